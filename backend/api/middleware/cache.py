@@ -0,0 +1,67 @@
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.http import HttpResponse
+from viewModule import cache, encoding
+
+
+def use_compressed(request, response, compressed):
+    """Swaps in the precompressed body the client accepts, if any."""
+    coding = encoding.content_coding(request, compressed)
+    if coding is not None:
+        response.content = compressed[coding]
+        response['Content-Encoding'] = coding
+    patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
+    return response
+
+
+class ResponseCacheMiddleware(MiddlewareMixin):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        params = getattr(view_func, 'cache_params', None)
+        backend = cache.backend()
+        if params is None or backend is None or request.method != 'GET':
+            return None
+
+        spec = cache.request_spec(request, params, view_func.cache_defaults)
+        if spec is None:
+            return None
+
+        request.cache_key = cache.cache_key(request, spec)
+        entry = backend.get(request.cache_key)
+        if entry is None:
+            return None
+
+        # serve the stored bytes as-is, without touching the ORM or the serializer
+        content_type, body, compressed = entry
+        response = use_compressed(request, HttpResponse(body, content_type=content_type), compressed)
+        response['X-Cache'] = 'HIT'
+        request.cache_key = None
+        return response
+
+    def process_response(self, request, response):
+        key = getattr(request, 'cache_key', None)
+        backend = cache.backend()
+        if key is None or backend is None or response.status_code != 200:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.store_when_complete(
+                backend, key, response['Content-Type'], response.streaming_content)
+        else:
+            compressed = cache.store(backend, key, response['Content-Type'], response.content)
+            use_compressed(request, response, compressed)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def store_when_complete(self, backend, key, content_type, chunks):
+        # pass the chunks through and keep a copy, given up as soon as it outgrows a cache entry
+        body, size = [], 0
+        for chunk in chunks:
+            if body is not None:
+                size += len(chunk)
+                if size > backend.max_entry_bytes:
+                    body = None
+                else:
+                    body.append(chunk)
+            yield chunk
+        if body is not None:
+            cache.store(backend, key, content_type, b''.join(body))
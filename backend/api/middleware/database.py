@@ -0,0 +1,31 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from django.db import InterfaceError, OperationalError
+from django.utils.deprecation import MiddlewareMixin
+from viewModule import routing
+
+
+class DatabaseMiddleware(MiddlewareMixin):
+    """Pins the reads of a request to one database, checks the idle persistent connections of this thread before
+    the request uses them, and runs a GET again, once, when a replica failed under it: the failed replica is out
+    of the rotation by then, so the second run reads from another one (or from 'default')."""
+
+    def process_request(self, request):
+        request.db_pin = routing.Pin()
+        routing.start(request.db_pin)
+        routing.check_connections()
+        request.replica_errors = routing.replica_errors()
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, (OperationalError, InterfaceError)) or request.method not in ('GET', 'HEAD'):
+            return None
+        match = getattr(request, 'resolver_match', None)
+        if match is None or getattr(request, 'replica_retried', False) \
+                or routing.replica_errors() == getattr(request, 'replica_errors', None):
+            return None
+
+        request.replica_retried = True
+        view = match.func
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        return view(request, *match.args, **match.kwargs)
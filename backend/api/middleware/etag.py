@@ -0,0 +1,49 @@
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_etags, quote_etag
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from viewModule import cache
+
+
+class ETagMiddleware(MiddlewareMixin):
+    """Conditional GET for the cacheable endpoints. The entity tag only depends on the dataset version and the
+    query spec of the request, so a matching If-None-Match is answered with 304 before the view (or the response
+    cache) runs, and Cache-Control lets browsers and a CDN keep the responses in between."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        params = getattr(view_func, 'cache_params', None)
+        if params is None or request.method not in ('GET', 'HEAD'):
+            return None
+
+        spec = cache.request_spec(request, params, view_func.cache_defaults)
+        if spec is None:
+            return None
+
+        request.etag = cache.etag(request, spec)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is None:
+            return None
+
+        # compressed representations carry a '-<coding>' suffix, any of them is still current
+        tags = parse_etags(if_none_match)
+        if '*' in tags or any(tag.strip('"').split('-')[:2] == request.etag.split('-') for tag in tags):
+            response = HttpResponseNotModified()
+            self.add_headers(response, request.etag)
+            return response
+        return None
+
+    def process_response(self, request, response):
+        tag = getattr(request, 'etag', None)
+        if tag is None or response.status_code != 200:
+            return response
+
+        coding = response.get('Content-Encoding')
+        self.add_headers(response, tag if coding is None else '{}-{}'.format(tag, coding))
+        return response
+
+    def add_headers(self, response, tag):
+        response['ETag'] = quote_etag(tag)
+        patch_cache_control(response, public=True, max_age=getattr(settings, 'HTTP_MAX_AGE', 60),
+                            s_maxage=getattr(settings, 'HTTP_SHARED_MAX_AGE', 3600))
+        patch_vary_headers(response, ['Accept', 'Accept-Encoding'])
@@ -0,0 +1,71 @@
+import json
+import logging
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from viewModule import metrics
+
+logger = logging.getLogger('api.metrics')
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    """Measures the SQL, serialization and size of every response, exposes them in a Server-Timing header and
+    a structured log line, and adds them to the per-route histograms served at /_metrics."""
+
+    def process_request(self, request):
+        request.stats = metrics.RequestStats()
+        metrics.start(request.stats)
+
+    def process_response(self, request, response):
+        stats = getattr(request, 'stats', None)
+        if stats is None:
+            return response
+
+        if response.streaming:
+            # the rows are read (and serialized) while the body is sent, so the totals come at the end
+            response['Server-Timing'] = self.server_timing(stats)
+            response.streaming_content = self.finish_when_sent(request, response, response.streaming_content)
+        else:
+            self.finish(request, response, len(response.content))
+            response['Server-Timing'] = self.server_timing(stats)
+        return response
+
+    def finish_when_sent(self, request, response, chunks):
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.finish(request, response, size)
+
+    def finish(self, request, response, size):
+        stats = request.stats
+        metrics.stop(stats)
+        elapsed = stats.elapsed()
+
+        match = getattr(request, 'resolver_match', None)
+        route = '/' + match.route if match is not None else 'unmatched'
+        metrics.observe(route, response.status_code, {
+            'vet_request_seconds': elapsed,
+            'vet_request_db_seconds': stats.db_seconds,
+            'vet_request_serialize_seconds': stats.serialize_seconds,
+            'vet_request_queries': stats.queries,
+            'vet_response_bytes': size,
+        })
+
+        record = {
+            'route': route, 'path': request.path, 'status': response.status_code,
+            'ms': round(elapsed * 1000, 3), 'queries': stats.queries, 'db_ms': round(stats.db_seconds * 1000, 3),
+            'serialize_ms': round(stats.serialize_seconds * 1000, 3), 'bytes': size,
+            'cache': response.get('X-Cache'),
+        }
+        if elapsed * 1000 >= getattr(settings, 'SLOW_REQUEST_MS', 1000):
+            record['query_string'] = request.META.get('QUERY_STRING', '')
+            record['sql'] = [{'ms': ms, 'sql': sql} for ms, sql in stats.sql]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+    def server_timing(self, stats):
+        return 'db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}, total;dur={:.2f}'.format(
+            stats.db_seconds * 1000, stats.queries, stats.serialize_seconds * 1000, stats.elapsed() * 1000)
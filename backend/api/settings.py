@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.metrics.InstrumentationMiddleware',
+    'api.middleware.database.DatabaseMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,7 +59,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'api.middleware.auth.AuthMiddleware'
+    'api.middleware.auth.AuthMiddleware',
+    'api.middleware.etag.ETagMiddleware',
+    'api.middleware.cache.ResponseCacheMiddleware'
 ]
 
 CORS_ORIGIN_ALLOW_ALL = True
@@ -93,10 +97,101 @@ DATABASES = {
         'USER': os.environ.get('DB_USER', 'postgres'),
         'PASSWORD': os.environ.get('DB_PASS', 'ubuntu'),
         'HOST': os.environ.get('DB_HOST', '127.0.0.1'),
-        'PORT': os.environ.get('DB_PORT', 5432)
+        'PORT': os.environ.get('DB_PORT', 5432),
+        # seconds a worker keeps its connections open between requests (0 reconnects for every request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Read replicas of 'default' as comma separated host[:port]; the API's reads of the TRI tables are spread over
+# them round-robin and move to another host (or 'default') when one fails, see viewModule/routing.py
+DATABASE_REPLICAS = []
+for n, replica in enumerate(r.strip() for r in os.environ.get('DB_REPLICAS', '').split(',') if r.strip()):
+    replica_host, _, replica_port = replica.partition(':')
+    DATABASES['replica{}'.format(n + 1)] = dict(DATABASES['default'], HOST=replica_host,
+                                                PORT=replica_port or DATABASES['default']['PORT'],
+                                                TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica{}'.format(n + 1))
+DATABASE_ROUTERS = ['viewModule.routing.ReplicaRouter']
+# Seconds an open connection may sit idle before it is checked again, and a failed replica is left out
+DB_HEALTH_CHECK_INTERVAL = int(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 10))
+DB_REPLICA_RETRY_SECONDS = int(os.environ.get('DB_REPLICA_RETRY_SECONDS', 30))
+
+# Answer the stats endpoints from the precomputed rollups when they can (see 'manage.py build_rollups')
+USE_ROLLUPS = os.environ.get('USE_ROLLUPS', 'true').lower() == 'true'
+
+# Response cache: 'local' (per-process LRU), 'shared' (the 'responses' cache below) or 'none'
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'local')
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# larger responses are not cached (memcached needs '-I' raised to store entries over 1MB)
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+RESPONSE_CACHE_ALIAS = 'responses'
+
+# Cache warm-up ('manage.py warm_cache'): requests rendered in parallel and how many of them may query the
+# database at once; with CACHE_WARM_INTERVAL > 0 each server process warms its own cache from a background
+# thread, checking every CACHE_WARM_INTERVAL seconds whether the dataset version changed
+CACHE_WARM_WORKERS = int(os.environ.get('CACHE_WARM_WORKERS', 2))
+CACHE_WARM_DB_LIMIT = int(os.environ.get('CACHE_WARM_DB_LIMIT', 2))
+CACHE_WARM_INTERVAL = int(os.environ.get('CACHE_WARM_INTERVAL', 0))
+
+# Seconds a worker trusts its copy of the dataset version before re-reading it
+DATASET_VERSION_TTL = int(os.environ.get('DATASET_VERSION_TTL', 5))
+
+# Cache-Control max-age for browsers and s-maxage for shared caches (a CDN) on the cacheable endpoints;
+# both revalidate with the ETag, which changes with the dataset version
+HTTP_MAX_AGE = int(os.environ.get('HTTP_MAX_AGE', 60))
+HTTP_SHARED_MAX_AGE = int(os.environ.get('HTTP_SHARED_MAX_AGE', 3600))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if RESPONSE_CACHE == 'shared':
+    # shared by all workers (the default memcached backend requires python-memcached)
+    CACHES[RESPONSE_CACHE_ALIAS] = {
+        'BACKEND': os.environ.get('RESPONSE_CACHE_SHARED_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache'),
+        'LOCATION': os.environ.get('RESPONSE_CACHE_SHARED_LOCATION', '127.0.0.1:11211'),
+        'TIMEOUT': None,
+    }
+
+# Threads available to run the independent queries of one request (e.g. dashboard panels, the summary
+# aggregates) concurrently; under ASGI the async views await them without blocking the event loop
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 4))
+
+# Stream large list responses from a server-side cursor instead of building them in memory
+STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', 'true').lower() == 'true'
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 2000))
+
+# Requests slower than this (in milliseconds) are logged with their SQL; every request is logged as one JSON
+# line by the 'api.metrics' logger at INFO (REQUEST_LOG_LEVEL=INFO to see them)
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Below this map zoom level /facilities/bbox returns clusters instead of individual facilities
+FACILITY_CLUSTER_ZOOM = int(os.environ.get('FACILITY_CLUSTER_ZOOM', 9))
+
+# Backend of the release aggregates: 'orm' or 'columnar' (numpy arrays memory-mapped from a snapshot written by
+# 'manage.py build_columnar_snapshot'; falls back to the ORM while no snapshot of the current dataset exists)
+ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'orm')
+COLUMNAR_SNAPSHOT_DIR = os.environ.get('COLUMNAR_SNAPSHOT_DIR', str(BASE_DIR / 'snapshots' / 'releases'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
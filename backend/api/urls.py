@@ -5,7 +5,9 @@ from viewModule.views import get_facilities, get_chemicals, state_total_releases
     location_summary, top_facility_releases, timeline_top_facility_releases, \
     timeline_top_pbt_chemicals, all_state_total_releases, \
     all_county_total_releases, \
-    get_chemicals_in_window, country_summary, health_check, homepoint
+    get_chemicals_in_window, country_summary, health_check, homepoint, location_dashboard, \
+    timeline_top_county_releases, get_facilities_in_bbox, metrics_view, location_compare, \
+    search_suggest
 
 
 ''' This list acts as a controller for the API endpoints while path() marks an element for inclusion'''
@@ -13,20 +15,30 @@ from viewModule.views import get_facilities, get_chemicals, state_total_releases
 
 urlpatterns = [
     path('_health', health_check),
+    # per-route request histograms for a Prometheus scraper
+    path('_metrics', metrics_view),
     # root page for API
     path('', homepoint),
     # admin page for backend
     path('admin/', admin.site.urls),
     # return distinct facilities for a state and requested specs.
     path('facilities', get_facilities),
+    # return the facilities (or clusters of them at low zoom) inside a map viewport
+    path('facilities/bbox', get_facilities_in_bbox),
     # return distinct facilities for a state and year
     path('chemicals', get_chemicals_in_window),
+    # return type-ahead suggestions of chemical, facility and parent company names
+    path('search/suggest', search_suggest),
     # return all chemical releases for a specific facility
     path('facilities/<str:facility_id>/chemicals', get_chemicals),
     # return summary for a state and year
     path('stats/location/summary', location_summary),
     # return summary for each county for a state and year
     path('stats/summary', country_summary),
+    # return several of the location stats below for one filter set in a single response
+    path('stats/location/dashboard', location_dashboard),
+    # return the change of the releases of each facility, chemical, parent company or county between two years
+    path('stats/location/compare', location_compare),
     # return amount of each chemical for a state and year
     path('stats/location/top_chemicals', top_chemicals),
     # return top ten polluting facilities for a state and year
@@ -43,6 +55,8 @@ urlpatterns = [
     path('stats/location/timeline/facility_releases', timeline_top_facility_releases),
     # return top ten polluting parent companies over time for a state and year
     path('stats/location/timeline/parent_releases', timeline_top_parentco_releases),
+    # return top ten releasing counties over time for a location
+    path('stats/location/timeline/county_releases', timeline_top_county_releases),
     # return total amount stats released for a state
     path('stats/state/summary', state_total_releases),
     # return release all states, individually
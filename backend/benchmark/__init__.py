@@ -0,0 +1,4 @@
+# Benchmark suite for the API
+# 'python -m benchmark generate' fills the configured database with a seeded synthetic TRI dataset,
+# 'python -m benchmark run' requests every route with a realistic parameter mix and writes latency percentiles,
+# throughput, query counts and peak memory as JSON, and 'python -m benchmark compare' diffs two such reports.
@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Synthetic data and load tests.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='Fill the database with a synthetic TRI dataset.')
+    generate.add_argument('--facilities', type=int, default=20000)
+    generate.add_argument('--chemicals', type=int, default=700)
+    generate.add_argument('--releases', type=int, default=3000000)
+    generate.add_argument('--years', default='2010-2019', help='First and last year, e.g. 2010-2019.')
+    generate.add_argument('--seed', type=int, default=1)
+    generate.add_argument('--replace', action='store_true', help='Delete the existing TRI rows first.')
+    generate.add_argument('--skip-rollups', action='store_true', help='Do not build the release rollups.')
+
+    run = commands.add_parser('run', help='Request every route and report latency, throughput and queries.')
+    run.add_argument('--requests', type=int, default=50, help='Measured requests per route.')
+    run.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route.')
+    run.add_argument('--concurrency', type=int, default=1, help='Clients sending requests at the same time.')
+    run.add_argument('--seed', type=int, default=1)
+    run.add_argument('--routes', help='Comma separated substrings; only matching routes are run.')
+    run.add_argument('--response-cache', default='none', choices=['none', 'local'],
+                     help='RESPONSE_CACHE while running in-process (default: measure uncached work).')
+    run.add_argument('--base-url', help='Benchmark a running server instead of the in-process application.')
+    run.add_argument('--out', help='Write the JSON report here instead of stdout.')
+
+    compare = commands.add_parser('compare', help='Compare two reports written by run.')
+    compare.add_argument('base')
+    compare.add_argument('head')
+    compare.add_argument('--metric', default='p95_ms', help='Latency field compared (p50_ms, p95_ms, p99_ms).')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='Relative slowdown reported as a regression (0.1 = 10%%).')
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        from benchmark.compare import compare as compare_reports
+        with open(args.base) as base, open(args.head) as head:
+            lines, regressions = compare_reports(json.load(base), json.load(head), args.metric, args.threshold)
+        print('\n'.join(lines))
+        sys.exit(1 if regressions else 0)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
+    import django
+    django.setup()
+
+    if args.command == 'generate':
+        from benchmark.generate import generate as generate_dataset
+        first, last = (int(y) for y in args.years.split('-'))
+        counts = generate_dataset(args.facilities, args.chemicals, args.releases, range(first, last + 1),
+                                  seed=args.seed, replace=args.replace, with_rollups=not args.skip_rollups,
+                                  log=lambda message: print(message, file=sys.stderr))
+        print(json.dumps(counts))
+    else:
+        from benchmark.run import run as run_benchmark
+        report = run_benchmark(requests=args.requests, warmup=args.warmup, concurrency=args.concurrency,
+                               seed=args.seed, routes=args.routes.split(',') if args.routes else None,
+                               response_cache=args.response_cache, base_url=args.base_url,
+                               log=lambda message: print(message, file=sys.stderr))
+        output = json.dumps(report, indent=2)
+        if args.out:
+            with open(args.out, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+
+
+if __name__ == '__main__':
+    main()
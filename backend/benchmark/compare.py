@@ -0,0 +1,22 @@
+# Route by route comparison of two reports written by "python -m benchmark run"
+# Kept free of Django imports so reports can be compared without a configured database.
+
+
+def compare(base, head, metric='p95_ms', threshold=0.1):
+    """Returns (report lines, regressed routes) comparing 'metric' of two reports route by route."""
+    lines = ['{:<45} {:>10} {:>10} {:>8}'.format('route', 'base', 'head', 'change')]
+    regressions = []
+    for route in sorted(set(base['routes']) | set(head['routes'])):
+        a = base['routes'].get(route, {}).get(metric)
+        b = head['routes'].get(route, {}).get(metric)
+        if a is None or b is None:
+            lines.append('{:<45} {:>10} {:>10} {:>8}'.format(route, str(a), str(b), 'n/a'))
+            continue
+        change = (b - a) / a if a else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(route)
+            flag = ' REGRESSION'
+        lines.append('{:<45} {:>10.3f} {:>10.3f} {:>+7.1%}{}'.format(route, a, b, change, flag))
+    lines.append('{} route(s) slower by more than {:.0%} on {}'.format(len(regressions), threshold, metric))
+    return lines, regressions
@@ -0,0 +1,133 @@
+# Seeded synthetic TRI dataset
+# Volumes and shapes follow the real data: a few industrial states hold most facilities (Zipf-like weights),
+# chemical popularity is skewed, most release measures are zero and the non-zero ones are log-normal.
+# The same arguments and seed always produce the same rows, on PostgreSQL (loaded with COPY) or SQLite.
+import math
+import random
+from django.db import connection, transaction
+from viewModule.models import Facility, Chemical, Release, ReleaseRollup, FacilityCountRollup, DistinctSketch, \
+    ParentCompany, Location
+from viewModule import dataset, ingest, rollups, spatial, parents, locations
+
+# ordered by facility count in the real data, so the Zipf weights put the big states first
+STATES = ['TX', 'OH', 'CA', 'PA', 'IL', 'IN', 'LA', 'MI', 'GA', 'NC', 'WI', 'NY', 'AL', 'TN', 'KY', 'SC',
+          'MO', 'IA', 'MN', 'VA', 'FL', 'NJ', 'AR', 'MS', 'WA', 'OK', 'KS', 'OR', 'UT', 'CO', 'NE', 'AZ', 'WV',
+          'CT', 'MA', 'ID', 'NV', 'MD', 'PR', 'ND', 'NM', 'MT', 'ME', 'WY', 'SD', 'NH', 'DE', 'AK', 'VT', 'HI',
+          'RI', 'DC']
+CHEMICAL_NAMES = ['LEAD', 'MERCURY', 'BENZENE', 'TOLUENE', 'XYLENE (MIXED ISOMERS)', 'AMMONIA', 'METHANOL',
+                  'ZINC COMPOUNDS', 'MANGANESE COMPOUNDS', 'NITRATE COMPOUNDS', 'HYDROCHLORIC ACID',
+                  'SULFURIC ACID', 'ETHYLENE', 'STYRENE', 'N-HEXANE', 'FORMALDEHYDE', 'CHROMIUM COMPOUNDS',
+                  'NICKEL COMPOUNDS', 'COPPER COMPOUNDS', 'BARIUM COMPOUNDS', 'ARSENIC COMPOUNDS', 'ACETALDEHYDE',
+                  'CHLORINE', 'HYDROGEN FLUORIDE', 'POLYCYCLIC AROMATIC COMPOUNDS', 'VANADIUM COMPOUNDS',
+                  'ETHYLBENZENE', 'NAPHTHALENE', '1,3-BUTADIENE', 'CYCLOHEXANE']
+DIOXIN = 'DIOXIN AND DIOXIN-LIKE COMPOUNDS'
+SECTORS = ['Chemicals', 'Primary Metals', 'Fabricated Metals', 'Petroleum', 'Plastics and Rubber', 'Food',
+           'Electric Utilities', 'Paper', 'Hazardous Waste', 'Metal Mining', 'Transportation Equipment']
+
+
+def zipf_weights(n, exponent=1.1):
+    return [1 / (i + 1) ** exponent for i in range(n)]
+
+
+def _insert(model, fields, rows):
+    """Inserts 'rows' (tuples in the order of 'fields') into the table of 'model'."""
+    return ingest.copy_rows(model._meta.db_table, [model._meta.get_field(f).column for f in fields], rows)
+
+
+def _facilities(rng, n):
+    weights = zipf_weights(len(STATES))
+    parents = ['PARENT CO {:04d}'.format(i) for i in range(max(1, n // 10))]
+    parent_weights = zipf_weights(len(parents), 0.9)
+    # a centre per state and a few counties/cities around it, larger states getting more of them
+    geo = {}
+    for i, state in enumerate(STATES):
+        counties = max(3, int(80 * weights[i] ** 0.5))
+        geo[state] = (rng.uniform(26, 48), rng.uniform(-123, -70),
+                      [('{} COUNTY {:02d}'.format(state, c), ['{} CITY {:02d}-{:02d}'.format(state, c, k)
+                                                              for k in range(rng.randint(1, 8))])
+                       for c in range(counties)])
+
+    for n_facility in range(n):
+        state = rng.choices(STATES, weights)[0]
+        lat, lon, counties = geo[state]
+        county, cities = counties[min(int(rng.expovariate(4 / len(counties))), len(counties) - 1)]
+        latitude = round(min(max(rng.gauss(lat, 1.2), -89.9), 89.9), 6)
+        longitude = round(rng.gauss(lon, 1.5), 6)
+        parent = None if rng.random() < 0.15 else rng.choices(parents, parent_weights)[0]
+        yield ('BM{:013d}'.format(n_facility), 'FACILITY {:05d}'.format(n_facility),
+               '{} MAIN ST'.format(rng.randint(1, 9999)), rng.choice(cities), county, state,
+               rng.randint(10000, 99999), latitude, longitude, parent, rng.choice(SECTORS),
+               spatial.cell(latitude, longitude))
+
+
+def _chemicals(rng, n):
+    for i in range(n):
+        if i == 0:
+            yield ('BC{:05d}'.format(i), DIOXIN, 'YES', 'Dioxin', None, 'YES', 'Grams')
+            continue
+        name = CHEMICAL_NAMES[i - 1] if i - 1 < len(CHEMICAL_NAMES) else 'CHEMICAL {:03d} COMPOUNDS'.format(i)
+        yield ('BC{:05d}'.format(i), name, 'YES' if rng.random() < 0.3 else 'NO',
+               'PBT' if rng.random() < 0.03 else 'TRI', rng.randint(1, 9) if rng.random() < 0.1 else None,
+               'YES' if rng.random() < 0.2 else 'NO', 'Pounds')
+
+
+def _measure(rng, zero_share, scale):
+    return 0.0 if rng.random() < zero_share else round(rng.lognormvariate(math.log(scale), 2.0), 3)
+
+
+def _releases(rng, facilities, chemicals, years, n):
+    chemical_weights = zipf_weights(len(chemicals), 0.8)
+    active = 0.85
+    per_report = max(1.0, n / (len(facilities) * len(years) * active))
+    number = 0
+    for year in years:
+        for facility in facilities:
+            if rng.random() > active:
+                continue
+            count = min(len(chemicals), max(1, round(rng.expovariate(1 / per_report))))
+            for chemical in dict.fromkeys(rng.choices(chemicals, chemical_weights, k=count)):
+                air = None if rng.random() < 0.01 else _measure(rng, 0.4, 500)
+                water, land = _measure(rng, 0.7, 50), _measure(rng, 0.6, 200)
+                off_site = _measure(rng, 0.5, 300)
+                on_site = round((air or 0) + water + land, 3)
+                yield ('BR{}{:010d}'.format(year, number), year, facility, chemical, air, water, land, on_site,
+                       off_site, round(on_site + off_site, 3))
+                number += 1
+
+
+def generate(facilities=20000, chemicals=700, releases=3000000, years=range(2010, 2020), seed=1, replace=False,
+             with_rollups=True, log=print):
+    """Writes the synthetic dataset and returns the number of rows per table."""
+    rng = random.Random(seed)
+    if Release.objects.exists() or Facility.objects.exists():
+        if not replace:
+            raise SystemExit('The database already holds TRI data, pass --replace to delete it first')
+        log('Deleting the existing data')
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (ReleaseRollup, FacilityCountRollup, DistinctSketch, Release, Facility, ParentCompany,
+                          Location, Chemical):
+                cursor.execute('DELETE FROM {}'.format(connection.ops.quote_name(model._meta.db_table)))
+
+    with transaction.atomic():
+        counts = {'facilities': _insert(Facility, [
+            'id', 'name', 'street_address', 'city', 'county', 'state', 'zip', 'latitude', 'longitude',
+            'parent_co_name', 'industry_sector', 'grid_cell'], _facilities(rng, facilities))}
+        log('{facilities} facilities of {} parent companies in {} locations'.format(
+            parents.link(Facility, ParentCompany), locations.link(Facility, Location), **counts))
+        counts['chemicals'] = _insert(Chemical, [
+            'id', 'name', 'carcinogen', 'classification', 'metal_category', 'clean_air_act_chemical',
+            'unit_of_measure'], _chemicals(rng, chemicals))
+        log('{chemicals} chemicals'.format(**counts))
+        facility_ids = list(Facility.objects.order_by('id').values_list('id', flat=True))
+        chemical_ids = list(Chemical.objects.order_by('id').values_list('id', flat=True))
+        counts['releases'] = _insert(Release, [
+            'doc_ctrl_num', 'year', 'facility', 'chemical', 'air', 'water', 'land', 'on_site', 'off_site',
+            'total'], _releases(rng, facility_ids, chemical_ids, list(years), releases))
+        log('{releases} releases'.format(**counts))
+
+    if with_rollups:
+        for year in years:
+            rollups.build(year)
+        log('Built the rollups')
+    dataset.bump()
+    return counts
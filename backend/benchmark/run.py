@@ -0,0 +1,251 @@
+# Load test over every route of api/urls.py
+# Parameters are drawn (seeded) from the loaded data with a realistic mix: states weighted by their number of
+# facilities, sometimes narrowed to a county or city, with the optional filters each view reads. Requests go
+# through the in-process application (django.test.Client) or to a running server (--base-url); query counts
+# come from the Server-Timing header, so both report the same fields.
+import base64
+import datetime
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import get_resolver
+from viewModule.models import Facility, Chemical, Release
+from viewModule import cache, timelines
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# routes that are not part of the API
+SKIPPED = ('admin/',)
+RELEASE_TYPES = ['air', 'water', 'land', 'on_site', 'off_site']
+ZOOMS = [4, 6, 8, 10, 12, 14]
+
+
+class Sampler:
+    """Draws request parameters from the loaded dataset."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        states = list(Facility.objects.exclude(state=None).values('state').annotate(n=Count('id')).order_by('state'))
+        if not states:
+            raise SystemExit('The database holds no facilities, run "python -m benchmark generate" first')
+        self.states = [s['state'] for s in states]
+        self.state_weights = [s['n'] for s in states]
+        self.places = {}
+        for state, county, city in Facility.objects.exclude(county=None).values_list(
+                'state', 'county', 'city').distinct():
+            self.places.setdefault(state, {}).setdefault(county, set()).add(city)
+        self.places = {state: {county: sorted(c for c in cities if c) for county, cities in counties.items()}
+                       for state, counties in self.places.items()}
+        self.years = sorted(y for y in Release.objects.values_list('year', flat=True).distinct() if y is not None)
+        facilities = list(Facility.objects.exclude(latitude=None).exclude(longitude=None).order_by(
+            'id').values_list('id', 'latitude', 'longitude'))
+        self.facilities = rng.sample(facilities, min(len(facilities), 500))
+        self.searches = sorted(set(name.split()[0].lower()[:5] for name in Chemical.objects.exclude(
+            name=None).order_by('id').values_list('name', flat=True)[:200]))
+        self.panels = ['summary', 'top_chemicals', 'facility_releases', 'timeline_total', 'timeline_top_chemicals']
+
+    def params(self, reads):
+        """Returns a parameter mix restricted to the names the view reads."""
+        rng = self.rng
+        state = rng.choices(self.states, self.state_weights)[0]
+        params = {'state': state}
+        counties = self.places.get(state)
+        if counties and rng.random() < 0.3:
+            county = rng.choice(sorted(counties))
+            params['county'] = county
+            if counties[county] and rng.random() < 0.3:
+                params['city'] = rng.choice(counties[county])
+        if self.years and rng.random() < 0.7:
+            params['year'] = rng.choice(self.years)
+        for name, share in (('carcinogen', 0.15), ('pbt', 0.1), ('all', 0.1)):
+            if rng.random() < share:
+                params[name] = 'true'
+        if self.searches and rng.random() < 0.1:
+            params['chemical'] = rng.choice(self.searches)
+        if rng.random() < 0.15:
+            params['release_type'] = rng.choice(RELEASE_TYPES)
+        if rng.random() < 0.2:
+            params['limit'] = rng.choice([5, timelines.DEFAULT_LIMIT, 25])
+        if rng.random() < 0.3:
+            params['panels'] = ','.join(rng.sample(self.panels, rng.randint(1, len(self.panels))))
+        if 'west' in reads and self.facilities:
+            _, lat, lon = rng.choice(self.facilities)
+            zoom = rng.choice(ZOOMS)
+            # a 1024x768 viewport at this zoom level
+            width, height = 360 * 4 / 2 ** zoom, 180 * 3 / 2 ** zoom
+            params.update({'west': round(lon - width / 2, 4), 'east': round(lon + width / 2, 4),
+                           'south': round(max(lat - height / 2, -90), 4),
+                           'north': round(min(lat + height / 2, 90), 4), 'zoom': zoom})
+        return {k: v for k, v in params.items() if k in reads}
+
+    def kwargs(self, converters):
+        return {name: self.rng.choice(self.facilities)[0] for name in converters}
+
+
+def api_routes(only=None):
+    """Yields (label, view, path template converters) for every API route."""
+    for pattern in get_resolver().url_patterns:
+        label = '/' + str(pattern.pattern)
+        if str(pattern.pattern).startswith(SKIPPED) or not hasattr(pattern, 'callback'):
+            continue
+        if only and not any(part in label for part in only):
+            continue
+        yield label, pattern
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of sorted 'values'."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+def _queries(server_timing):
+    if 'queries"' not in server_timing:
+        return None
+    return int(server_timing.split('desc="')[1].split()[0])
+
+
+class Fetcher:
+    """Sends GET requests and returns (status, body bytes, query count)."""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.local = threading.local()
+        key = os.environ.get('API_KEY')
+        self.headers = {} if key is None else {'Authorization': base64.b64encode(key.encode()).decode()}
+
+    def __call__(self, path, params):
+        if self.base_url is not None:
+            url = self.base_url.rstrip('/') + path + ('?' + urllib.parse.urlencode(params) if params else '')
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=self.headers)) as response:
+                    body = response.read()
+                    return response.status, len(body), _queries(response.headers.get('Server-Timing', ''))
+            except urllib.error.HTTPError as error:
+                return error.code, len(error.read()), _queries(error.headers.get('Server-Timing', ''))
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(**{'HTTP_' + k.upper(): v for k, v in self.headers.items()})
+        response = client.get(path, params)
+        size = len(b''.join(response.streaming_content) if response.streaming else response.content)
+        # the header of a streamed response is sent before its rows are read, the request's stats are final
+        stats = getattr(response.wsgi_request, 'stats', None)
+        return response.status_code, size, _queries(response.get('Server-Timing', '')) if stats is None \
+            else stats.queries
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _summary(samples, wall):
+    latencies = sorted(s[0] * 1000 for s in samples)
+    queries = [s[3] for s in samples if s[3] is not None]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+    return {
+        'requests': len(samples),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(latencies[-1], 3),
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+        'mean_bytes': round(sum(s[2] for s in samples) / len(samples)),
+        'statuses': statuses,
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(requests=50, warmup=5, concurrency=1, seed=1, routes=None, response_cache='none', base_url=None,
+        log=print):
+    """Runs the benchmark and returns the report (see README.md for its fields)."""
+    rng = random.Random(seed)
+    sampler = Sampler(rng)
+    fetch = Fetcher(base_url)
+    report = {
+        'meta': {
+            'commit': _commit(),
+            'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'target': base_url or 'in-process',
+            'database': connection.vendor,
+            'rows': {'facilities': Facility.objects.count(), 'chemicals': Chemical.objects.count(),
+                     'releases': Release.objects.count()},
+            'requests_per_route': requests, 'warmup': warmup, 'concurrency': concurrency, 'seed': seed,
+            'settings': {name: getattr(settings, name, None) for name in (
+                'USE_ROLLUPS', 'ANALYTICS_BACKEND', 'STREAM_RESPONSES', 'QUERY_WORKERS')},
+        },
+        'routes': {},
+    }
+    report['meta']['settings']['RESPONSE_CACHE'] = response_cache if base_url is None else None
+
+    everything = []
+    started = time.perf_counter()
+    with override_settings(RESPONSE_CACHE=response_cache):
+        cache.clear()
+        for label, pattern in api_routes(routes):
+            reads = getattr(pattern.callback, 'cache_params', ())
+            jobs = [('/' + _fill(str(pattern.pattern), sampler.kwargs(pattern.pattern.converters)),
+                     sampler.params(reads)) for _ in range(warmup + requests)]
+            for path, params in jobs[:warmup]:
+                fetch(path, params)
+
+            def measure(job):
+                start = time.perf_counter()
+                status, size, queries = fetch(*job)
+                return time.perf_counter() - start, status, size, queries
+
+            route_started = time.perf_counter()
+            if concurrency > 1:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    samples = list(pool.map(measure, jobs[warmup:]))
+            else:
+                samples = [measure(job) for job in jobs[warmup:]]
+            wall = time.perf_counter() - route_started
+
+            report['routes'][label] = _summary(samples, wall)
+            report['routes'][label]['peak_rss_mb'] = _peak_rss_mb()
+            everything.extend(samples)
+            log('{}: p50 {p50_ms} ms, p95 {p95_ms} ms, {mean_queries} queries'.format(label, **report['routes'][label]))
+        cache.clear()
+
+    report['total'] = _summary(everything, time.perf_counter() - started)
+    report['total']['peak_rss_mb'] = _peak_rss_mb()
+    return report
+
+
+def _fill(route, kwargs):
+    for name, value in kwargs.items():
+        route = route.replace('<str:{}>'.format(name), urllib.parse.quote(value)).replace(
+            '<{}>'.format(name), urllib.parse.quote(value))
+    return route
@@ -0,0 +1,31 @@
+# gunicorn settings for deployments, read from the environment
+#   gunicorn -c gunicorn.conf.py api.asgi:application                    (ASGI, uvicorn workers; the default)
+#   SERVER_MODE=wsgi gunicorn -c gunicorn.conf.py api.wsgi:application   (threaded WSGI workers)
+# Each worker process holds its own query pool of QUERY_WORKERS threads, and so up to
+# WEB_WORKERS * (QUERY_WORKERS + 1) database connections; size max_connections accordingly.
+import multiprocessing
+import os
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'asgi')
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'uvicorn.workers.UvicornWorker' if SERVER_MODE == 'asgi' else 'gthread'
+# request threads of a WSGI worker (uvicorn workers serve their requests from one event loop)
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# recycle workers now and then so a leak can't grow forever
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+# the application is imported once and forked, sharing the memory of the loaded modules
+preload_app = os.environ.get('WEB_PRELOAD', 'true').lower() == 'true'
+accesslog = os.environ.get('WEB_ACCESS_LOG')
+
+
+def post_worker_init(worker):
+    # each worker keeps its response cache warm when CACHE_WARM_INTERVAL is set
+    from viewModule import warmup, suggest
+    warmup.start_refresher()
+    # load the type-ahead names before the first keystroke asks for them
+    suggest.index()
@@ -0,0 +1,169 @@
+# Response cache for the read-only API endpoints
+# Every endpoint is a pure function of its query parameters and the dataset, so the serialized response is
+# stored under a key built from the dataset version, the path and the query spec of the request (filters.py).
+# Views opt in with @cacheable(...); api.middleware.cache.ResponseCacheMiddleware serves and fills the cache.
+# An entry is (content type, body, {content coding: compressed body}), one per negotiated media type.
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponseBadRequest
+from viewModule import dataset, encoding, filters
+
+
+def _digest(request, spec):
+    raw = '{}?{}#{}'.format(request.path, spec.key(), encoding.negotiate(request))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def cache_key(request, spec):
+    return 'vet:response:{}:{}'.format(dataset.current_version(), _digest(request, spec))
+
+
+def etag(request, spec):
+    """Returns the (unquoted) entity tag of the response: it only changes with the dataset or the parameters."""
+    return 'v{}-{}'.format(dataset.current_version(), _digest(request, spec)[:20])
+
+
+def request_spec(request, params, defaults=None):
+    """Returns the QuerySpec of the request, compiled once per request, or None when a parameter is malformed."""
+    if not hasattr(request, 'spec'):
+        try:
+            request.spec = filters.compile_request(request, params, defaults)
+        except ValueError:
+            request.spec = None
+    return request.spec
+
+
+''' Declares the query parameters a view reads: the view finds them compiled in request.spec (a malformed one
+is a bad request), and its responses are cached on them; any other parameter is ignored in the key.'''
+
+
+def cacheable(*params, defaults=None):
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request_spec(request, params, defaults) is None:
+                    return HttpResponseBadRequest()
+                return await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request_spec(request, params, defaults) is None:
+                    return HttpResponseBadRequest()
+                return view(request, *args, **kwargs)
+        wrapper.cache_params = params
+        wrapper.cache_defaults = defaults
+        return wrapper
+    return decorator
+
+
+def store(backend, key, content_type, body):
+    """Stores a response body with its precompressed variants and returns them ({content coding: body})."""
+    compressed = encoding.precompress(body)
+    backend.set(key, (content_type, body, compressed))
+    return compressed
+
+
+def entry_size(entry):
+    return len(entry[1]) + sum(len(body) for body in entry[2].values())
+
+
+class LocalCache:
+    """In-process LRU cache bounded by entry count and total body size."""
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        size = entry_size(entry)
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= entry_size(old)
+            self._entries[key] = entry
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= entry_size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SharedCache:
+    """Cache shared between workers through one of Django's CACHES (memcached evicts by LRU on its own)."""
+
+    def __init__(self, alias, max_entry_bytes=8 * 1024 * 1024):
+        self.alias = alias
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = caches[self.alias].get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry):
+        if entry_size(entry) <= self.max_entry_bytes:
+            caches[self.alias].set(key, entry, None)
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+_backend = None
+
+
+def backend():
+    """Returns the configured cache backend, or None when RESPONSE_CACHE is 'none'."""
+    global _backend
+    if _backend is None:
+        kind = getattr(settings, 'RESPONSE_CACHE', 'local')
+        if kind == 'local':
+            _backend = LocalCache(getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 1024),
+                                  getattr(settings, 'RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+                                  getattr(settings, 'RESPONSE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+        elif kind == 'shared':
+            _backend = SharedCache(getattr(settings, 'RESPONSE_CACHE_ALIAS', 'responses'),
+                                   getattr(settings, 'RESPONSE_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+        else:
+            return None
+    return _backend
+
+
+def clear():
+    """Drops every cached response of this process and resets the backend (used by tests and reloads)."""
+    global _backend
+    if _backend is not None:
+        _backend.clear()
+    _backend = None
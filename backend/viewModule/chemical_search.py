@@ -0,0 +1,68 @@
+# Resolves the 'chemical' search parameter to compound ids
+# The chemicals table is small, so the names are kept in memory (per dataset version) and the substring match
+# happens here once per search; release queries then filter on the indexed 'compound_id' column instead of an
+# ILIKE '%...%' through the join with 'chemicals'.
+import threading
+from collections import OrderedDict
+from django.db.models import Q
+from viewModule.models import Chemical as chemical
+from viewModule import dataset
+
+# searches remembered per index
+MAX_SEARCHES = 512
+
+_index = None
+_lock = threading.Lock()
+
+
+class ChemicalIndex:
+    """Upper-cased chemical names of one dataset version, with the ids matching recent searches."""
+
+    def __init__(self, version, names):
+        self.version = version
+        self.names = [(name.upper(), compound_id) for compound_id, name in names if name is not None]
+        self.searches = OrderedDict()
+
+    def matching_ids(self, search):
+        # same match as icontains: UPPER(name) LIKE UPPER('%search%')
+        needle = search.upper()
+        with _lock:
+            ids = self.searches.get(needle)
+            if ids is not None:
+                self.searches.move_to_end(needle)
+                return ids
+
+        ids = frozenset(compound_id for name, compound_id in self.names if needle in name)
+        with _lock:
+            self.searches[needle] = ids
+            if len(self.searches) > MAX_SEARCHES:
+                self.searches.popitem(last=False)
+        return ids
+
+
+def index():
+    """Returns the index of the current dataset version, loading it on first use and after a reload."""
+    global _index
+    version = dataset.current_version()
+    current = _index
+    if current is None or current.version != version:
+        current = ChemicalIndex(version, chemical.objects.values_list('id', 'name'))
+        _index = current
+    return current
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def matching_ids(search):
+    return index().matching_ids(search)
+
+
+''' Returns a Q object matching the chemicals whose name contains 'search' (case-insensitive) through 'field',
+the path to the chemical from the queried model ('chemical' from releases, 'id' from chemicals).'''
+
+
+def chemical_filter(search, field='chemical'):
+    return Q(**{field + '__in': matching_ids(search)})
@@ -0,0 +1,304 @@
+# Optional in-memory columnar engine for the release aggregates (requires numpy)
+# 'manage.py build_columnar_snapshot' writes the releases, with their facility and chemical attributes
+# dictionary-encoded, as one .npy file per column. Workers memory-map those files, so forked processes share
+# the same pages, and answer the Sum/Count group-bys of the stats views with masked numpy reductions.
+# Enabled with ANALYTICS_BACKEND = 'columnar'; the views fall back to the ORM whenever no snapshot of the
+# current dataset version is available.
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from django.conf import settings
+from viewModule.models import Release as release
+from viewModule.models import Facility as facility
+from viewModule.models import Chemical as chemical
+from viewModule import dataset, chemical_search
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+MEASURES = ['air', 'water', 'land', 'on_site', 'off_site', 'total']
+# column -> numpy type of its .npy file
+COLUMN_TYPES = {'year': 'int32', 'facility': 'int32', 'chemical': 'int32', **dict.fromkeys(MEASURES, 'float64'),
+                'state': 'int32', 'county': 'int32', 'city': 'int32', 'carcinogen': 'bool', 'pbt': 'bool'}
+
+_snapshot = None
+_checked_version = None
+_lock = threading.Lock()
+
+
+def _encode(values, dictionary, lookup):
+    codes = []
+    for value in values:
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(dictionary)
+            dictionary.append(value)
+        codes.append(code)
+    return codes
+
+
+def build(directory):
+    """Writes a snapshot of the releases of the current dataset version to 'directory'."""
+    facilities = list(facility.objects.order_by('id').values_list('id', 'state', 'county', 'city'))
+    chemicals = list(chemical.objects.order_by('id').values_list('id', 'name', 'carcinogen', 'classification'))
+    facility_codes = {row[0]: i for i, row in enumerate(facilities)}
+    chemical_codes = {row[0]: i for i, row in enumerate(chemicals)}
+
+    dims = {'state': [], 'county': [], 'city': []}
+    lookups = {name: {} for name in dims}
+    facility_geo = {name: np.array(_encode((row[i] for row in facilities), dims[name], lookups[name]), dtype=np.int32)
+                    for i, name in enumerate(['state', 'county', 'city'], start=1)}
+
+    carcinogen = np.array([row[2] == 'YES' for row in chemicals], dtype=bool)
+    pbt = np.array([row[3] == 'PBT' for row in chemicals], dtype=bool)
+
+    # write next to the target and swap directories, so running workers never see a partial snapshot
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent)
+
+    # the releases are streamed into the memory-mapped columns chunk by chunk, so the build holds one chunk of
+    # rows at a time; rows loaded after the count are left out (their load bumps the version anyway)
+    size = release.objects.count()
+    columns = {name: np.lib.format.open_memmap(os.path.join(staging, name + '.npy'), mode='w+', dtype=kind,
+                                               shape=(size,))
+               for name, kind in COLUMN_TYPES.items()}
+    chunk_size = getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+    rows = release.objects.order_by().values_list('year', 'facility_id', 'chemical_id', *MEASURES).iterator(
+        chunk_size=chunk_size)
+    filled = 0
+    while filled < size:
+        chunk = list(itertools.islice(rows, min(chunk_size, size - filled)))
+        if not chunk:
+            break
+        span = slice(filled, filled + len(chunk))
+        years, facility_ids, chemical_ids, *measures = zip(*chunk)
+        columns['year'][span] = [-1 if year is None else year for year in years]
+        facilities_of = np.array([facility_codes[i] for i in facility_ids], dtype=np.int32)
+        chemicals_of = np.array([chemical_codes[i] for i in chemical_ids], dtype=np.int32)
+        columns['facility'][span] = facilities_of
+        columns['chemical'][span] = chemicals_of
+        for name, values in zip(MEASURES, measures):
+            # None becomes NaN
+            columns[name][span] = np.array(values, dtype=np.float64)
+        for name, codes in facility_geo.items():
+            columns[name][span] = codes[facilities_of]
+        columns['carcinogen'][span] = carcinogen[chemicals_of]
+        columns['pbt'][span] = pbt[chemicals_of]
+        filled += len(chunk)
+    for values in columns.values():
+        values.flush()
+    del columns
+
+    meta = {'version': dataset.current_version(), 'columns': sorted(COLUMN_TYPES), 'rows': filled, **dims,
+            'chemicals': [[row[0], row[1]] for row in chemicals]}
+    with open(os.path.join(staging, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(staging, directory)
+    return filled
+
+
+class Snapshot:
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.version = meta['version']
+        # releases deleted while the snapshot was written leave unused rows at the end of the columns
+        rows = meta.get('rows')
+        self.columns = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')[:rows]
+                        for name in meta['columns']}
+        self.dims = {name: meta[name] for name in ['state', 'county', 'city']}
+        self.codes = {name: {value: i for i, value in enumerate(values)} for name, values in self.dims.items()}
+        self.chemical_ids = {row[0]: i for i, row in enumerate(meta['chemicals'])}
+        self.chemical_names = [row[1] for row in meta['chemicals']]
+        self.size = len(self.columns['year'])
+
+    # --- filters of a QuerySpec, each returning a boolean mask over the releases ---
+
+    def geo_mask(self, spec, mask):
+        for name in ['state', 'county', 'city']:
+            value = getattr(spec, name)
+            if value is not None:
+                code = self.codes[name].get(value)
+                if code is None:
+                    return np.zeros(self.size, dtype=bool)
+                mask = mask & (self.columns[name] == code)
+        return mask
+
+    def chemical_mask(self, spec, mask, flags=True, search=True):
+        if search and spec.chemical is not None:
+            codes = [self.chemical_ids[i] for i in chemical_search.matching_ids(spec.chemical)
+                     if i in self.chemical_ids]
+            mask = mask & np.isin(self.columns['chemical'], codes)
+        if flags and spec.carcinogen:
+            mask = mask & self.columns['carcinogen']
+        if flags and spec.pbt:
+            mask = mask & self.columns['pbt']
+        return mask
+
+    def release_mask(self, spec, mask):
+        # same filters as the positive releases narrowed by QuerySpec.releases()
+        mask = mask & (self.columns['total'] > 0)
+        if spec.release_type is not None:
+            mask = mask & (self.columns[spec.release_type] > 0)
+        return self.chemical_mask(spec, mask)
+
+    def year_mask(self, y):
+        return self.columns['year'] == y
+
+    # --- reductions ---
+
+    def group_sums(self, mask, keys, size, measures):
+        """Returns (rows per group, {measure: sums per group}); a sum is None when all its values are NULL."""
+        keys = keys[mask]
+        rows = np.bincount(keys, minlength=size)
+        sums = {}
+        for name in measures:
+            values = self.columns[name][mask]
+            valid = ~np.isnan(values)
+            totals = np.bincount(keys[valid], weights=values[valid], minlength=size)
+            counts = np.bincount(keys[valid], minlength=size)
+            sums[name] = [float(t) if c else None for t, c in zip(totals, counts)]
+        return rows, sums
+
+    def total(self, mask, name):
+        values = self.columns[name][mask]
+        values = values[~np.isnan(values)]
+        return float(values.sum()) if len(values) else None
+
+    def distinct(self, mask, name, size):
+        return int(np.count_nonzero(np.bincount(self.columns[name][mask], minlength=size)))
+
+    def group_distinct(self, mask, keys, size, name):
+        """Returns the number of distinct values of column 'name' per group."""
+        values = self.columns[name][mask].astype(np.int64)
+        width = int(values.max(initial=0)) + 1
+        pairs = np.unique(keys[mask] * width + values)
+        return np.bincount(pairs // width, minlength=size)
+
+    # --- the view aggregates ---
+
+    def location_totals(self, spec, by_county):
+        """Rows of all_state_total_releases (by_county=False) or all_county_total_releases (by_county=True)."""
+        mask = self.chemical_mask(spec, self.geo_mask(spec, self.year_mask(spec.year)))
+        n_states = len(self.dims['state'])
+        keys = self.columns['state'].astype(np.int64)
+        size = n_states
+        if by_county:
+            keys = keys + self.columns['county'].astype(np.int64) * n_states
+            size = n_states * len(self.dims['county'])
+        rows, sums = self.group_sums(mask, keys, size, ['total', 'air', 'water', 'land', 'off_site', 'on_site'])
+        facilities = self.group_distinct(mask, keys, size, 'facility')
+
+        result = []
+        for key in np.flatnonzero(rows):
+            group = {}
+            if by_county:
+                group['facility__county'] = self.dims['county'][key // n_states]
+            group['facility__state'] = self.dims['state'][key % n_states]
+            group.update({name: sums[name][key] for name in ['total', 'air', 'water', 'land', 'off_site', 'on_site']})
+            group['num_facilities'] = int(facilities[key])
+            result.append(group)
+
+        order = 'facility__county' if by_county else 'facility__state'
+        # NULL locations sort last, as in PostgreSQL
+        result.sort(key=lambda g: (g[order] is None, g[order] or '', g['facility__state'] or ''))
+        return result
+
+    def summary(self, spec, geo=True):
+        """The aggregate of location_summary (or country_summary with geo=False)."""
+        mask = self.year_mask(spec.year)
+        if geo:
+            mask = self.geo_mask(spec, mask)
+        return {
+            'total': self.total(mask, 'total'),
+            'num_facilities': self.distinct(mask, 'facility', int(self.columns['facility'].max(initial=0)) + 1),
+            'num_chemicals': self.distinct(mask, 'chemical', len(self.chemical_names)),
+            'total_air': self.total(mask, 'air'),
+            'total_water': self.total(mask, 'water'),
+            'total_land': self.total(mask, 'land'),
+            'total_on_site': self.total(mask, 'on_site'),
+            'total_off_site': self.total(mask, 'off_site'),
+            'total_carcinogen': self.total(mask & self.columns['carcinogen'], 'total'),
+        }
+
+    def top_chemicals(self, spec):
+        """Rows of top_chemicals: every chemical by name with spec.all, else the 10 largest."""
+        mask = self.chemical_mask(spec, self.geo_mask(spec, self.year_mask(spec.year)) & (self.columns['total'] > 0),
+                                  search=False)
+        # output field -> summed column
+        if spec.release_type is not None:
+            fields = {'total': spec.release_type}
+        else:
+            fields = {name: name for name in ['total', 'air', 'water', 'land', 'off_site']}
+        rows, sums = self.group_sums(mask, self.columns['chemical'], len(self.chemical_names), set(fields.values()))
+
+        # the endpoint groups by name, which several compound ids may share
+        groups = {}
+        for code in np.flatnonzero(rows):
+            name = self.chemical_names[code]
+            group = groups.setdefault(name, {'chemical__name': name, **{field: None for field in fields}})
+            for field, column in fields.items():
+                value = sums[column][code]
+                if value is not None:
+                    group[field] = (group[field] or 0) + value
+
+        result = [g for g in groups.values() if g['total'] is not None and g['total'] > 0]
+        if spec.all:
+            return sorted(result, key=lambda g: (g['chemical__name'] is None, g['chemical__name'] or ''))
+        return sorted(result, key=lambda g: -g['total'])[:10]
+
+    def timeline_total(self, spec):
+        """Rows of timeline_total: the yearly totals of the filtered releases."""
+        mask = self.release_mask(spec, self.geo_mask(spec, np.ones(self.size, dtype=bool)))
+        # NULL years are stored as -1 and come last, as in PostgreSQL
+        keys = self.columns['year'].astype(np.int64)
+        keys = np.where(keys < 0, int(keys.max(initial=0)) + 1, keys)
+        rows, sums = self.group_sums(mask, keys, int(keys.max(initial=0)) + 1, ['total'])
+        null_key = int(self.columns['year'].max(initial=0)) + 1
+        return [{'year': None if key == null_key else int(key), 'total': sums['total'][key]}
+                for key in np.flatnonzero(rows)]
+
+
+def engine():
+    """Returns the snapshot of the current dataset version when the columnar backend is selected, else None."""
+    global _snapshot, _checked_version
+    if np is None or getattr(settings, 'ANALYTICS_BACKEND', 'orm') != 'columnar':
+        return None
+
+    version = dataset.current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _lock:
+        if _checked_version == version:
+            return None
+        _checked_version = version
+        directory = settings.COLUMNAR_SNAPSHOT_DIR
+        try:
+            snapshot = Snapshot(directory)
+        except FileNotFoundError:
+            snapshot = None
+        if snapshot is None or snapshot.version != version:
+            logger.warning('No columnar snapshot for dataset version %s in %s, using the ORM', version, directory)
+            _snapshot = None
+            return None
+        _snapshot = snapshot
+        return snapshot
+
+
+def reset():
+    global _snapshot, _checked_version
+    _snapshot = None
+    _checked_version = None
@@ -0,0 +1,76 @@
+# Bounded thread pool used to run the independent queries of a single request concurrently
+# run_all() serves the synchronous views; the async views await gather() instead, which runs the same
+# callables on the same pool so the event loop keeps serving other requests while the queries run.
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, close_old_connections
+from viewModule import metrics, routing
+
+THREAD_PREFIX = 'vet-query'
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'QUERY_WORKERS', 4),
+                                           thread_name_prefix=THREAD_PREFIX)
+    return _executor
+
+
+def _in_worker(task, stats, pin):
+    # each pool thread holds its own connections, recycled according to CONN_MAX_AGE
+    close_old_connections()
+    routing.check_connections()
+    try:
+        with metrics.recording(stats), routing.pinned(pin):
+            return task()
+    finally:
+        close_old_connections()
+
+
+def _stay_on_connection():
+    # other connections can't see the rows of an open transaction (tests, ATOMIC_REQUESTS), so stay on this one;
+    # a task already running on the pool runs its own tasks itself rather than waiting on a pool it occupies
+    return (connection.in_atomic_block or getattr(settings, 'QUERY_WORKERS', 4) <= 1
+            or threading.current_thread().name.startswith(THREAD_PREFIX))
+
+
+def run_all(tasks):
+    """Runs the zero-argument callables of 'tasks' (name -> callable) and returns name -> result."""
+    if len(tasks) <= 1 or _stay_on_connection():
+        return {name: task() for name, task in tasks.items()}
+
+    stats, pin = metrics.current(), routing.current_pin()
+    futures = {name: executor().submit(_in_worker, task, stats, pin) for name, task in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _run_here(tasks, stats, pin):
+    with metrics.recording(stats), routing.pinned(pin):
+        return {name: task() for name, task in tasks.items()}
+
+
+async def gather(request, tasks):
+    """Awaits the zero-argument callables of 'tasks' (name -> callable) and returns name -> result."""
+    # the middleware and the atomic block of a request live on Django's thread for synchronous code
+    stats, pin = getattr(request, 'stats', None), getattr(request, 'db_pin', None)
+    if await sync_to_async(_stay_on_connection, thread_sensitive=True)():
+        return await sync_to_async(_run_here, thread_sensitive=True)(tasks, stats, pin)
+
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(loop.run_in_executor(executor(), _in_worker, task, stats, pin)
+                                     for task in tasks.values()))
+    return dict(zip(tasks, results))
+
+
+async def call(request, func, *args, **kwargs):
+    """Awaits func(*args, **kwargs), run like a task of gather()."""
+    return (await gather(request, {'result': partial(func, *args, **kwargs)}))['result']
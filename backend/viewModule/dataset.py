@@ -0,0 +1,42 @@
+# Tracks the version of the loaded TRI dataset
+# Anything derived from the data (cached responses, in-process indexes) is keyed on this version,
+# so bumping it after a reload invalidates all of them at once, across every worker.
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from viewModule.models import DatasetVersion as dataset_version
+
+# (version, time it was read) for this process
+_current = None
+
+
+def current_version():
+    """Returns the dataset version, re-reading it from the database at most every DATASET_VERSION_TTL seconds."""
+    global _current
+    ttl = getattr(settings, 'DATASET_VERSION_TTL', 5)
+    now = time.monotonic()
+
+    if _current is None or now - _current[1] >= ttl:
+        row = dataset_version.objects.filter(pk=1).values_list('version', flat=True).first()
+        _current = (row or 0, now)
+
+    return _current[0]
+
+
+def bump():
+    """Increments the dataset version and returns the new value."""
+    global _current
+    with transaction.atomic():
+        dataset_version.objects.get_or_create(pk=1)
+        dataset_version.objects.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now())
+        version = dataset_version.objects.get(pk=1).version
+    _current = None
+    return version
+
+
+def reset():
+    """Forgets the version read by this process (after a reload or in tests)."""
+    global _current
+    _current = None
@@ -0,0 +1,137 @@
+# Response encodings negotiated from the Accept header, shared by every view
+# Views hand their data to respond() (or stream() for querysets) instead of building a JsonResponse, and the
+# client picks the layout and the serialization:
+#   application/json                     rows as a JSON array of objects (the default)
+#   application/vnd.vet.columns+json     lists of rows as {"length": n, "columns": {field: [values...]}}
+#   application/msgpack                  rows as MessagePack (requires msgpack)
+#   application/vnd.vet.columns+msgpack  columns as MessagePack
+# The columnar layout names every field once instead of once per row, which is most of a large list's bytes.
+# Cached bodies also get precompressed gzip/brotli copies, served to clients sending Accept-Encoding.
+import gzip
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from viewModule import streaming, metrics
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = 'application/json'
+COLUMNS_JSON = 'application/vnd.vet.columns+json'
+MSGPACK = 'application/msgpack'
+COLUMNS_MSGPACK = 'application/vnd.vet.columns+msgpack'
+
+ALIASES = {'application/x-msgpack': MSGPACK}
+
+# bodies smaller than this are not worth a compressed copy
+COMPRESS_MIN_BYTES = 512
+
+
+def formats():
+    """Returns the media types this process can produce."""
+    if msgpack is None:
+        return (JSON, COLUMNS_JSON)
+    return (JSON, COLUMNS_JSON, MSGPACK, COLUMNS_MSGPACK)
+
+
+def _preferences(header):
+    """Yields (value, quality) for every item of an Accept-style header."""
+    for item in header.split(','):
+        value, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        yield value.lower(), quality
+
+
+def negotiate(request):
+    """Returns the supported media type the Accept header prefers, JSON when nothing else matches."""
+    accept = request.META.get('HTTP_ACCEPT')
+    if not accept:
+        return JSON
+
+    supported = formats()
+    choices = []
+    for position, (media_type, quality) in enumerate(_preferences(accept)):
+        media_type = ALIASES.get(media_type, media_type)
+        if quality > 0 and media_type in supported:
+            choices.append((-quality, position, media_type))
+    return min(choices)[2] if choices else JSON
+
+
+def to_columns(data):
+    """Turns every list of objects in 'data' into one array per field."""
+    if isinstance(data, dict):
+        return {key: to_columns(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)) and all(isinstance(row, dict) for row in data):
+        fields = list(dict.fromkeys(field for row in data for field in row))
+        return {'length': len(data), 'columns': {field: [row.get(field) for row in data] for field in fields}}
+    return data
+
+
+def _msgpack_default(value):
+    # dates, decimals and the like, as DjangoJSONEncoder writes them
+    return DjangoJSONEncoder().default(value)
+
+
+def encode(data, media_type):
+    """Returns 'data' serialized as 'media_type'."""
+    if media_type in (COLUMNS_JSON, COLUMNS_MSGPACK):
+        data = to_columns(data)
+    if media_type in (MSGPACK, COLUMNS_MSGPACK):
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+def respond(request, data):
+    """Returns 'data' in the format negotiated with the client."""
+    media_type = negotiate(request)
+    with metrics.serializing(getattr(request, 'stats', None)):
+        body = encode(data, media_type)
+    response = HttpResponse(body, content_type=media_type)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def stream(request, queryset):
+    """Returns the rows of 'queryset', streamed when the client takes the default JSON."""
+    media_type = negotiate(request)
+    # the ASGI handler reads a streamed body on the event loop, where the ORM refuses to run
+    if media_type != JSON or isinstance(request, ASGIRequest):
+        return respond(request, list(queryset))
+    response = streaming.json_response(queryset)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def precompress(body):
+    """Returns the compressed copies of a cached body: {content coding: bytes}, best coding first."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return {}
+    compressed = {}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(body, quality=9)
+    compressed['gzip'] = gzip.compress(body, compresslevel=6, mtime=0)
+    return compressed
+
+
+def content_coding(request, available):
+    """Returns the first of the 'available' content codings the client accepts, or None."""
+    accepted = dict(_preferences(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+    for coding in available:
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
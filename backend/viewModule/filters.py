@@ -0,0 +1,159 @@
+# Query specs: the filters of a request, parsed once
+# Each view declares the query parameters it reads (@cacheable); compile_request() turns them into a QuerySpec,
+# an immutable and hashable value in which equivalent spellings ('mi' and 'MI', 'True' and 'true', no chemical
+# and chemical=all) are equal. The views build their Q trees from the spec for the model they query, the
+# response cache and the ETag are keyed on it, and rollup_eligible() tells whether the rollups can answer it.
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+from django.db.models import Q
+from viewModule.chemical_search import chemical_filter
+from viewModule.location_resolver import location_filter
+
+# release_type values, each the column that has to be positive
+RELEASE_TYPES = ('air', 'water', 'land', 'on_site', 'off_site')
+# parameters that only act as a flag when they equal 'true' (case-insensitive)
+FLAG_PARAMS = ('carcinogen', 'pbt', 'all', 'total', 'exact')
+INT_PARAMS = ('year', 'year_a', 'year_b', 'limit', 'offset', 'page_size', 'zoom')
+FLOAT_PARAMS = ('west', 'south', 'east', 'north')
+
+# models a spec filters, with the paths from them to the facility, to the chemical, to the compound id and to the
+# release measures; the rollups carry the location and the chemical flags as columns of their own
+RELEASES = 'releases'
+FACILITIES = 'facilities'
+CHEMICALS = 'chemicals'
+ROLLUPS = 'rollups'
+PATHS = {
+    RELEASES: {'location': 'facility__', 'chemical': 'chemical__', 'compound': 'chemical', 'measure': ''},
+    FACILITIES: {'location': '', 'chemical': 'chemical__', 'compound': 'chemical', 'measure': 'release__'},
+    CHEMICALS: {'location': 'facilities__', 'chemical': '', 'compound': 'id', 'measure': 'release__'},
+    ROLLUPS: {'location': '', 'chemical': None, 'compound': 'chemical', 'measure': ''},
+}
+
+
+@dataclass(frozen=True)
+class QuerySpec:
+    """Canonical filters of a request; a parameter the view doesn't read is left at its default."""
+
+    state: Optional[str] = None
+    county: Optional[str] = None
+    city: Optional[str] = None
+    year: Optional[int] = None
+    carcinogen: bool = False
+    pbt: bool = False
+    # case-insensitive substring of the chemical name
+    chemical: Optional[str] = None
+    release_type: Optional[str] = None
+    all: bool = False
+    # keyset pages of the all=true lists: page size, continuation token and whether to count the groups
+    page_size: Optional[int] = None
+    cursor: Optional[str] = None
+    total: bool = False
+    # count distinct facilities and chemicals exactly instead of merging the sketches
+    exact: bool = False
+    # the two years of a comparison, and the dimension it is grouped by
+    year_a: Optional[int] = None
+    year_b: Optional[int] = None
+    by: Optional[str] = None
+    limit: Optional[int] = None
+    offset: Optional[int] = None
+    zoom: Optional[int] = None
+    west: Optional[float] = None
+    south: Optional[float] = None
+    east: Optional[float] = None
+    north: Optional[float] = None
+    panels: Optional[Tuple[str, ...]] = None
+
+    def items(self):
+        """Returns the sorted (name, value) pairs of the parameters that are set."""
+        pairs = []
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if value is None or value is False:
+                continue
+            if value is True:
+                value = 'true'
+            elif isinstance(value, tuple):
+                value = ','.join(value)
+            pairs.append((field.name, str(value)))
+        return tuple(sorted(pairs))
+
+    def key(self):
+        """Returns the spec as a query string, the same for every equivalent request."""
+        return urlencode(self.items())
+
+    def rollup_eligible(self):
+        # the rollups stop at the county level
+        return self.city is None
+
+    # --- Q trees, over the model named by 'base' ---
+
+    def location(self, base=RELEASES):
+        """State, county and city filters; the facilities are matched on their location ids."""
+        prefix = PATHS[base]['location']
+        if base == ROLLUPS:
+            filters = Q()
+            for name in ('state', 'county'):
+                if getattr(self, name) is not None:
+                    filters &= Q(**{name: getattr(self, name)})
+        else:
+            filters = location_filter(self, prefix)
+        if self.city is not None:
+            filters &= Q(**{prefix + 'city': self.city})
+        return filters
+
+    def chemicals(self, base=RELEASES, search=True):
+        """Chemical name search and carcinogen/PBT filters."""
+        filters = Q()
+        if search and self.chemical is not None:
+            filters &= chemical_filter(self.chemical, PATHS[base]['compound'])
+        prefix = PATHS[base]['chemical']
+        if self.carcinogen:
+            filters &= Q(carcinogen=True) if prefix is None else Q(**{prefix + 'carcinogen': 'YES'})
+        if self.pbt:
+            filters &= Q(pbt=True) if prefix is None else Q(**{prefix + 'classification': 'PBT'})
+        return filters
+
+    def released(self, base=RELEASES):
+        """The release_type filter: the chosen measure is positive."""
+        if self.release_type is None:
+            return Q()
+        return Q(**{PATHS[base]['measure'] + self.release_type + '__gt': 0})
+
+    def releases(self, base=RELEASES):
+        """Every filter of the lists of releases, facilities and chemicals except the location."""
+        return self.released(base) & self.chemicals(base)
+
+
+def _parse(name, value):
+    if name in ('state', 'county', 'city'):
+        return value.upper()
+    if name in FLAG_PARAMS:
+        return value.lower() == 'true'
+    if name == 'chemical':
+        # 'all' disables the filter
+        return None if value == 'all' else value.lower()
+    if name == 'release_type':
+        # anything else means every release
+        return value.lower() if value.lower() in RELEASE_TYPES else None
+    if name == 'by':
+        return value.lower()
+    if name == 'panels':
+        return tuple(sorted(set(p for p in value.split(',') if p)))
+    if name in INT_PARAMS:
+        return int(value)
+    if name in FLOAT_PARAMS:
+        return float(value)
+    return value
+
+
+def compile_request(request, params, defaults=None):
+    """Returns the QuerySpec of the parameters 'params' of the request (ValueError on a malformed number)."""
+    values = {}
+    for name in params:
+        value = request.GET.get(name)
+        if value is None and defaults is not None and name in defaults:
+            value = str(defaults[name])
+        if value is not None:
+            values[name] = _parse(name, value)
+    return QuerySpec(**values)
@@ -0,0 +1,311 @@
+# Incremental loading of the EPA TRI basic data files (one CSV per reporting year)
+# Rows are streamed from the file, normalized to the columns of viewModule/models.py and bulk loaded (COPY on
+# PostgreSQL) into temporary staging tables. One transaction then upserts the facilities and chemicals, replaces
+# the releases of the years found in the file, relinks the parent companies and locations, rebuilds the rollups of
+# the years and bumps the dataset version. Until it commits the API keeps answering from the previous rows, and no
+# reader ever sees a half-loaded year.
+import csv
+import gzip
+import io
+import re
+import sys
+import zipfile
+from django.db import connection, transaction
+from viewModule.models import Facility, Chemical, Release, ParentCompany, Location
+from viewModule import dataset, rollups, spatial, parents, locations
+
+BATCH_SIZE = 10000
+
+# Header names of the basic data files once their column number is dropped ("4. FACILITY NAME" -> "FACILITY
+# NAME"), the first one present wins: field -> candidates
+FACILITY_COLUMNS = {
+    'id': ('TRIFD', 'TRI FACILITY ID'),
+    'name': ('FACILITY NAME',),
+    'street_address': ('STREET ADDRESS',),
+    'city': ('CITY',),
+    'county': ('COUNTY',),
+    'state': ('ST', 'STATE'),
+    'zip': ('ZIP', 'ZIP CODE'),
+    'latitude': ('LATITUDE',),
+    'longitude': ('LONGITUDE',),
+    'parent_co_name': ('STANDARD PARENT CO NAME', 'PARENT CO NAME', 'PARENT COMPANY NAME'),
+    'industry_sector_code': ('INDUSTRY SECTOR CODE',),
+    'industry_sector': ('INDUSTRY SECTOR',),
+}
+CHEMICAL_COLUMNS = {
+    'id': ('TRI CHEMICAL/COMPOUND ID', 'TRI CHEMICAL ID', 'CAS#/COMPOUND ID', 'CAS #/COMPOUND ID', 'CAS#'),
+    'name': ('CHEMICAL',),
+    'clean_air_act_chemical': ('CLEAN AIR ACT CHEMICAL',),
+    'classification': ('CLASSIFICATION',),
+    'metal_category': ('METAL CATEGORY',),
+    'carcinogen': ('CARCINOGEN',),
+    'unit_of_measure': ('UNIT OF MEASURE',),
+}
+RELEASE_COLUMNS = {
+    'year': ('YEAR', 'REPORTING YEAR'),
+    'doc_ctrl_num': ('DOCUMENT CONTROL NUMBER', 'DOC_CTRL_NUM', 'DOC CTRL NUM'),
+    'on_site': ('ON-SITE RELEASE TOTAL',),
+    'off_site': ('OFF-SITE RELEASE TOTAL',),
+    'total': ('TOTAL RELEASES',),
+}
+# measures summed from the individual release quantities of section 5 of Form R
+AIR = ('5.1 - FUGITIVE AIR', '5.2 - STACK AIR')
+WATER = ('5.3 - WATER',)
+LAND = ('5.4 - UNDERGROUND', '5.5.1 - LANDFILLS', '5.5.2 - LAND TREATMENT', '5.5.3 - SURFACE IMPNDMNT',
+        '5.5.4 - OTHER DISPOSAL')
+
+FACILITY_FIELDS = [*FACILITY_COLUMNS, 'grid_cell']
+CHEMICAL_FIELDS = list(CHEMICAL_COLUMNS)
+RELEASE_FIELDS = ['doc_ctrl_num', 'year', 'facility', 'chemical', 'air', 'water', 'land', 'on_site', 'off_site',
+                  'total']
+
+
+def copy_rows(table, columns, rows):
+    """Bulk inserts 'rows' (tuples in the order of 'columns') into 'table' and returns their number: COPY on
+    PostgreSQL, batched executemany() elsewhere."""
+    qn = connection.ops.quote_name
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(['' if v is None else v for v in row] for row in batch)
+                buffer.seek(0)
+                cursor.cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                    qn(table), ', '.join(qn(c) for c in columns)), buffer)
+            else:
+                cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+                    qn(table), ', '.join(qn(c) for c in columns), ', '.join(['%s'] * len(columns))), batch)
+        batch.clear()
+
+    count = 0
+    for row in rows:
+        batch.append(row)
+        count += 1
+        if len(batch) >= BATCH_SIZE:
+            flush()
+    flush()
+    return count
+
+
+def open_csv(path, encoding='utf-8-sig'):
+    """Returns a text stream over the CSV at 'path': plain, gzipped, the first .csv of a zip, or stdin for '-'."""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline='')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding=encoding, newline='')
+    if path.endswith('.zip'):
+        archive = zipfile.ZipFile(path)
+        names = [n for n in archive.namelist() if n.lower().endswith('.csv')]
+        if not names:
+            raise ValueError('{} holds no CSV file'.format(path))
+        return io.TextIOWrapper(archive.open(names[0]), encoding=encoding, newline='')
+    return open(path, encoding=encoding, newline='')
+
+
+def _header_name(column):
+    return re.sub(r'^\d+\.\s*', '', column.strip().upper())
+
+
+def _indexes(header, columns):
+    """Maps each field of 'columns' to the position of its first candidate present in 'header' (or None)."""
+    positions = {}
+    for i, column in enumerate(header):
+        positions.setdefault(_header_name(column), i)
+    return {field: next((positions[c] for c in candidates if c in positions), None)
+            for field, candidates in columns.items()}
+
+
+def _text(value):
+    value = value.strip() if value is not None else ''
+    return value or None
+
+
+def _upper(value):
+    value = _text(value)
+    return value.upper() if value is not None else None
+
+
+def _float(value):
+    value = _text(value)
+    return float(value.replace(',', '')) if value is not None else None
+
+
+def _int(value):
+    value = _text(value)
+    if value is None:
+        return None
+    digits = re.match(r'\d+', value)
+    return int(digits.group()) if digits else None
+
+
+def _sum(values):
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+class Normalizer:
+    """Turns the rows of a basic data file into release rows, collecting their facilities and chemicals."""
+
+    def __init__(self, header, years=None):
+        self.facility = _indexes(header, FACILITY_COLUMNS)
+        self.chemical = _indexes(header, CHEMICAL_COLUMNS)
+        self.release = _indexes(header, RELEASE_COLUMNS)
+        positions = {_header_name(column): i for i, column in enumerate(header)}
+        self.measures = {name: [positions[c] for c in candidates if c in positions]
+                         for name, candidates in (('air', AIR), ('water', WATER), ('land', LAND))}
+
+        missing = [name for name, i in (('year', self.release['year']), ('facility id', self.facility['id']),
+                                        ('chemical id', self.chemical['id'])) if i is None]
+        if missing:
+            raise ValueError('Not a TRI basic data file, missing: {}'.format(', '.join(missing)))
+
+        self.only_years = set(years) if years else None
+        self.facilities = {}
+        self.chemicals = {}
+        self.years = set()
+        self.keys = {}
+
+    def _get(self, row, index):
+        return row[index] if index is not None and index < len(row) else None
+
+    def _getter(self, row, indexes):
+        return lambda field: self._get(row, indexes[field])
+
+    def rows(self, reader):
+        for row in reader:
+            year = _int(self._get(row, self.release['year']))
+            if year is None or (self.only_years is not None and year not in self.only_years):
+                continue
+            facility_id = _upper(self._get(row, self.facility['id']))
+            chemical_id = _text(self._get(row, self.chemical['id']))
+            if facility_id is None or chemical_id is None:
+                continue
+            self.years.add(year)
+            # later rows (the latest report of the file) win
+            self.facilities[facility_id] = self._facility(facility_id, row)
+            self.chemicals[chemical_id] = self._chemical(chemical_id, row)
+            yield self._release(year, facility_id, chemical_id, row)
+
+    def _facility(self, facility_id, row):
+        get = self._getter(row, self.facility)
+        latitude, longitude = _float(get('latitude')), _float(get('longitude'))
+        return (facility_id, _upper(get('name')), _upper(get('street_address')), _upper(get('city')),
+                _upper(get('county')), _upper(get('state')), _int(get('zip')), latitude, longitude,
+                _upper(get('parent_co_name')), _text(get('industry_sector_code')), _text(get('industry_sector')),
+                spatial.cell(latitude, longitude))
+
+    def _chemical(self, chemical_id, row):
+        get = self._getter(row, self.chemical)
+        return (chemical_id, _upper(get('name')), _upper(get('clean_air_act_chemical')), _text(get('classification')),
+                _int(get('metal_category')), _upper(get('carcinogen')), _text(get('unit_of_measure')))
+
+    def _release(self, year, facility_id, chemical_id, row):
+        get = self._getter(row, self.release)
+        air, water, land = (_sum(_float(self._get(row, i)) for i in self.measures[name])
+                            for name in ('air', 'water', 'land'))
+        on_site = _float(get('on_site'))
+        if on_site is None:
+            on_site = _sum([air, water, land])
+        off_site = _float(get('off_site'))
+        total = _float(get('total'))
+        if total is None:
+            total = _sum([on_site, off_site])
+
+        key = _text(get('doc_ctrl_num'))
+        if key is None:
+            # files without document control numbers get a stable key per facility, chemical and year
+            key = '{}-{}-{}'.format(year, facility_id, chemical_id)
+            n = self.keys[key] = self.keys.get(key, 0) + 1
+            if n > 1:
+                key = '{}-{}'.format(key, n)
+        return (key, year, facility_id, chemical_id, air, water, land, on_site, off_site, total)
+
+
+def _columns(model, fields):
+    return [model._meta.get_field(f).column for f in fields]
+
+
+def _create_staging(cursor, model, fields):
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    staging = 'staging_' + table
+    cursor.execute('DROP TABLE IF EXISTS {}'.format(qn(staging)))
+    # same column types, no constraints or indexes
+    cursor.execute('CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WHERE 1 = 0'.format(
+        qn(staging), ', '.join(qn(c) for c in _columns(model, fields)), qn(table)))
+    return staging
+
+
+def _upsert(cursor, model, fields, staging, keep_existing=False):
+    """Copies the staged rows into the table of 'model', updating the rows whose primary key exists."""
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    columns = _columns(model, fields)
+    pk = model._meta.pk.column
+    if keep_existing:
+        # a file without an attribute (or an older year loaded later) doesn't erase what is known
+        updates = ['{0} = COALESCE(excluded.{0}, {1}.{0})'.format(qn(c), qn(table)) for c in columns if c != pk]
+    else:
+        updates = ['{0} = excluded.{0}'.format(qn(c)) for c in columns if c != pk]
+    # 'WHERE 1 = 1' keeps SQLite from reading ON CONFLICT as a join constraint
+    cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} WHERE 1 = 1 '
+                   'ON CONFLICT ({pk}) DO UPDATE SET {updates}'.format(
+                       table=qn(table), columns=', '.join(qn(c) for c in columns), staging=qn(staging),
+                       pk=qn(pk), updates=', '.join(updates)))
+    cursor.execute('DROP TABLE {}'.format(qn(staging)))
+
+
+def load(stream, years=None, log=print):
+    """Loads a TRI basic data file and returns {'years': [...], 'facilities': n, 'chemicals': n, 'releases': n}."""
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        raise ValueError('The file is empty')
+    normalizer = Normalizer(header, years)
+    qn = connection.ops.quote_name
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            staged_releases = _create_staging(cursor, Release, RELEASE_FIELDS)
+            staged_facilities = _create_staging(cursor, Facility, FACILITY_FIELDS)
+            staged_chemicals = _create_staging(cursor, Chemical, CHEMICAL_FIELDS)
+
+        counts = {'releases': copy_rows(staged_releases, _columns(Release, RELEASE_FIELDS), normalizer.rows(reader))}
+        counts['facilities'] = copy_rows(staged_facilities, _columns(Facility, FACILITY_FIELDS),
+                                         normalizer.facilities.values())
+        counts['chemicals'] = copy_rows(staged_chemicals, _columns(Chemical, CHEMICAL_FIELDS),
+                                        normalizer.chemicals.values())
+        counts['years'] = sorted(normalizer.years)
+        log('Staged {releases} releases of {facilities} facilities and {chemicals} chemicals'.format(**counts))
+        if not counts['years']:
+            raise ValueError('The file holds no release of the requested years')
+
+        with connection.cursor() as cursor:
+            _upsert(cursor, Facility, FACILITY_FIELDS, staged_facilities, keep_existing=True)
+            _upsert(cursor, Chemical, CHEMICAL_FIELDS, staged_chemicals, keep_existing=True)
+            # the file is the complete report of its years: replace them
+            cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+                qn(Release._meta.db_table), qn(Release._meta.get_field('year').column),
+                ', '.join(['%s'] * len(counts['years']))), counts['years'])
+            _upsert(cursor, Release, RELEASE_FIELDS, staged_releases)
+        log('Replaced the releases of {}'.format(', '.join(str(y) for y in counts['years'])))
+        log('Linked the facilities to {} parent companies'.format(parents.link(Facility, ParentCompany)))
+        log('Linked the facilities to {} locations'.format(locations.link(Facility, Location)))
+
+        for year in counts['years']:
+            rollups.build(year)
+        log('Rebuilt the rollups')
+        # cached responses and in-process indexes keyed on the previous version expire with the commit
+        version = dataset.bump()
+
+    if connection.vendor == 'postgresql':
+        # fresh planner statistics for the changed tables
+        with connection.cursor() as cursor:
+            for model in (Facility, Chemical, Release):
+                cursor.execute('ANALYZE {}'.format(qn(model._meta.db_table)))
+    log('Dataset version {}'.format(version))
+    return counts
@@ -0,0 +1,100 @@
+# Resolves the 'state' and 'county' parameters to location ids
+# The locations table is small, so it is kept in memory (per dataset version): a location filter becomes an
+# IN over the indexed 'location_id' integer of the facilities, and the county results get their labels and FIPS
+# code from here instead of grouping on text pairs. A location created or removed by this process (Facility.save()
+# of a facility in a new county) drops the index at once; other processes see it after the next version bump.
+import threading
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from viewModule.models import Location as location
+from viewModule import dataset, locations
+
+_index = None
+_lock = threading.Lock()
+
+
+class LocationIndex:
+    """The locations of one dataset version."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.labels = {}
+        self.by_state = {}
+        self.by_county = {}
+        for location_id, state, county, state_fips, county_fips in rows:
+            self.labels[location_id] = (county, state, locations.fips(state_fips, county_fips))
+            self.by_state.setdefault(state, set()).add(location_id)
+            self.by_county.setdefault(county, set()).add(location_id)
+        self.by_state = {key: frozenset(ids) for key, ids in self.by_state.items()}
+        self.by_county = {key: frozenset(ids) for key, ids in self.by_county.items()}
+
+    def matching_ids(self, state, county):
+        """Returns the ids of the locations in 'state' and 'county' (either may be None), or None when no location
+        of this version has that name."""
+        ids = None
+        for value, names in ((state, self.by_state), (county, self.by_county)):
+            if value is not None:
+                found = names.get(value)
+                if found is None:
+                    return None
+                ids = found if ids is None else ids & found
+        return ids
+
+
+def index():
+    """Returns the index of the current dataset version, loading it on first use and after a reload."""
+    global _index
+    version = dataset.current_version()
+    current = _index
+    if current is None or current.version != version:
+        with _lock:
+            current = _index
+            if current is None or current.version != version:
+                current = _index = LocationIndex(version, location.objects.values_list(
+                    'id', 'state', 'county', 'state_fips', 'county_fips'))
+    return current
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def _locations_changed(sender, **kwargs):
+    reset()
+
+
+post_save.connect(_locations_changed, sender=location)
+post_delete.connect(_locations_changed, sender=location)
+
+
+''' Returns a Q object matching the facilities in the state and county of 'spec' through 'prefix' (the path to the
+facility), on their location ids; names this version doesn't know fall back to the text columns. '''
+
+
+def location_filter(spec, prefix):
+    if spec.state is None and spec.county is None:
+        return Q()
+    ids = index().matching_ids(spec.state, spec.county)
+    if ids is None:
+        filters = Q()
+        for name in ('state', 'county'):
+            if getattr(spec, name) is not None:
+                filters &= Q(**{prefix + name: getattr(spec, name)})
+        return filters
+    return Q(**{prefix + 'location__in': sorted(ids)})
+
+
+def label(location_id):
+    """Returns (county, state, fips) of a location id (all None for facilities without a location)."""
+    return index().labels.get(location_id, (None, None, None))
+
+
+def county_fips(state, county):
+    """Returns the 5-digit code of a county named by its state and county, None when unknown."""
+    if county is None:
+        return None
+    ids = index().matching_ids(state, county)
+    if ids is None or len(ids) != 1:
+        return None
+    return label(next(iter(ids)))[2]
@@ -0,0 +1,105 @@
+# Location dimension: one row per reported (state, county), with its FIPS codes
+# Facilities reference their location by a small integer id, so the county group-bys and location filters run on
+# an indexed integer column instead of text pairs. The state FIPS codes are known here; the county codes are
+# matched by name from a Census county file ('manage.py load_county_fips'), after which county results carry the
+# 5-digit code of the map shapes. Facility.save() resolves the location of a facility whose state or county
+# changed; queryset update() and the bulk writes skip save(), so whatever writes those columns that way must call
+# link() afterwards. The functions take the models as arguments so the migrations can run them on historical
+# models. location_resolver.py maps request parameters to the location ids.
+import csv
+import re
+
+STATE_FIPS = {
+    'AL': 1, 'AK': 2, 'AZ': 4, 'AR': 5, 'CA': 6, 'CO': 8, 'CT': 9, 'DE': 10, 'DC': 11, 'FL': 12, 'GA': 13,
+    'HI': 15, 'ID': 16, 'IL': 17, 'IN': 18, 'IA': 19, 'KS': 20, 'KY': 21, 'LA': 22, 'ME': 23, 'MD': 24,
+    'MA': 25, 'MI': 26, 'MN': 27, 'MS': 28, 'MO': 29, 'MT': 30, 'NE': 31, 'NV': 32, 'NH': 33, 'NJ': 34,
+    'NM': 35, 'NY': 36, 'NC': 37, 'ND': 38, 'OH': 39, 'OK': 40, 'OR': 41, 'PA': 42, 'RI': 44, 'SC': 45,
+    'SD': 46, 'TN': 47, 'TX': 48, 'UT': 49, 'VT': 50, 'VA': 51, 'WA': 53, 'WV': 54, 'WI': 55, 'WY': 56,
+    'AS': 60, 'GU': 66, 'MP': 69, 'PR': 72, 'VI': 78,
+}
+
+# facilities updated per statement
+BATCH_SIZE = 500
+
+# words of the Census county names that the TRI county names leave out
+COUNTY_SUFFIXES = re.compile(r' (COUNTY|PARISH|BOROUGH|CENSUS AREA|CITY AND BOROUGH|MUNICIPALITY|MUNICIPIO)$')
+
+
+def county_key(name):
+    """Returns the name of a county as both the TRI data and the Census files can be matched on."""
+    if name is None:
+        return None
+    text = re.sub(r'[.\']', '', name.upper())
+    text = ' '.join(re.sub(r'[^0-9A-Z]+', ' ', text).split())
+    text = COUNTY_SUFFIXES.sub('', text)
+    return re.sub(r'^SAINT ', 'ST ', re.sub(r'^SAINTE ', 'STE ', text))
+
+
+def fips(state_fips, county_fips):
+    """The 5-digit code of a county, as the map shapes name it (None while the county code is unknown)."""
+    if state_fips is None or county_fips is None:
+        return None
+    return '{:02d}{:03d}'.format(state_fips, county_fips)
+
+
+def resolve(location_model, state, county):
+    """Returns the location of a facility, creating it when new (None without a state)."""
+    if state is None:
+        return None
+    location, _ = location_model.objects.get_or_create(
+        state=state, county=county, defaults={'state_fips': STATE_FIPS.get(state)})
+    return location
+
+
+def link(facility_model, location_model):
+    """Creates the locations of the facilities and links every facility to its own. Returns the number of
+    locations."""
+    pairs = facility_model.objects.exclude(state=None).order_by().values_list('state', 'county').distinct()
+    known = {(row.state, row.county): row for row in location_model.objects.all()}
+    location_model.objects.bulk_create([
+        location_model(state=state, county=county, state_fips=STATE_FIPS.get(state))
+        for state, county in pairs if (state, county) not in known], batch_size=BATCH_SIZE)
+
+    # bulk_create doesn't return the ids on every database; one pass over the facilities then updates the
+    # changed ones by primary key (facilities without a state have no location)
+    ids = {(state, county): location_id
+           for location_id, state, county in location_model.objects.values_list('id', 'state', 'county')}
+    changed = [facility_model(pk=pk, location_id=ids.get((state, county)))
+               for pk, state, county, location_id in facility_model.objects.order_by().values_list(
+                   'pk', 'state', 'county', 'location').iterator(chunk_size=BATCH_SIZE)
+               if ids.get((state, county)) != location_id]
+    facility_model.objects.bulk_update(changed, ['location'], batch_size=BATCH_SIZE)
+    location_model.objects.filter(facilities=None).delete()
+    return location_model.objects.count()
+
+
+def read_counties(stream):
+    """Yields (state, county name, state FIPS, county FIPS) of a Census county file: the pipe-separated
+    national_county2020.txt with its header, or the comma-separated national_county.txt without one."""
+    lines = iter(stream)
+    first = next(lines, '')
+    if '|' in first:
+        reader = csv.DictReader([first, *lines], delimiter='|')
+        for row in reader:
+            yield row['STATE'], row['COUNTYNAME'], int(row['STATEFP']), int(row['COUNTYFP'])
+    else:
+        for row in csv.reader([first, *lines]):
+            if len(row) >= 4:
+                yield row[0], row[3], int(row[1]), int(row[2])
+
+
+def load_county_codes(location_model, counties):
+    """Sets the FIPS codes of the locations whose county matches one of 'counties' (see read_counties()).
+    Returns the (state, county) of the locations left without a county code."""
+    codes = {(state.upper(), county_key(name)): (state_code, county_code)
+             for state, name, state_code, county_code in counties}
+    updated, missing = [], []
+    for location in location_model.objects.all():
+        code = codes.get((location.state, county_key(location.county)))
+        if code is None:
+            missing.append((location.state, location.county))
+        elif (location.state_fips, location.county_fips) != code:
+            location.state_fips, location.county_fips = code
+            updated.append(location)
+    location_model.objects.bulk_update(updated, ['state_fips', 'county_fips'], batch_size=500)
+    return sorted(missing, key=lambda pair: (pair[0], pair[1] or ''))
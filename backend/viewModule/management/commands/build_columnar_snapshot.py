@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from viewModule import columnar
+
+
+class Command(BaseCommand):
+    help = 'Writes the columnar snapshot of the releases used when ANALYTICS_BACKEND is \'columnar\'. Run it ' \
+           'after build_rollups/bump_dataset_version, since a snapshot only serves the version it was built for.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Snapshot directory. Defaults to COLUMNAR_SNAPSHOT_DIR.')
+
+    def handle(self, *args, **options):
+        if columnar.np is None:
+            raise CommandError('The columnar backend requires numpy')
+        directory = options['dir'] or settings.COLUMNAR_SNAPSHOT_DIR
+        rows = columnar.build(directory)
+        self.stdout.write('Wrote {} releases to {}'.format(rows, directory))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from viewModule.models import Release as release
+from viewModule import rollups, dataset
+
+
+class Command(BaseCommand):
+    help = 'Builds or refreshes the precomputed release rollups used by the stats endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, action='append', dest='years',
+                            help='Year to rebuild (repeatable). Defaults to every year in the releases table.')
+
+    def handle(self, *args, **options):
+        years = options['years'] or list(release.objects.order_by('year').values_list(
+            'year', flat=True).distinct())
+
+        for y in years:
+            if y is None:
+                continue
+            rollups.build(y)
+            self.stdout.write('Built rollups for {}'.format(y))
+
+        # responses cached before the rebuild may have been computed from stale data
+        dataset.bump()
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from viewModule import dataset
+
+
+class Command(BaseCommand):
+    help = 'Bumps the dataset version, invalidating every cached response. Run it after reloading TRI data.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Dataset version is now {}'.format(dataset.bump()))
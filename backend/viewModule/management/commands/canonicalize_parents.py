@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from viewModule.models import Facility, ParentCompany
+from viewModule import parents, dataset
+
+
+class Command(BaseCommand):
+    help = 'Merges the spelling variants of the parent company names into canonical parent companies and links ' \
+           'the facilities to them.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = parents.link(Facility, ParentCompany)
+        self.stdout.write('Linked the facilities to {} parent companies'.format(count))
+
+        # cached parent-company responses may group the previous companies
+        dataset.bump()
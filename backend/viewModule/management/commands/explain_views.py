@@ -0,0 +1,120 @@
+import asyncio
+import json
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from viewModule.models import Facility as facility
+
+# representative filter combinations; each view only gets the parameters it reads
+VARIANTS = [
+    {},
+    {'county': '{county}'},
+    {'city': '{city}'},
+    {'carcinogen': 'true'},
+    {'pbt': 'true'},
+    {'chemical': 'lead'},
+    {'release_type': 'air'},
+    {'all': 'true'},
+    # a viewport around the sample facility, detailed and clustered
+    {'west': '{west}', 'south': '{south}', 'east': '{east}', 'north': '{north}', 'zoom': '12'},
+    {'west': '{west}', 'south': '{south}', 'east': '{east}', 'north': '{north}', 'zoom': '4'},
+]
+
+
+def seq_scans(cursor, sql):
+    """Returns the tables read with a sequential scan in the plan of 'sql'."""
+    if connection.vendor == 'postgresql':
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+        plan = cursor.fetchone()[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes, tables = [plan[0]['Plan']], []
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                tables.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return tables
+
+    # SQLite reports full table scans as 'SCAN <table>' (or 'SCAN TABLE <table>') without an index
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+    tables = []
+    for row in cursor.fetchall():
+        words = row[-1].split()
+        if words[0] == 'SCAN' and 'USING' not in words and 'SUBQUERY' not in words and 'CONSTANT' not in words:
+            tables.append(words[2] if words[1] == 'TABLE' else words[1])
+    return tables
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the SQL of every cacheable endpoint for representative parameters and reports ' \
+           'sequential scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--state', default='MI', help='State used in the representative requests.')
+        parser.add_argument('--year', type=int, help='Year used in the representative requests.')
+        parser.add_argument('--tables', default='releases,facilities',
+                            help='Comma separated tables whose sequential scans are reported.')
+        parser.add_argument('--fail', action='store_true', help='Exit with an error when a scan is reported.')
+
+    # every statement runs on 'default', whose connection the capture and EXPLAIN use (the replicas mirror it),
+    # and a cached response would run none
+    @override_settings(DATABASE_REPLICAS=[], RESPONSE_CACHE='none')
+    def handle(self, *args, **options):
+        state = options['state'].upper()
+        tables = set(t for t in options['tables'].split(',') if t)
+        sample = facility.objects.filter(state=state).exclude(county=None).exclude(city=None).exclude(
+            latitude=None).exclude(longitude=None).first()
+        if sample is None:
+            raise CommandError('No facility found in state {}'.format(state))
+        values = {'county': sample.county, 'city': sample.city,
+                  'west': sample.longitude - 0.5, 'south': sample.latitude - 0.5,
+                  'east': sample.longitude + 0.5, 'north': sample.latitude + 0.5}
+
+        factory = RequestFactory()
+        reported = 0
+        for pattern in get_resolver().url_patterns:
+            view = getattr(pattern, 'callback', None)
+            params = getattr(view, 'cache_params', None)
+            if params is None:
+                continue
+            call = async_to_sync(view) if asyncio.iscoroutinefunction(view) else view
+            path = reverse(view, kwargs={name: sample.id for name in pattern.pattern.converters})
+
+            seen = set()
+            for variant in VARIANTS:
+                query = {'state': state, **{k: v.format(**values) for k, v in variant.items()}}
+                if options['year'] is not None:
+                    query['year'] = options['year']
+                query = {k: v for k, v in query.items() if k in params}
+                key = tuple(sorted(query.items()))
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                # one query thread, so every statement runs on the captured connection
+                with CaptureQueriesContext(connection) as queries, override_settings(QUERY_WORKERS=1):
+                    response = call(factory.get(path, query), **{
+                        name: sample.id for name in pattern.pattern.converters})
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+
+                scans = []
+                with connection.cursor() as cursor:
+                    for q in queries:
+                        if q['sql'].lstrip().upper().startswith(('SELECT', 'WITH')):
+                            scans.extend(t for t in seq_scans(cursor, q['sql']) if t in tables)
+
+                label = '{} {}'.format(path, '&'.join('{}={}'.format(k, v) for k, v in key))
+                if scans:
+                    reported += 1
+                    self.stdout.write('{}: {} queries, sequential scan on {}'.format(
+                        label, len(queries), ', '.join(sorted(set(scans)))))
+                else:
+                    self.stdout.write('{}: {} queries, indexed'.format(label, len(queries)))
+
+        self.stdout.write('{} request(s) with sequential scans'.format(reported))
+        if reported and options['fail']:
+            raise CommandError('Sequential scans found')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from viewModule.models import Location
+from viewModule import locations, dataset
+
+
+class Command(BaseCommand):
+    help = 'Sets the county FIPS codes of the facility locations from a Census county file ' \
+           '(national_county2020.txt or national_county.txt), matching the counties by state and name.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Census county file.')
+        parser.add_argument('--encoding', default='latin-1', help='Encoding of the file.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], encoding=options['encoding'], newline='') as stream, transaction.atomic():
+                missing = locations.load_county_codes(Location, locations.read_counties(stream))
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError('{}: {}'.format(options['file'], error))
+
+        for state, county in missing:
+            self.stderr.write('No FIPS code for {} {}'.format(county, state))
+        self.stdout.write('{} of {} locations have a county FIPS code'.format(
+            Location.objects.exclude(county_fips=None).count(), Location.objects.count()))
+        # cached county responses carry the codes
+        dataset.bump()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from viewModule import ingest
+
+
+class Command(BaseCommand):
+    help = 'Loads EPA TRI basic data files (CSV, optionally .gz or .zip) and replaces the releases of the ' \
+           'years they hold, refreshing the rollups and the dataset version in the same transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Basic data files, e.g. 2020_us.csv ("-" reads stdin).')
+        parser.add_argument('--year', type=int, action='append', dest='years',
+                            help='Only load this year (repeatable). Defaults to every year in the files.')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Encoding of the files.')
+
+    def handle(self, *args, **options):
+        for path in options['files']:
+            self.stdout.write('Loading {}'.format(path))
+            try:
+                with ingest.open_csv(path, options['encoding']) as stream:
+                    ingest.load(stream, options['years'], log=self.stdout.write)
+            except (OSError, ValueError) as error:
+                raise CommandError('{}: {}'.format(path, error))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from viewModule import cache, warmup
+
+
+class Command(BaseCommand):
+    help = 'Precomputes the responses of the stats endpoints for every state at the latest year with the default ' \
+           'filter combinations, and reports the coverage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--state', action='append', dest='states',
+                            help='State to warm (repeatable). Defaults to every state with facilities.')
+        parser.add_argument('--year', type=int, help='Year to warm. Defaults to the latest year of the views.')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'CACHE_WARM_WORKERS', 2),
+                            help='Requests rendered in parallel.')
+        parser.add_argument('--db-limit', type=int, default=getattr(settings, 'CACHE_WARM_DB_LIMIT', 2),
+                            help='Requests allowed to query the database at the same time.')
+        parser.add_argument('--base-url', help='Warm a running server (e.g. http://localhost:8000) instead of '
+                                               'filling the cache from this process.')
+
+    def handle(self, *args, **options):
+        if options['base_url'] is None:
+            if cache.backend() is None:
+                raise CommandError('The response cache is disabled (RESPONSE_CACHE=none)')
+            if getattr(settings, 'RESPONSE_CACHE', 'local') == 'local':
+                # only the server processes can use their local caches
+                self.stderr.write('RESPONSE_CACHE=local only warms this process, use --base-url or '
+                                  'CACHE_WARM_INTERVAL to warm the servers')
+
+        states = None if options['states'] is None else [s.upper() for s in options['states']]
+        jobs = warmup.targets(states, options['year'])
+        report = warmup.warm(jobs, options['workers'], options['db_limit'], options['base_url'])
+
+        for path, counts in report['routes'].items():
+            self.stdout.write('{}: {warmed} warmed, {cached} cached, {skipped} skipped, {failed} failed'.format(
+                path, **counts))
+        self.stdout.write('{warmed} of {targets} responses warmed, {cached} already cached ({coverage}% coverage), '
+                          '{skipped} skipped, {failed} failed in {seconds} s'.format(**report))
+        if report['failed']:
+            raise CommandError('{} responses failed'.format(report['failed']))
@@ -0,0 +1,175 @@
+# Per-request cost accounting and per-route histograms
+# api.middleware.metrics.InstrumentationMiddleware opens a RequestStats for every request; the SQL of every
+# connection used on its behalf (including the query pool threads) is timed through an execute wrapper, and
+# encoding.respond() adds its serialization time. Finished requests are folded into per-process histograms
+# that the /_metrics endpoint renders in the Prometheus text format.
+import threading
+import time
+from contextlib import contextmanager
+from django.db import connections
+from viewModule import routing
+
+# bucket upper bounds of each histogram
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+# statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Costs of one request, shared by the threads working on it."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.sql = []
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.queries += 1
+                self.db_seconds += elapsed
+                if len(self.sql) < MAX_LOGGED_QUERIES:
+                    self.sql.append((round(elapsed * 1000, 3), sql))
+
+    def add_serialization(self, seconds):
+        with self._lock:
+            self.serialize_seconds += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current():
+    """Returns the stats of the request this thread works for, or None."""
+    return getattr(_local, 'stats', None)
+
+
+def start(stats):
+    """Attributes the queries of this thread's connections to 'stats' until stop()."""
+    # a streamed response that was never read leaves its request open on this thread
+    stop(current())
+    _local.stats = stats
+    for connection in connections.all():
+        connection.execute_wrappers.append(stats)
+
+
+def stop(stats):
+    if stats is None:
+        return
+    if current() is stats:
+        _local.stats = None
+    for connection in connections.all():
+        if stats in connection.execute_wrappers:
+            connection.execute_wrappers.remove(stats)
+
+
+@contextmanager
+def recording(stats):
+    """Attributes the queries run on this thread's connections (and serialization) to 'stats'."""
+    previous = current()
+    _local.stats = stats
+    # connections already attributed on this thread by start() are left alone
+    added = [] if stats is None else [c for c in connections.all() if stats not in c.execute_wrappers]
+    for connection in added:
+        connection.execute_wrappers.append(stats)
+    try:
+        yield
+    finally:
+        for connection in added:
+            if stats in connection.execute_wrappers:
+                connection.execute_wrappers.remove(stats)
+        _local.stats = previous
+
+
+@contextmanager
+def serializing(stats=None):
+    """Adds the time spent in the block to 'stats', by default the stats of this thread's request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = stats or current()
+        if stats is not None:
+            stats.add_serialization(time.perf_counter() - start)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, cumulative)
+
+
+# name -> (help text, buckets)
+HISTOGRAMS = {
+    'vet_request_seconds': ('Time spent answering the request', SECONDS_BUCKETS),
+    'vet_request_db_seconds': ('Time spent in SQL', SECONDS_BUCKETS),
+    'vet_request_serialize_seconds': ('Time spent serializing the response', SECONDS_BUCKETS),
+    'vet_request_queries': ('SQL statements executed', QUERY_BUCKETS),
+    'vet_response_bytes': ('Size of the response body', BYTES_BUCKETS),
+}
+
+_routes = {}
+_statuses = {}
+_lock = threading.Lock()
+
+
+def observe(route, status, values):
+    """Folds a finished request into the histograms of its route; 'values' maps histogram name -> value."""
+    with _lock:
+        histograms = _routes.get(route)
+        if histograms is None:
+            histograms = _routes[route] = {name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()}
+        for name, value in values.items():
+            histograms[name].observe(value)
+        _statuses[(route, status)] = _statuses.get((route, status), 0) + 1
+
+
+def render():
+    """Returns every metric of this process in the Prometheus text exposition format."""
+    lines = ['# HELP vet_requests_total Requests answered', '# TYPE vet_requests_total counter']
+    with _lock:
+        for (route, status), count in sorted(_statuses.items()):
+            lines.append('vet_requests_total{{route="{}",status="{}"}} {}'.format(route, status, count))
+        for name, (description, _) in HISTOGRAMS.items():
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} histogram'.format(name))
+            for route in sorted(_routes):
+                lines.extend(_routes[route][name].lines(name, 'route="{}"'.format(route)))
+    lines.extend(routing.metric_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _routes.clear()
+        _statuses.clear()
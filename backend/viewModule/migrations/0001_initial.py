@@ -0,0 +1,74 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chemical',
+            fields=[
+                ('id', models.TextField(db_column='compound_id', primary_key=True, serialize=False)),
+                ('name', models.TextField(blank=True, db_column='chemical', null=True)),
+                ('clean_air_act_chemical', models.CharField(blank=True, max_length=100, null=True)),
+                ('classification', models.CharField(blank=True, max_length=100, null=True)),
+                ('metal_category', models.IntegerField(blank=True, null=True)),
+                ('carcinogen', models.TextField(blank=True, null=True)),
+                ('unit_of_measure', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'chemicals',
+            },
+        ),
+        migrations.CreateModel(
+            name='Facility',
+            fields=[
+                ('id', models.TextField(db_column='trf_id', primary_key=True, serialize=False)),
+                ('name', models.TextField(blank=True, db_column='facility_name', null=True)),
+                ('street_address', models.TextField(blank=True, null=True)),
+                ('city', models.TextField(blank=True, null=True)),
+                ('county', models.TextField(blank=True, null=True)),
+                ('state', models.TextField(blank=True, null=True)),
+                ('zip', models.IntegerField(blank=True, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('parent_co_name', models.TextField(blank=True, db_column='resoved_parent_co', null=True)),
+                ('industry_sector_code', models.TextField(blank=True, null=True)),
+                ('industry_sector', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'facilities',
+            },
+        ),
+        migrations.CreateModel(
+            name='Release',
+            fields=[
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('doc_ctrl_num', models.TextField(primary_key=True, serialize=False)),
+                ('air', models.FloatField(blank=True, db_column='vet_total_air_releases', null=True)),
+                ('water', models.FloatField(blank=True, db_column='water', null=True)),
+                ('land', models.FloatField(blank=True, db_column='vet_total_land_releases', null=True)),
+                ('on_site', models.FloatField(blank=True, db_column='onsite_release_total', null=True)),
+                ('off_site', models.FloatField(blank=True, db_column='offsite_release_total', null=True)),
+                ('total', models.FloatField(blank=True, db_column='total_releases', null=True)),
+                ('chemical', models.ForeignKey(db_column='compound_id', on_delete=django.db.models.deletion.CASCADE, to='viewModule.chemical')),
+                ('facility', models.ForeignKey(db_column='trf_id', on_delete=django.db.models.deletion.CASCADE, to='viewModule.facility')),
+            ],
+            options={
+                'db_table': 'releases',
+                'ordering': ['total'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chemical',
+            name='facilities',
+            field=models.ManyToManyField(through='viewModule.Release', to='viewModule.Facility'),
+        ),
+    ]
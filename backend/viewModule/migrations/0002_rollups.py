@@ -0,0 +1,58 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacilityCountRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('state', models.TextField(blank=True, null=True)),
+                ('county', models.TextField(blank=True, null=True)),
+                ('num_facilities', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'facility_count_rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReleaseRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('state', models.TextField(blank=True, null=True)),
+                ('county', models.TextField(blank=True, null=True)),
+                ('carcinogen', models.BooleanField(default=False)),
+                ('pbt', models.BooleanField(default=False)),
+                ('positive', models.BooleanField(default=False)),
+                ('air', models.FloatField(blank=True, null=True)),
+                ('water', models.FloatField(blank=True, null=True)),
+                ('land', models.FloatField(blank=True, null=True)),
+                ('on_site', models.FloatField(blank=True, null=True)),
+                ('off_site', models.FloatField(blank=True, null=True)),
+                ('total', models.FloatField(blank=True, null=True)),
+                ('num_releases', models.IntegerField(default=0)),
+                ('chemical', models.ForeignKey(db_column='compound_id', on_delete=django.db.models.deletion.CASCADE, to='viewModule.chemical')),
+            ],
+            options={
+                'db_table': 'release_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='facilitycountrollup',
+            index=models.Index(fields=['year', 'state', 'county'], name='facility_co_year_286394_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='releaserollup',
+            index=models.Index(fields=['year', 'state', 'county'], name='release_rol_year_dff41e_idx'),
+        ),
+    ]
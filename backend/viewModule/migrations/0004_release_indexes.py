@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0003_dataset_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='facility',
+            index=models.Index(fields=['state', 'county', 'city'], name='facilities_geo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='release',
+            index=models.Index(fields=['year', 'facility'], name='releases_year_trf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='release',
+            index=models.Index(fields=['facility', 'year'], name='releases_trf_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='release',
+            index=models.Index(fields=['chemical', 'year'], name='releases_compound_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='release',
+            index=models.Index(condition=models.Q(total__gt=0), fields=['year', 'facility'], name='releases_positive_year_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.2 on 2026-10-18 16:34
+
+from django.db import migrations, models
+from viewModule.spatial import cell
+
+
+def fill_grid_cells(apps, schema_editor):
+    Facility = apps.get_model('viewModule', 'Facility')
+    facilities = list(Facility.objects.exclude(latitude=None).exclude(longitude=None).only('id', 'latitude', 'longitude'))
+    for facility in facilities:
+        facility.grid_cell = cell(facility.latitude, facility.longitude)
+    Facility.objects.bulk_update(facilities, ['grid_cell'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0004_release_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facility',
+            name='grid_cell',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='facility',
+            index=models.Index(fields=['grid_cell'], name='facilities_grid_idx'),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+    ]
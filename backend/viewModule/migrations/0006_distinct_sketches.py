@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0005_facility_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistinctSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('state', models.TextField(blank=True, null=True)),
+                ('county', models.TextField(blank=True, null=True)),
+                ('carcinogen', models.BooleanField(default=False)),
+                ('pbt', models.BooleanField(default=False)),
+                ('facilities', models.BinaryField()),
+                ('chemicals', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'distinct_sketches',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='distinctsketch',
+            index=models.Index(fields=['year', 'state', 'county'], name='distinct_sk_year_bc5f5c_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.2 on 2026-10-18 17:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+from viewModule import parents
+
+
+def link_parent_companies(apps, schema_editor):
+    parents.link(apps.get_model('viewModule', 'Facility'), apps.get_model('viewModule', 'ParentCompany'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0006_distinct_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParentCompany',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+                ('key', models.TextField(unique=True)),
+            ],
+            options={
+                'db_table': 'parent_companies',
+            },
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='parent_co',
+            field=models.ForeignKey(blank=True, db_column='parent_co_id', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='facilities', to='viewModule.parentcompany'),
+        ),
+        migrations.RunPython(link_parent_companies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.2 on 2026-10-18 17:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+from viewModule import locations
+
+
+def link_locations(apps, schema_editor):
+    locations.link(apps.get_model('viewModule', 'Facility'), apps.get_model('viewModule', 'Location'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewModule', '0007_parent_companies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.TextField()),
+                ('county', models.TextField(blank=True, null=True)),
+                ('state_fips', models.SmallIntegerField(blank=True, null=True)),
+                ('county_fips', models.SmallIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'locations',
+                'unique_together': {('state', 'county')},
+            },
+        ),
+        migrations.AddField(
+            model_name='facility',
+            name='location',
+            field=models.ForeignKey(blank=True, db_column='location_id', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='facilities', to='viewModule.location'),
+        ),
+        migrations.RunPython(link_locations, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,34 @@
 from django.db import models
+from viewModule import spatial, parents, locations
+
+
+# Parent companies, one per canonical key of the reported name variants (see viewModule/parents.py)
+class ParentCompany(models.Model):
+    # the variant reported by the most facilities
+    name = models.TextField()
+    key = models.TextField(unique=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        db_table = 'parent_companies'
+
+
+# Reported (state, county) pairs with their FIPS codes (see viewModule/locations.py)
+class Location(models.Model):
+    state = models.TextField()
+    county = models.TextField(blank=True, null=True)
+    state_fips = models.SmallIntegerField(blank=True, null=True)
+    # 3-digit code within the state, set by 'manage.py load_county_fips'
+    county_fips = models.SmallIntegerField(blank=True, null=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.state, self.county)
+
+    class Meta:
+        db_table = 'locations'
+        unique_together = [('state', 'county')]
 
 
 # Model class to reflect 'facilities' table
@@ -14,14 +44,63 @@ class Facility(models.Model):
     longitude = models.FloatField(blank=True, null=True)
     parent_co_name = models.TextField(
         db_column="resoved_parent_co", blank=True, null=True)
+    # (state, county) of the facility, kept in step by save() and locations.link()
+    location = models.ForeignKey(Location, db_column='location_id', related_name='facilities',
+                                 blank=True, null=True, on_delete=models.SET_NULL)
+    # canonical company of parent_co_name, kept in step by save() and parents.link()
+    parent_co = models.ForeignKey(ParentCompany, db_column='parent_co_id', related_name='facilities',
+                                  blank=True, null=True, on_delete=models.SET_NULL)
     industry_sector_code = models.TextField(blank=True, null=True)
     industry_sector = models.TextField(blank=True, null=True)
+    # Z-order cell of (latitude, longitude), see viewModule/spatial.py
+    grid_cell = models.BigIntegerField(blank=True, null=True)
+
+    # the columns save() resolves the foreign keys from
+    SOURCES = ('parent_co_name', 'state', 'county')
+    # values of those columns when the facility was last loaded or saved
+    _stored_sources = None
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_sources = instance._sources()
+        return instance
+
+    def _sources(self):
+        return {name: self.__dict__[name] for name in self.SOURCES if name in self.__dict__}
+
+    def _changed(self, *names):
+        stored = self._stored_sources or {}
+        return any(name not in stored or stored[name] != getattr(self, name) for name in names)
+
+    # Resolves the foreign keys whose columns changed since the facility was loaded. Queryset update(),
+    # bulk_create() and bulk_update() skip save(), so code writing those columns in bulk must call
+    # parents.link() and locations.link() afterwards, as load_tri and the benchmark generator do.
+    def save(self, *args, **kwargs):
+        self.grid_cell = spatial.cell(self.latitude, self.longitude)
+        resolved = []
+        if self._changed('parent_co_name'):
+            self.parent_co = parents.resolve(ParentCompany, self.parent_co_name)
+            resolved.append('parent_co')
+        if self._changed('state', 'county'):
+            self.location = locations.resolve(Location, self.state, self.county)
+            resolved.append('location')
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *resolved}
+        super().save(*args, **kwargs)
+        self._stored_sources = self._sources()
+
     class Meta:
         db_table = 'facilities'
+        indexes = [
+            # geo_filter() narrows on state, then county, then city
+            models.Index(fields=['state', 'county', 'city'], name='facilities_geo_idx'),
+            # viewport queries scan ranges of cells
+            models.Index(fields=['grid_cell'], name='facilities_grid_idx'),
+        ]
 
 
 # Model class to reflect 'chemicals' table
@@ -69,3 +148,87 @@ class Release(models.Model):
     class Meta:
         db_table = 'releases'
         ordering = ['total']
+        indexes = [
+            # yearly stats join the releases of a year to their facilities
+            models.Index(fields=['year', 'facility'], name='releases_year_trf_idx'),
+            # timelines span every year of the facilities in a location
+            models.Index(fields=['facility', 'year'], name='releases_trf_year_idx'),
+            # chemical searches resolve to compound ids (see chemical_search.py)
+            models.Index(fields=['chemical', 'year'], name='releases_compound_year_idx'),
+            # most endpoints only read releases with a positive total
+            models.Index(fields=['year', 'facility'], condition=models.Q(total__gt=0),
+                         name='releases_positive_year_idx'),
+        ]
+
+
+# Pre-summed releases at the year/state/county/chemical grain, rebuilt by 'manage.py build_rollups'
+class ReleaseRollup(models.Model):
+    year = models.IntegerField()
+    state = models.TextField(blank=True, null=True)
+    county = models.TextField(blank=True, null=True)
+    chemical = models.ForeignKey(
+        Chemical, db_column="compound_id", on_delete=models.CASCADE)
+    carcinogen = models.BooleanField(default=False)
+    pbt = models.BooleanField(default=False)
+    # true when the summed releases all had a positive total (mirrors the 'total > 0' filter)
+    positive = models.BooleanField(default=False)
+    air = models.FloatField(blank=True, null=True)
+    water = models.FloatField(blank=True, null=True)
+    land = models.FloatField(blank=True, null=True)
+    on_site = models.FloatField(blank=True, null=True)
+    off_site = models.FloatField(blank=True, null=True)
+    total = models.FloatField(blank=True, null=True)
+    num_releases = models.IntegerField(default=0)
+
+    def __str__(self):
+        return 'Rollup for: {} {} {}'.format(self.year, self.state, self.county)
+
+    class Meta:
+        db_table = 'release_rollups'
+        indexes = [models.Index(fields=['year', 'state', 'county'])]
+
+
+# Distinct facility counts at the year/state/county grain (additive across counties)
+class FacilityCountRollup(models.Model):
+    year = models.IntegerField()
+    state = models.TextField(blank=True, null=True)
+    county = models.TextField(blank=True, null=True)
+    num_facilities = models.IntegerField(default=0)
+
+    def __str__(self):
+        return 'Facility count for: {} {} {}'.format(self.year, self.state, self.county)
+
+    class Meta:
+        db_table = 'facility_count_rollups'
+        indexes = [models.Index(fields=['year', 'state', 'county'])]
+
+
+# HyperLogLog sketches of the distinct facilities and chemicals at the year/state/county/chemical-flag grain
+# (see sketches.py), rebuilt with the rollups
+class DistinctSketch(models.Model):
+    year = models.IntegerField()
+    state = models.TextField(blank=True, null=True)
+    county = models.TextField(blank=True, null=True)
+    carcinogen = models.BooleanField(default=False)
+    pbt = models.BooleanField(default=False)
+    facilities = models.BinaryField()
+    chemicals = models.BinaryField()
+
+    def __str__(self):
+        return 'Distinct sketch for: {} {} {}'.format(self.year, self.state, self.county)
+
+    class Meta:
+        db_table = 'distinct_sketches'
+        indexes = [models.Index(fields=['year', 'state', 'county'])]
+
+
+# Version of the loaded TRI dataset, bumped whenever the data (or anything derived from it) is reloaded
+class DatasetVersion(models.Model):
+    version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return 'Dataset version {}'.format(self.version)
+
+    class Meta:
+        db_table = 'dataset_version'
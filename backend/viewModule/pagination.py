@@ -0,0 +1,72 @@
+# Keyset pagination of the all=true lists
+# A page is the next 'page_size' groups after the group key the previous page ended on, so every page costs
+# an index range instead of an OFFSET over the groups before it. The key travels to the client in an opaque,
+# signed continuation token. Groups are ordered by key with the NULL key last on every database.
+import base64
+import json
+from django.core import signing
+from django.db.models import Count, F, Q
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SALT = 'vet.pagination'
+
+
+def requested(spec):
+    """Returns True when the client asked for pages (a page size or a continuation token)."""
+    return spec.page_size is not None or spec.cursor is not None
+
+
+def page_size(spec):
+    return max(1, min(DEFAULT_PAGE_SIZE if spec.page_size is None else spec.page_size, MAX_PAGE_SIZE))
+
+
+def encode(key):
+    # the same key always gives the same token, so the pages stay cacheable
+    value = base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+    return signing.Signer(salt=SALT).sign(value)
+
+
+def decode(token):
+    """Returns the group key a token continues after (ValueError on a token this API didn't issue)."""
+    try:
+        value = signing.Signer(salt=SALT).unsign(token)
+    except signing.BadSignature as error:
+        raise ValueError('invalid continuation token') from error
+    return json.loads(base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)))
+
+
+def _result(rows, field, size):
+    more = len(rows) > size
+    rows = rows[:size]
+    return {'results': rows, 'next': encode(rows[-1][field]) if more else None}
+
+
+def page(queryset, field, spec):
+    """Returns {'results': rows, 'next': token or None} of the grouped 'queryset' ordered by 'field'."""
+    size = page_size(spec)
+    queryset = queryset.order_by(F(field).asc(nulls_last=True))
+    if spec.cursor is not None:
+        after = decode(spec.cursor)
+        # the NULL key is last, nothing comes after it
+        queryset = queryset.none() if after is None else queryset.filter(
+            Q(**{field + '__gt': after}) | Q(**{field + '__isnull': True}))
+    return _result(list(queryset[:size + 1]), field, size)
+
+
+def page_rows(rows, field, spec):
+    """page() over rows already in memory, sorted by 'field' with None last."""
+    size = page_size(spec)
+    if spec.cursor is not None:
+        after = decode(spec.cursor)
+        rows = [] if after is None else [row for row in rows if row[field] is None or row[field] > after]
+    return _result(rows[:size + 1], field, size)
+
+
+def count(queryset, field, measure):
+    """Returns the number of groups of 'field' with a positive sum of 'measure' in the ungrouped 'queryset'.
+    The measures are never negative, so that is the number of keys with a positive row: one aggregate without
+    the GROUP BY of the list itself."""
+    counts = queryset.filter(**{measure + '__gt': 0}).aggregate(
+        keys=Count(field, distinct=True), nulls=Count('pk', filter=Q(**{field + '__isnull': True})))
+    return counts['keys'] + (1 if counts['nulls'] else 0)
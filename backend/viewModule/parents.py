@@ -0,0 +1,81 @@
+# Canonical parent companies
+# Facilities report their parent company as free text, with spelling variants of the same company ('ACME CORP',
+# 'Acme Corporation', 'ACME CORP.'). The variants sharing a canonical key (upper-cased, punctuation and a trailing
+# legal form dropped) are one ParentCompany with an integer id, which the parent-company aggregates group and
+# join on. link() rebuilds the companies from the reported names after a bulk load; Facility.save() resolves a
+# single name when it changed. Queryset update() and the bulk writes skip save(), so whatever writes the names
+# that way must call link() afterwards. The functions take the models as arguments so the migrations can run
+# them on historical models.
+import re
+from collections import Counter
+from django.db.models import Count
+
+# legal forms dropped from the end of a key, spelled out or abbreviated
+SUFFIXES = {'INC', 'INCORPORATED', 'CORP', 'CORPORATION', 'CO', 'COMPANY', 'LLC', 'LP', 'LLP', 'LTD', 'LIMITED',
+            'PLC', 'SA', 'NV', 'AG'}
+
+# facilities updated per statement
+BATCH_SIZE = 500
+
+
+def canonical_key(name):
+    """Returns the key shared by the spelling variants of a company name, None for a name without one."""
+    if name is None:
+        return None
+    # 'L.L.C.' and 'O'NEIL' stay one word
+    text = re.sub(r"[.']", '', name.upper()).replace('&', ' AND ')
+    words = re.sub(r'[^0-9A-Z]+', ' ', text).split()
+    if len(words) > 1 and words[0] == 'THE':
+        words = words[1:]
+    while len(words) > 1 and words[-1] in SUFFIXES:
+        words.pop()
+    return ' '.join(words) or None
+
+
+def resolve(company_model, name):
+    """Returns the company of the reported 'name', creating it when its key is new (None without a key)."""
+    key = canonical_key(name)
+    if key is None:
+        return None
+    company, _ = company_model.objects.get_or_create(key=key, defaults={'name': name})
+    return company
+
+
+def link(facility_model, company_model):
+    """Rebuilds the companies from the parent names of the facilities and links every facility to its company.
+    Existing companies keep their id; a company is named after its most reported variant, and companies no
+    facility reports any more are deleted. Returns the number of companies."""
+    reported = facility_model.objects.exclude(parent_co_name=None).order_by().values_list(
+        'parent_co_name').annotate(n=Count('pk'))
+    variants = {}
+    for name, n in reported:
+        key = canonical_key(name)
+        if key is not None:
+            variants.setdefault(key, Counter())[name] += n
+
+    companies = {company.key: company for company in company_model.objects.all()}
+    created, renamed = [], []
+    for key, counts in variants.items():
+        name = min(counts, key=lambda variant: (-counts[variant], len(variant), variant))
+        company = companies.get(key)
+        if company is None:
+            created.append(company_model(key=key, name=name))
+        elif company.name != name:
+            company.name = name
+            renamed.append(company)
+    company_model.objects.bulk_create(created, batch_size=BATCH_SIZE)
+    company_model.objects.bulk_update(renamed, ['name'], batch_size=BATCH_SIZE)
+
+    # bulk_create doesn't return the ids on every database; names without a key (blank or punctuation) belong
+    # to no company
+    ids = dict(company_model.objects.values_list('key', 'id'))
+    company_of = {name: ids[key] for key, counts in variants.items() for name in counts}
+    # one pass over the facilities, updating the changed ones by primary key
+    changed = [facility_model(pk=pk, parent_co_id=company_of.get(name))
+               for pk, name, company_id in facility_model.objects.order_by().values_list(
+                   'pk', 'parent_co_name', 'parent_co').iterator(chunk_size=BATCH_SIZE)
+               if company_of.get(name) != company_id]
+    facility_model.objects.bulk_update(changed, ['parent_co'], batch_size=BATCH_SIZE)
+
+    company_model.objects.filter(facilities=None).delete()
+    return len(variants)
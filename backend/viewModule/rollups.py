@@ -0,0 +1,103 @@
+# Precomputed aggregates over the 'releases' table
+# The TRI data only changes when a new year is loaded, so the sums behind the stats endpoints are stored
+# at the year/state/county/chemical grain by 'manage.py build_rollups' and read back from there, along with the
+# distinct count sketches of sketches.py.
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import Q, Sum, Count, Case, When, Value, BooleanField
+from viewModule.models import Release as release
+from viewModule.models import ReleaseRollup as release_rollup
+from viewModule.models import FacilityCountRollup as facility_count_rollup
+from viewModule import sketches
+
+# measures summed into the rollup, in the order they are stored
+MEASURES = ['air', 'water', 'land', 'on_site', 'off_site', 'total']
+
+# years known to have rollups in this process, filled lazily by is_built()
+_built_years = set()
+
+
+def _flag(condition):
+    return Case(When(condition, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+def _insert_select(model, queryset, columns):
+    """Copies the rows of a values() queryset into the table of 'model' without leaving the database."""
+    query = queryset.query
+    names = [*query.extra_select, *query.values_select, *query.annotation_select]
+    sql, params = query.get_compiler(connection=connection).as_sql()
+    targets = [model._meta.get_field(columns[name]).column for name in names]
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {} ({}) {}'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(t) for t in targets), sql), params)
+
+
+def build(year):
+    """Rebuilds the rollups of a single year inside one transaction."""
+    source = release.objects.filter(year=year).order_by()
+
+    releases = source.annotate(
+        carcinogen_flag=_flag(Q(chemical__carcinogen='YES')),
+        pbt_flag=_flag(Q(chemical__classification='PBT')),
+        positive_flag=_flag(Q(total__gt=0))).values(
+        'year', 'facility__state', 'facility__county', 'chemical', 'carcinogen_flag', 'pbt_flag',
+        'positive_flag').annotate(**{m: Sum(m) for m in MEASURES}, num_releases=Count('doc_ctrl_num'))
+
+    facilities = source.values('year', 'facility__state', 'facility__county').annotate(
+        num_facilities=Count('facility', distinct=True))
+
+    geo_columns = {'year': 'year', 'facility__state': 'state', 'facility__county': 'county'}
+
+    with transaction.atomic():
+        release_rollup.objects.filter(year=year).delete()
+        facility_count_rollup.objects.filter(year=year).delete()
+        _insert_select(release_rollup, releases, {
+            **geo_columns, 'chemical': 'chemical', 'carcinogen_flag': 'carcinogen', 'pbt_flag': 'pbt',
+            'positive_flag': 'positive', 'num_releases': 'num_releases', **{m: m for m in MEASURES}})
+        _insert_select(facility_count_rollup, facilities, {
+            **geo_columns, 'num_facilities': 'num_facilities'})
+        sketches.build(year)
+    reset()
+
+
+def reset():
+    """Forgets which years are known to be built (after a rebuild or in tests)."""
+    _built_years.clear()
+    sketches.reset()
+
+
+def is_built(year):
+    # read from 'default': a lagging replica must not decide for the whole process
+    if year not in _built_years and release_rollup.objects.using(DEFAULT_DB_ALIAS).filter(year=year).exists():
+        _built_years.add(year)
+    return year in _built_years
+
+
+''' Returns True when the filters of 'spec' can be answered from the rollups of its year. '''
+
+
+def can_answer(spec):
+    if not getattr(settings, 'USE_ROLLUPS', True):
+        return False
+    return spec.rollup_eligible() and is_built(spec.year)
+
+
+''' Returns the location summary of year 'y' from the rollups, in the same shape as the 'releases' aggregate.
+    Without 'chemicals' the distinct chemicals are left uncounted (None), for the caller to take from the sketches.'''
+
+
+def summary(filters, y, chemicals=True):
+    distinct = {'num_chemicals': Count('chemical', distinct=True)} if chemicals else {}
+    raw = release_rollup.objects.filter(filters & Q(year=y)).aggregate(
+        total=Sum('total'), **distinct,
+        total_air=Sum('air'), total_water=Sum('water'), total_land=Sum('land'),
+        total_on_site=Sum('on_site'), total_off_site=Sum('off_site'),
+        total_carcinogen=Sum('total', filter=Q(carcinogen=True)))
+    facilities = facility_count_rollup.objects.filter(filters & Q(year=y)).aggregate(
+        num_facilities=Sum('num_facilities'))['num_facilities']
+
+    return {'total': raw['total'], 'num_facilities': facilities or 0, 'num_chemicals': raw.get('num_chemicals'),
+            'total_air': raw['total_air'], 'total_water': raw['total_water'], 'total_land': raw['total_land'],
+            'total_on_site': raw['total_on_site'], 'total_off_site': raw['total_off_site'],
+            'total_carcinogen': raw['total_carcinogen']}
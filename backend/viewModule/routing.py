@@ -0,0 +1,246 @@
+# Read routing over the database replicas and health of the persistent connections
+# The API never writes the TRI tables, so their reads go round-robin to the DATABASE_REPLICAS aliases (replicas
+# of 'default') while writes, migrations, other apps and anything inside a transaction stay on 'default'.
+# A request is pinned to the replica of its first read, so replicas lagging by different amounts never serve
+# parts of the same response, and the dataset version its cache keys and ETags hang on is read from 'default'.
+# A replica that fails a health check or a query is left out for DB_REPLICA_RETRY_SECONDS and its reads move to
+# the next one, or to 'default' when none is left. Connections stay open for CONN_MAX_AGE seconds and are
+# checked before they are reused after DB_HEALTH_CHECK_INTERVAL idle seconds. The counters behind all of it
+# are rendered with the request metrics at /_metrics.
+import itertools
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# apps whose reads may be served by a replica
+ROUTED_APPS = ('viewModule',)
+# models read from 'default' even when replicas are set
+PRIMARY_MODELS = ('viewModule.DatasetVersion',)
+
+# name -> (help text, metric type)
+COUNTERS = {
+    'reads': ('Reads of the TRI tables routed to the database', 'counter'),
+    'connects': ('Connections opened', 'counter'),
+    'health_checks': ('Health checks of a connection', 'counter'),
+    'failed_health_checks': ('Health checks that failed', 'counter'),
+    'errors': ('Statements that failed with a connection error', 'counter'),
+}
+
+_lock = threading.Lock()
+_local = threading.local()
+_turn = itertools.count()
+# alias -> time.monotonic() when a failed replica is tried again
+_down_until = {}
+# alias -> {counter: value}
+_counts = {}
+# every connection wrapper that connected once, to count the open ones
+_wrappers = weakref.WeakSet()
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def _count(alias, name):
+    with _lock:
+        counts = _counts.setdefault(alias, dict.fromkeys(COUNTERS, 0))
+        counts[name] += 1
+
+
+def is_up(alias):
+    return _down_until.get(alias, 0) <= time.monotonic()
+
+
+def mark_down(alias, error):
+    if alias not in replicas():
+        return
+    retry = getattr(settings, 'DB_REPLICA_RETRY_SECONDS', 30)
+    _down_until[alias] = time.monotonic() + retry
+    logger.warning('Database replica %s failed (%s), leaving it out for %s seconds', alias, error, retry)
+
+
+def check(alias):
+    """Returns True when this thread's connection to 'alias' works, connecting it if needed; an open connection
+    is only checked again after DB_HEALTH_CHECK_INTERVAL seconds."""
+    checked = _local.__dict__.setdefault('checked', {})
+    connection = connections[alias]
+    now = time.monotonic()
+    if connection.connection is not None and now - checked.get(alias, -1e9) < getattr(
+            settings, 'DB_HEALTH_CHECK_INTERVAL', 10):
+        return True
+
+    _count(alias, 'health_checks')
+    try:
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+        connection.ensure_connection()
+    except DatabaseError as error:
+        _count(alias, 'failed_health_checks')
+        mark_down(alias, error)
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+        return False
+    checked[alias] = now
+    return True
+
+
+def check_connections():
+    """Checks the open connections of this thread that sat idle for a while (at the start of a request)."""
+    for alias in connections:
+        connection = connections[alias]
+        if connection.connection is not None and not connection.in_atomic_block:
+            check(alias)
+
+
+def replica_errors():
+    with _lock:
+        return sum(_counts.get(alias, {}).get('errors', 0) + _counts.get(alias, {}).get('failed_health_checks', 0)
+                   for alias in replicas())
+
+
+class Pin:
+    """The database the reads of one request go to, picked by its first read and shared by the threads working
+    on the request."""
+
+    def __init__(self):
+        self.alias = None
+        self._lock = threading.Lock()
+
+
+def current_pin():
+    """Returns the pin of the request this thread works for, or None."""
+    return getattr(_local, 'pin', None)
+
+
+def start(pin):
+    """Pins the reads of this thread to 'pin' until the next request replaces it."""
+    _local.pin = pin
+
+
+@contextmanager
+def pinned(pin):
+    """Pins the reads of this thread to 'pin' (a pool thread working for a request)."""
+    previous = current_pin()
+    _local.pin = pin
+    try:
+        yield
+    finally:
+        _local.pin = previous
+
+
+def _pick(pool):
+    start = next(_turn)
+    for i in range(len(pool)):
+        alias = pool[(start + i) % len(pool)]
+        if is_up(alias) and check(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def _usable(alias):
+    return alias == DEFAULT_DB_ALIAS or (is_up(alias) and check(alias))
+
+
+class ReplicaRouter:
+    """Reads of the TRI tables from a healthy replica, everything else from 'default'."""
+
+    def db_for_read(self, model, **hints):
+        pool = replicas()
+        if not pool or model._meta.app_label not in ROUTED_APPS:
+            return None
+        if model._meta.label in PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        # a transaction must read its own writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+
+        pin = current_pin()
+        if pin is None:
+            alias = _pick(pool)
+        else:
+            # a pinned replica that failed since is replaced for the rest of the request
+            with pin._lock:
+                if pin.alias is None or not _usable(pin.alias):
+                    pin.alias = _pick(pool)
+                alias = pin.alias
+        _count(alias, 'reads')
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as 'default'
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from 'default'
+        return False if db in replicas() else None
+
+
+class ErrorWatcher:
+    """Execute wrapper taking a replica out of the rotation when its statements fail to reach it."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError) as error:
+            _count(self.alias, 'errors')
+            mark_down(self.alias, error)
+            raise
+
+
+def _connected(sender, connection, **kwargs):
+    _count(connection.alias, 'connects')
+    _wrappers.add(connection)
+    if not any(isinstance(wrapper, ErrorWatcher) for wrapper in connection.execute_wrappers):
+        connection.execute_wrappers.append(ErrorWatcher(connection.alias))
+
+
+connection_created.connect(_connected)
+
+
+def stats():
+    """Returns alias -> {'up': bool, 'open': open connections of this process, counter: value}."""
+    open_connections = {}
+    for wrapper in list(_wrappers):
+        if wrapper.connection is not None:
+            open_connections[wrapper.alias] = open_connections.get(wrapper.alias, 0) + 1
+    with _lock:
+        return {alias: {'up': is_up(alias), 'open': open_connections.get(alias, 0),
+                        **_counts.get(alias, dict.fromkeys(COUNTERS, 0))} for alias in connections}
+
+
+def metric_lines():
+    """Returns the connection metrics in the Prometheus text format."""
+    current = stats()
+    lines = ['# HELP vet_db_up Whether the database takes reads', '# TYPE vet_db_up gauge']
+    lines.extend('vet_db_up{{alias="{}"}} {}'.format(alias, int(s['up'])) for alias, s in current.items())
+    lines.extend(['# HELP vet_db_connections_open Open connections of this process',
+                  '# TYPE vet_db_connections_open gauge'])
+    lines.extend('vet_db_connections_open{{alias="{}"}} {}'.format(alias, s['open']) for alias, s in current.items())
+    for name, (description, kind) in COUNTERS.items():
+        metric = 'vet_db_{}_total'.format(name)
+        lines.extend(['# HELP {} {}'.format(metric, description), '# TYPE {} {}'.format(metric, kind)])
+        lines.extend('{}{{alias="{}"}} {}'.format(metric, alias, s[name]) for alias, s in current.items())
+    return lines
+
+
+def reset():
+    with _lock:
+        _down_until.clear()
+        _counts.clear()
+    _local.__dict__.pop('checked', None)
+    _local.__dict__.pop('pin', None)
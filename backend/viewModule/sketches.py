@@ -0,0 +1,173 @@
+# Approximate distinct counts from HyperLogLog sketches
+# COUNT(DISTINCT) can't be summed across rows, so the rollups alone can't give the number of chemicals of a
+# location, nor the facilities releasing carcinogens. 'manage.py build_rollups' also stores a HyperLogLog sketch
+# of the facilities and one of the chemicals of every year/state/county/carcinogen/pbt group; merging the
+# sketches of the groups a request selects estimates its distinct counts with a relative error of about 1.6%.
+# Facilities belong to a single county, so without a chemical flag their exact counts per county add up and are
+# read from the facility count rollups instead. Requests with a chemical search or a city, or with exact=true,
+# count the releases exactly.
+import hashlib
+import math
+import struct
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q, Sum
+from viewModule.models import Release as release
+from viewModule.models import DistinctSketch as distinct_sketch
+from viewModule.models import FacilityCountRollup as facility_count_rollup
+from viewModule.filters import ROLLUPS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 2**PRECISION registers of one byte each
+PRECISION = 12
+REGISTERS = 1 << PRECISION
+# bits of the hash left for the rank once the register index is taken
+RANK_BITS = 64 - PRECISION
+# a sparse sketch stores (index, rank) as 3 bytes, worth it while fewer than a third of the registers are set
+SPARSE, DENSE = b'S', b'D'
+_pair = struct.Struct('>HB')
+
+# group key columns of the location lists
+GROUPS = {None: (), 'state': ('state',), 'county': ('county', 'state')}
+
+# years known to have sketches in this process, filled lazily by is_built()
+_built_years = set()
+
+
+class HyperLogLog:
+    """A sketch of the distinct values added to it."""
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(REGISTERS) if registers is None else registers
+
+    def add(self, value):
+        h = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index, rest = h >> RANK_BITS, h & ((1 << RANK_BITS) - 1)
+        rank = RANK_BITS - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        return estimate(self.registers)
+
+    def to_bytes(self):
+        pairs = [(i, r) for i, r in enumerate(self.registers) if r]
+        if 3 * len(pairs) < REGISTERS:
+            return SPARSE + b''.join(_pair.pack(i, r) for i, r in pairs)
+        return DENSE + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        if data[:1] == DENSE:
+            return cls(bytearray(data[1:]))
+        registers = bytearray(REGISTERS)
+        for i, r in _pair.iter_unpack(data[1:]):
+            registers[i] = r
+        return cls(registers)
+
+
+def estimate(registers):
+    """The HyperLogLog estimate of the registers, with linear counting for small cardinalities."""
+    m = len(registers)
+    if np is not None:
+        registers = np.asarray(registers, dtype=np.float64)
+        harmonic = float(np.sum(np.exp2(-registers)))
+        zeros = int(np.count_nonzero(registers == 0))
+    else:
+        harmonic = sum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+    raw = 0.7213 / (1 + 1.079 / m) * m * m / harmonic
+    if raw <= 2.5 * m and zeros:
+        return int(round(m * math.log(m / zeros)))
+    return int(round(raw))
+
+
+def merge(blobs):
+    """Returns the registers of the union of the serialized sketches."""
+    if np is None:
+        registers = bytearray(REGISTERS)
+        for blob in blobs:
+            registers = bytearray(map(max, registers, HyperLogLog.from_bytes(blob).registers))
+        return registers
+
+    registers = np.zeros(REGISTERS, dtype=np.uint8)
+    for blob in blobs:
+        blob = bytes(blob)
+        if blob[:1] == DENSE:
+            np.maximum(registers, np.frombuffer(blob, dtype=np.uint8, offset=1), out=registers)
+        else:
+            pairs = np.frombuffer(blob, dtype=[('index', '>u2'), ('rank', 'u1')], offset=1)
+            np.maximum.at(registers, pairs['index'].astype(np.intp), pairs['rank'])
+    return registers
+
+
+def build(year):
+    """Rebuilds the sketches of a single year (call inside the transaction of the rollups)."""
+    groups = {}
+    rows = release.objects.filter(year=year).order_by().values_list(
+        'facility__state', 'facility__county', 'chemical__carcinogen', 'chemical__classification', 'facility',
+        'chemical').distinct()
+    for state, county, carcinogen, classification, facility_id, chemical_id in rows.iterator(
+            chunk_size=getattr(settings, 'STREAM_CHUNK_SIZE', 2000)):
+        key = (state, county, carcinogen == 'YES', classification == 'PBT')
+        facilities, chemicals = groups.setdefault(key, (HyperLogLog(), HyperLogLog()))
+        facilities.add(facility_id)
+        chemicals.add(chemical_id)
+
+    distinct_sketch.objects.filter(year=year).delete()
+    distinct_sketch.objects.bulk_create([
+        distinct_sketch(year=year, state=state, county=county, carcinogen=carcinogen, pbt=pbt,
+                        facilities=facilities.to_bytes(), chemicals=chemicals.to_bytes())
+        for (state, county, carcinogen, pbt), (facilities, chemicals) in groups.items()], batch_size=500)
+
+
+def reset():
+    _built_years.clear()
+
+
+def is_built(year):
+    # read from 'default': a lagging replica must not decide for the whole process
+    if year not in _built_years and distinct_sketch.objects.using(DEFAULT_DB_ALIAS).filter(year=year).exists():
+        _built_years.add(year)
+    return year in _built_years
+
+
+''' Returns True when the distinct counts of 'spec' can be merged from the sketches of its year. '''
+
+
+def can_answer(spec):
+    if not getattr(settings, 'USE_ROLLUPS', True) or spec.exact:
+        return False
+    return spec.rollup_eligible() and spec.chemical is None and is_built(spec.year)
+
+
+def _sketches(spec, geo):
+    return distinct_sketch.objects.filter((spec.location(ROLLUPS) if geo else Q()) & spec.chemicals(ROLLUPS) &
+                                          Q(year=spec.year))
+
+
+def chemicals(spec, geo=True):
+    """Estimated number of distinct chemicals released under the filters of 'spec' (the location with geo)."""
+    return estimate(merge(_sketches(spec, geo).values_list('chemicals', flat=True)))
+
+
+def facilities(spec, group=None):
+    """Number of distinct facilities under the filters of 'spec' per group of GROUPS (a tuple of its columns, in
+    order), estimated when a chemical flag is set."""
+    columns = GROUPS[group]
+    if not spec.carcinogen and not spec.pbt:
+        counts = facility_count_rollup.objects.filter(spec.location(ROLLUPS) & Q(year=spec.year))
+        if not columns:
+            return {(): counts.aggregate(n=Sum('num_facilities'))['n'] or 0}
+        counts = counts.values(*columns).annotate(n=Sum('num_facilities')).order_by()
+        return {tuple(row[c] for c in columns): row['n'] or 0 for row in counts}
+
+    blobs = {}
+    for row in _sketches(spec, True).values_list(*columns, 'facilities'):
+        blobs.setdefault(row[:-1], []).append(row[-1])
+    return {key: estimate(merge(group_blobs)) for key, group_blobs in blobs.items()}
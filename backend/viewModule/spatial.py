@@ -0,0 +1,94 @@
+# Grid-cell index over the facility coordinates, used by the viewport endpoint of the map
+# Latitude and longitude are quantized to GRID_BITS bits each and interleaved into one integer (a Z-order
+# curve, the integer form of a geohash), stored in 'facilities.grid_cell'. Every cell of a coarser level
+# covers one contiguous range of codes, so a bounding box becomes a few BETWEEN ranges on the indexed column.
+from django.db.models import Q
+
+# bits per axis of the stored cell (cells are ~0.0055 degrees wide)
+GRID_BITS = 16
+# coarsest cover of a bounding box: the largest level with at most this many cells
+MAX_COVER_CELLS = 32
+
+
+def _quantize(value, low, high, bits):
+    scaled = int((value - low) / (high - low) * (1 << bits))
+    return min(max(scaled, 0), (1 << bits) - 1)
+
+
+def _interleave(x, y):
+    code = 0
+    for bit in range(GRID_BITS):
+        code |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+def _deinterleave(code):
+    x = y = 0
+    for bit in range(GRID_BITS):
+        x |= ((code >> (2 * bit)) & 1) << bit
+        y |= ((code >> (2 * bit + 1)) & 1) << bit
+    return x, y
+
+
+def cell(latitude, longitude):
+    """Returns the grid cell of a coordinate, or None when it is missing."""
+    if latitude is None or longitude is None:
+        return None
+    return _interleave(_quantize(longitude, -180, 180, GRID_BITS), _quantize(latitude, -90, 90, GRID_BITS))
+
+
+def cell_bounds(code, level):
+    """Returns (west, south, east, north) of the cell 'code' at 'level' bits per axis."""
+    x, y = _deinterleave(code << 2 * (GRID_BITS - level))
+    size = 1 << (GRID_BITS - level)
+    width, height = 360 / (1 << GRID_BITS), 180 / (1 << GRID_BITS)
+    return (-180 + x * width, -90 + y * height, -180 + (x + size) * width, -90 + (y + size) * height)
+
+
+def covering_ranges(west, south, east, north):
+    """Returns merged [low, high) ranges of grid cells covering the bounding box (west > east crosses the
+    antimeridian)."""
+    if west > east:
+        return covering_ranges(west, south, 180, north) + covering_ranges(-180, south, east, north)
+
+    # the finest level whose cover stays within MAX_COVER_CELLS
+    level = GRID_BITS
+    while level > 0:
+        x0, x1 = (_quantize(v, -180, 180, level) for v in (west, east))
+        y0, y1 = (_quantize(v, -90, 90, level) for v in (south, north))
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_COVER_CELLS:
+            break
+        level -= 1
+    else:
+        x0 = x1 = y0 = y1 = 0
+
+    shift = 2 * (GRID_BITS - level)
+    codes = sorted(_interleave(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    ranges = []
+    for code in codes:
+        low, high = code << shift, (code + 1) << shift
+        if ranges and ranges[-1][1] == low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+    return [tuple(r) for r in ranges]
+
+
+def bbox_filter(west, south, east, north, prefix=''):
+    """Returns a Q object selecting the facilities inside the bounding box through 'prefix' (e.g. 'facility__')."""
+    cells = Q()
+    for low, high in covering_ranges(west, south, east, north):
+        cells |= Q(**{prefix + 'grid_cell__gte': low, prefix + 'grid_cell__lt': high})
+
+    # the cover is coarser than the box, so the coordinates are checked as well
+    exact = Q(**{prefix + 'latitude__gte': south, prefix + 'latitude__lte': north})
+    if west > east:
+        exact &= Q(**{prefix + 'longitude__gte': west}) | Q(**{prefix + 'longitude__lte': east})
+    else:
+        exact &= Q(**{prefix + 'longitude__gte': west, prefix + 'longitude__lte': east})
+    return cells & exact
+
+
+def cluster_level(zoom):
+    """Bits per axis of the clusters shown at a map zoom level (about four clusters across a map tile)."""
+    return max(1, min(GRID_BITS, zoom + 2))
@@ -0,0 +1,34 @@
+# Streaming JSON responses for the endpoints that can return thousands of rows
+# Rows are read through QuerySet.iterator() (a server-side cursor on PostgreSQL) and written out as a JSON
+# array in batches, so neither the rows nor the serialized document are ever held in memory as a whole.
+# The bytes are identical to json.dumps(list(queryset), cls=DjangoJSONEncoder).
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+
+def json_array(rows, batch_size):
+    """Yields the JSON array of 'rows' piece by piece, 'batch_size' rows at a time."""
+    yield '['
+    separator = ''
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row, cls=DjangoJSONEncoder))
+        if len(batch) >= batch_size:
+            yield separator + ', '.join(batch)
+            separator = ', '
+            batch = []
+    if batch:
+        yield separator + ', '.join(batch)
+    yield ']'
+
+
+def json_response(queryset):
+    """Returns the rows of 'queryset' as a JSON array, streamed unless STREAM_RESPONSES is off."""
+    if not getattr(settings, 'STREAM_RESPONSES', True):
+        return HttpResponse(json.dumps(list(queryset), cls=DjangoJSONEncoder), content_type='application/json')
+
+    chunk_size = getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+    return StreamingHttpResponse(json_array(queryset.iterator(chunk_size=chunk_size), chunk_size),
+                                 content_type='application/json')
@@ -0,0 +1,135 @@
+# Type-ahead suggestions over chemical, facility and parent company names
+# The names are held in memory per dataset version: sorted keys of the whole names and of every word suffix
+# answer prefix queries with a binary search, and a trigram index catches misspellings and inner substrings
+# when the prefixes don't fill the list. A lookup never queries the database; the index is built when a worker
+# starts (see gunicorn.conf.py) and rebuilt on the first lookup after the dataset version changes.
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+from viewModule.models import Facility as facility
+from viewModule.models import Chemical as chemical
+from viewModule.models import ParentCompany as parent_company
+from viewModule import dataset
+
+KINDS = ('chemical', 'facility', 'parent')
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# smallest trigram similarity (shared / all trigrams of the query and the name) of a fuzzy match
+SIMILARITY = 0.3
+
+# ranks of a match, best first
+NAME_PREFIX, WORD_PREFIX, FUZZY = 0, 1, 2
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize(text):
+    """Upper-cases 'text' and reduces every run of punctuation and spaces to a single space."""
+    return ' '.join(re.sub(r'[^0-9A-Z]+', ' ', text.upper()).split())
+
+
+def trigrams(text):
+    padded = '  ' + text + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class KindIndex:
+    """Prefix and trigram indexes over the names of one kind; 'entries' are (id, name, extra fields) tuples."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        starts, words = [], []
+        self.grams = {}
+        self.sizes = []
+        for n, (_, name, _) in enumerate(entries):
+            key = normalize(name)
+            starts.append((key, n))
+            words.extend((key[i + 1:], n) for i, c in enumerate(key) if c == ' ')
+            grams = trigrams(key)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.grams.setdefault(gram, []).append(n)
+        starts.sort()
+        words.sort()
+        self.prefixes = [([key for key, _ in keys], [n for _, n in keys]) for keys in (starts, words)]
+
+    def matches(self, needle, limit):
+        """Returns up to 'limit' (rank, score, name, entry number), best first."""
+        found, seen = [], set()
+        for rank, (keys, owners) in zip((NAME_PREFIX, WORD_PREFIX), self.prefixes):
+            i = bisect_left(keys, needle)
+            while i < len(keys) and len(found) < limit and keys[i].startswith(needle):
+                if owners[i] not in seen:
+                    seen.add(owners[i])
+                    found.append((rank, 0.0, self.entries[owners[i]][1], owners[i]))
+                i += 1
+        if len(found) >= limit or len(needle) < 3:
+            return found
+
+        grams = trigrams(needle)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+        fuzzy = []
+        for n, count in shared.items():
+            score = count / (len(grams) + self.sizes[n] - count)
+            if n not in seen and score >= SIMILARITY:
+                fuzzy.append((FUZZY, -score, self.entries[n][1], n))
+        fuzzy.sort()
+        return found + fuzzy[:limit - len(found)]
+
+
+class SuggestIndex:
+    """The names of one dataset version."""
+
+    def __init__(self, version):
+        self.version = version
+        chemicals = [(compound_id, name, {}) for compound_id, name in chemical.objects.order_by('id').values_list(
+            'id', 'name') if name]
+        facilities = [(trf_id, name, {'city': city, 'state': state}) for trf_id, name, city, state in
+                      facility.objects.order_by('id').values_list('id', 'name', 'city', 'state') if name]
+        # the canonical companies, not every reported variant of their names
+        parents = [(company_id, name, {}) for company_id, name in parent_company.objects.order_by('id').values_list(
+            'id', 'name')]
+        self.kinds = {'chemical': KindIndex(chemicals), 'facility': KindIndex(facilities),
+                      'parent': KindIndex(parents)}
+
+    def suggest(self, q, kinds, limit):
+        needle = normalize(q)
+        if not needle:
+            return []
+        matches = []
+        for kind in kinds:
+            index = self.kinds[kind]
+            matches.extend((rank, score, name, kind, index.entries[n])
+                           for rank, score, name, n in index.matches(needle, limit))
+        matches.sort(key=lambda m: m[:3])
+        return [{'kind': kind, 'id': entry_id, 'name': name, **extra}
+                for _, _, _, kind, (entry_id, name, extra) in matches[:limit]]
+
+
+def index():
+    """Returns the index of the current dataset version, building it on first use and after a reload."""
+    global _index
+    version = dataset.current_version()
+    current = _index
+    if current is None or current.version != version:
+        with _lock:
+            # another thread may have rebuilt it while this one waited
+            current = _index
+            if current is None or current.version != version:
+                current = _index = SuggestIndex(version)
+    return current
+
+
+def reset():
+    global _index
+    _index = None
+
+
+def suggest(q, kind=None, limit=DEFAULT_LIMIT):
+    """Returns the suggestions for 'q' of one kind (or of all of them), best first."""
+    limit = max(1, min(limit, MAX_LIMIT))
+    return index().suggest(q, KINDS if kind is None else (kind,), limit)
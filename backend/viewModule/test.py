@@ -1,5 +1,22 @@
 
-from django.test import TestCase
+from io import StringIO
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, modify_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from viewModule.models import Chemical, Facility, Release, ReleaseRollup, ParentCompany, Location, DatasetVersion
+from viewModule import rollups, dataset, cache, timelines, chemical_search, columnar, spatial, encoding, metrics, \
+    routing, filters, warmup, pagination, sketches, suggest, parents, locations, location_resolver
 
 class EndpointTestCases(TestCase):
     def setUp(self):
@@ -69,3 +86,1191 @@ class EndpointTestCases(TestCase):
     def test_validity(self):
         # mock testing with 'pytest-postgresql' not possible for many to many models currently, refer to postman testing in doc
         pass
+
+
+''' Small fixture of facilities, chemicals and releases shared by the data-driven test cases '''
+
+
+def seed_releases():
+    from viewModule.models import Facility, Chemical, Release
+
+    facilities = [
+        Facility.objects.create(id='F1', name='ACME PLANT', city='DETROIT', county='WAYNE', state='MI',
+                                parent_co_name='ACME CORP', latitude=42.33, longitude=-83.04),
+        Facility.objects.create(id='F2', name='RIVER WORKS', city='DEARBORN', county='WAYNE', state='MI',
+                                parent_co_name='ACME CORP', latitude=42.32, longitude=-83.17),
+        Facility.objects.create(id='F3', name='LAKE MILL', city='FLINT', county='GENESEE', state='MI',
+                                parent_co_name='LAKE INC', latitude=43.01, longitude=-83.68),
+        Facility.objects.create(id='F4', name='GULF REFINERY', city='HOUSTON', county='HARRIS', state='TX',
+                                parent_co_name='GULF LLC', latitude=29.76, longitude=-95.36),
+    ]
+    chemicals = [
+        Chemical.objects.create(id='C1', name='BENZENE', carcinogen='YES', classification='TRI'),
+        Chemical.objects.create(id='C2', name='LEAD', carcinogen='NO', classification='PBT', metal_category=1),
+        Chemical.objects.create(id='C3', name='DIOXIN AND DIOXIN-LIKE COMPOUNDS', carcinogen='YES',
+                                classification='Dioxin'),
+        Chemical.objects.create(id='C4', name='TOLUENE', carcinogen='NO', classification='TRI'),
+    ]
+    rows = [
+        # year, facility, chemical, air, water, land, off_site
+        (2019, 0, 0, 10, 1, 0, 4), (2019, 0, 1, 0, 3, 2, 0), (2019, 1, 2, 1, 0, 0, 1),
+        (2019, 1, 3, 20, 0, 5, 0), (2019, 2, 0, 6, 0, 0, 0), (2019, 2, 3, 0, 0, 0, 0),
+        (2019, 3, 0, 100, 10, 10, 30), (2019, 3, 1, 2, 0, 8, 0),
+        (2018, 0, 0, 8, 2, 0, 1), (2018, 2, 1, 0, 0, 7, 0), (2018, 3, 3, 50, 0, 0, 5),
+    ]
+    for n, (y, f, c, air, water, land, off_site) in enumerate(rows):
+        on_site = air + water + land
+        Release.objects.create(doc_ctrl_num='D{}'.format(n), year=y, facility=facilities[f], chemical=chemicals[c],
+                               air=air, water=water, land=land, on_site=on_site, off_site=off_site,
+                               total=on_site + off_site)
+
+
+''' Base class for the test cases running against the seeded fixture, with every process-level cache reset '''
+
+
+@modify_settings(MIDDLEWARE={'remove': ['api.middleware.auth.AuthMiddleware']})
+class DataTestCase(TestCase):
+    def setUp(self):
+        seed_releases()
+        self.reset()
+
+    def tearDown(self):
+        self.reset()
+
+    def reset(self):
+        rollups.reset()
+        dataset.reset()
+        cache.clear()
+        chemical_search.reset()
+        location_resolver.reset()
+        suggest.reset()
+        columnar.reset()
+        metrics.reset()
+        routing.reset()
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return response.json()
+
+
+class RollupTestCases(DataTestCase):
+
+    urls = [
+        '/stats/state/all', '/stats/state/all?carcinogen=true', '/stats/state/all?chemical=lead&year=2018',
+        '/stats/county/all?state=mi', '/stats/county/all?state=MI&pbt=true',
+        '/stats/location/summary?state=MI', '/stats/location/summary?state=MI&county=wayne',
+        '/stats/location/summary?state=MI&city=FLINT', '/stats/summary?state=', '/stats/summary?state=&year=2018',
+        '/stats/location/top_chemicals?state=MI', '/stats/location/top_chemicals?state=TX&release_type=air',
+        '/stats/location/top_chemicals?state=MI&all=true&carcinogen=true',
+    ]
+
+    def test_rollups_match_releases(self):
+        with self.settings(USE_ROLLUPS=False):
+            expected = {url: self.get_json(url) for url in self.urls}
+
+        call_command('build_rollups', stdout=StringIO())
+
+        for url in self.urls:
+            self.assertEqual(self.get_json(url), expected[url], url)
+
+    def test_rollups_are_used_once_built(self):
+        self.assertFalse(rollups.is_built(2019))
+        call_command('build_rollups', '--year', '2019', stdout=StringIO())
+
+        self.assertTrue(rollups.is_built(2019))
+        self.assertFalse(rollups.is_built(2018))
+        self.assertEqual(ReleaseRollup.objects.filter(year=2019, state='MI', county='WAYNE').count(), 4)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/stats/state/all')
+        self.assertNotIn('"releases"', ' '.join(q['sql'] for q in queries))
+
+
+class SketchTestCases(DataTestCase):
+    def test_estimates_are_bounded(self):
+        sketch, other = sketches.HyperLogLog(), sketches.HyperLogLog()
+        for n in range(20000):
+            sketch.add(n)
+            other.add(n + 10000)
+        self.assertLess(abs(sketch.count() - 20000), 20000 * 0.05)
+        merged = sketches.estimate(sketches.merge([sketch.to_bytes(), other.to_bytes()]))
+        self.assertLess(abs(merged - 30000), 30000 * 0.05)
+
+        small = sketches.HyperLogLog()
+        for n in range(50):
+            small.add('F{}'.format(n))
+        self.assertEqual(small.to_bytes()[:1], sketches.SPARSE)
+        self.assertEqual(sketch.to_bytes()[:1], sketches.DENSE)
+        for blob in (small.to_bytes(), sketch.to_bytes()):
+            self.assertEqual(bytes(sketches.HyperLogLog.from_bytes(blob).registers), bytes(sketches.merge([blob])))
+        self.assertEqual(small.count(), 50)
+
+    def test_facilities_are_distinct(self):
+        # 6 releases of 3 facilities in MI, each of which releases a carcinogen
+        expected = {'MI': 3, 'TX': 1}
+        with self.settings(USE_ROLLUPS=False):
+            rows = self.get_json('/stats/state/all')
+            self.assertEqual({r['facility__state']: r['num_facilities'] for r in rows}, expected)
+            rows = self.get_json('/stats/county/all?state=MI&carcinogen=true')
+            self.assertEqual({r['facility__county']: r['num_facilities'] for r in rows}, {'WAYNE': 2, 'GENESEE': 1})
+
+        call_command('build_rollups', stdout=StringIO())
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get_json('/stats/state/all?carcinogen=true')
+        self.assertEqual({r['facility__state']: r['num_facilities'] for r in rows}, expected)
+        self.assertIn('"distinct_sketches"', ' '.join(q['sql'] for q in queries))
+
+    def test_summaries_merge_the_sketches(self):
+        urls = ['/stats/location/summary?state=MI', '/stats/location/summary?state=MI&county=WAYNE',
+                '/stats/summary?state=', '/stats/state/summary?state=MI', '/stats/county/all?state=MI&pbt=true']
+        with self.settings(USE_ROLLUPS=False):
+            expected = {url: self.get_json(url) for url in urls}
+        call_command('build_rollups', stdout=StringIO())
+
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.get_json(url), expected[url], url)
+            self.assertNotIn('COUNT(DISTINCT', ' '.join(q['sql'] for q in queries), url)
+            # exact=true counts the releases
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.get_json(url + '&exact=true'), expected[url], url)
+            self.assertNotIn('"distinct_sketches"', ' '.join(q['sql'] for q in queries), url)
+
+
+class ResponseCacheTestCases(DataTestCase):
+    def test_canonical_params_share_a_key(self):
+        first = self.client.get('/stats/location/summary?state=mi&county=Wayne&year=2019&carcinogen=false')
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/stats/location/summary?county=WAYNE&state=MI&foo=bar')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+        third = self.client.get('/stats/location/summary?state=MI&county=WAYNE&year=2018')
+        self.assertEqual(third['X-Cache'], 'MISS')
+
+    def test_dataset_version_invalidates(self):
+        self.client.get('/stats/state/all')
+        self.assertEqual(self.client.get('/stats/state/all')['X-Cache'], 'HIT')
+
+        call_command('bump_dataset_version', stdout=StringIO())
+        self.assertEqual(self.client.get('/stats/state/all')['X-Cache'], 'MISS')
+
+    def test_errors_are_not_cached(self):
+        self.client.get('/stats/location/summary')
+        response = self.client.get('/stats/location/summary')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('X-Cache'))
+
+    def test_local_cache_evicts_least_recently_used(self):
+        lru = cache.LocalCache(max_entries=2, max_bytes=10)
+        lru.set('a', ('text/plain', b'1234', {}))
+        lru.set('b', ('text/plain', b'1234', {}))
+        lru.get('a')
+        lru.set('c', ('text/plain', b'1234', {}))
+
+        self.assertIsNotNone(lru.get('a'))
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.size, 8)
+
+        lru.set('d', ('text/plain', b'123456789', {}))
+        self.assertEqual(lru.size, 9)
+        self.assertIsNone(lru.get('a'))
+
+
+class QuerySpecTestCases(DataTestCase):
+    params = ('state', 'county', 'year', 'carcinogen', 'pbt', 'chemical', 'release_type', 'panels')
+
+    def spec(self, url, params=params, defaults=None):
+        return filters.compile_request(RequestFactory().get(url), params, defaults)
+
+    def test_equivalent_requests_share_a_spec(self):
+        first = self.spec('/x?state=mi&county=Wayne&carcinogen=True&chemical=all&release_type=AIR&panels=b,a,')
+        second = self.spec('/x?county=WAYNE&state=MI&carcinogen=true&pbt=no&release_type=air&panels=a,b,a')
+
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(first.key(), 'carcinogen=true&county=WAYNE&panels=a%2Cb&release_type=air&state=MI')
+        self.assertEqual(self.spec('/x?year=2018', defaults={'year': 2019}).year, 2018)
+        self.assertEqual(self.spec('/x', defaults={'year': 2019}).year, 2019)
+        # a parameter the view doesn't read is not part of its spec
+        self.assertEqual(self.spec('/x?state=MI&pbt=true', ('state',)), filters.QuerySpec(state='MI'))
+
+    def test_filters_follow_the_base_model(self):
+        spec = self.spec('/x?state=MI&carcinogen=true&chemical=benz&release_type=water')
+        expected = set(Release.objects.filter(facility__state='MI', chemical__carcinogen='YES', water__gt=0,
+                                              chemical__name__icontains='benz').values_list('pk', flat=True))
+
+        self.assertEqual(set(Release.objects.filter(spec.location() & spec.releases()).values_list(
+            'pk', flat=True)), expected)
+        self.assertEqual(set(Chemical.objects.filter(spec.releases(filters.CHEMICALS)).values_list('id', flat=True)),
+                         {'C1'})
+        self.assertEqual(set(Facility.objects.filter(spec.location(filters.FACILITIES) &
+                                                     spec.releases(filters.FACILITIES)).values_list('id', flat=True)),
+                         {'F1'})
+
+    def test_chemicals_in_window_reads_the_chemical_flags(self):
+        self.assertEqual(self.get_json('/chemicals?state=MI'),
+                         ['BENZENE', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS', 'LEAD', 'TOLUENE'])
+        self.assertEqual(self.get_json('/chemicals?state=MI&carcinogen=true'),
+                         ['BENZENE', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS'])
+        self.assertEqual(self.get_json('/chemicals?state=MI&pbt=TRUE'), ['LEAD'])
+
+    def test_malformed_parameters_are_bad_requests(self):
+        for url in ['/stats/location/summary?state=MI&year=last', '/stats/location/timeline/top_chemicals?state=MI&limit=x',
+                    '/facilities/bbox?west=a&south=0&east=1&north=1']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertFalse(response.has_header('X-Cache'), url)
+            self.assertFalse(response.has_header('ETag'), url)
+
+
+class CompareTestCases(DataTestCase):
+    def test_matches_the_yearly_sums(self):
+        for by, field in [('facility', 'facility__id'), ('chemical', 'chemical__id'),
+                          ('parent', 'facility__parent_co_name')]:
+            with CaptureQueriesContext(connection) as queries:
+                body = self.get_json('/stats/location/compare?state=MI&by={}&year_a=2018&year_b=2019'.format(by))
+            self.assertEqual(len([q for q in queries if '"releases"' in q['sql']]), 1, by)
+            yearly = {y: dict(Release.objects.filter(facility__state='MI', year=y, total__gt=0).order_by().values_list(
+                field).annotate(Sum('total'))) for y in (2018, 2019)}
+
+            groups = set(yearly[2018]) | set(yearly[2019])
+            self.assertEqual({row[field]: (row['total_a'], row['total_b']) for row in body['results']},
+                             {k: (yearly[2018].get(k), yearly[2019].get(k)) for k in groups}, by)
+            changes = [abs(row['change']) for row in body['results']]
+            self.assertEqual(changes, sorted(changes, reverse=True), by)
+
+    def test_change_and_paging(self):
+        first = self.get_json('/stats/location/compare?state=mi&by=chemical&limit=2')
+        second = self.get_json('/stats/location/compare?state=mi&by=chemical&limit=2&offset=2')
+
+        self.assertEqual((first['year_a'], first['year_b']), (2018, 2019))
+        self.assertEqual(first['next_offset'], 2)
+        self.assertIsNone(second['next_offset'])
+        self.assertEqual([r['chemical__name'] for r in first['results'] + second['results']],
+                         ['TOLUENE', 'BENZENE', 'LEAD', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS'])
+        self.assertEqual(first['results'][1], {'chemical__id': 'C1', 'chemical__name': 'BENZENE', 'total_a': 11.0,
+                                               'total_b': 21.0, 'change': 10.0, 'percent_change': 10 / 11 * 100})
+        self.assertIsNone(first['results'][0]['percent_change'])
+
+    def test_filters_and_validation(self):
+        body = self.get_json('/stats/location/compare?state=MI&by=county&release_type=air&carcinogen=true')
+        self.assertEqual(body['results'], [
+            {'facility__state': 'MI', 'facility__county': 'GENESEE', 'total_a': None, 'total_b': 6.0, 'change': 6.0,
+             'percent_change': None},
+            {'facility__state': 'MI', 'facility__county': 'WAYNE', 'total_a': 8.0, 'total_b': 11.0, 'change': 3.0,
+             'percent_change': 37.5}])
+        for url in ['/stats/location/compare?by=facility', '/stats/location/compare?state=MI&by=state',
+                    '/stats/location/compare?state=MI&year_a=last']:
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+
+class PaginationTestCases(DataTestCase):
+    lists = [
+        '/stats/location/facility_releases?state=MI&all=true',
+        '/stats/location/facility_releases?state=MI&all=true&release_type=air&pbt=false',
+        '/stats/location/top_chemicals?state=MI&all=true&carcinogen=true',
+        '/stats/location/facility_releases?all=true&chemical=e',
+    ]
+
+    def walk(self, url):
+        rows, url = [], url + '&page_size=1&total=true'
+        page = self.get_json(url)
+        while True:
+            self.assertLessEqual(len(page['results']), 1)
+            rows.extend(page['results'])
+            if page['next'] is None:
+                return rows, page['total']
+            page = self.get_json(url + '&cursor=' + page['next'])
+
+    def test_pages_cover_the_list(self):
+        for rollups_built in (False, True):
+            if rollups_built:
+                call_command('build_rollups', stdout=StringIO())
+            for url in self.lists:
+                expected = self.get_json(url)
+                rows, total = self.walk(url)
+                self.assertEqual(rows, expected, url)
+                self.assertEqual(total, len(expected), url)
+
+    def test_pages_are_bounded(self):
+        page = self.get_json('/stats/location/top_chemicals?state=MI&all=true&page_size=3')
+        self.assertEqual([r['chemical__name'] for r in page['results']],
+                         ['BENZENE', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS', 'LEAD'])
+        self.assertNotIn('total', page)
+        self.assertEqual(page['next'], pagination.encode('LEAD'))
+
+        last = self.get_json('/stats/location/top_chemicals?state=MI&all=true&cursor=' + page['next'])
+        self.assertEqual(last, {'results': [{'chemical__name': 'TOLUENE', 'total': 25.0, 'air': 20.0,
+                                             'water': 0.0, 'land': 5.0, 'off_site': 0.0}], 'next': None})
+        # without all=true the page parameters don't apply
+        self.assertEqual(len(self.get_json('/stats/location/top_chemicals?state=MI&page_size=1')), 4)
+
+    def test_foreign_tokens_are_rejected(self):
+        token = pagination.encode('LEAD')
+        for cursor in ['LEAD', token[:-1], token.replace(token.split(':')[0], 'IlpaWiI')]:
+            response = self.client.get('/stats/location/facility_releases?state=MI&all=true&cursor=' + cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+class WarmCacheTestCases(DataTestCase):
+    def test_targets_collapse_unread_filters(self):
+        jobs = warmup.targets()
+        summaries = [params for path, _, params in jobs if path == '/stats/location/summary']
+        top = [params for path, _, params in jobs if path == '/stats/location/top_chemicals']
+
+        self.assertEqual(summaries, [{'state': 'MI'}, {'state': 'TX'}])
+        self.assertEqual(len(top), 2 * len(warmup.COMBINATIONS))
+        self.assertNotIn('/facilities', [path for path, _, _ in jobs])
+
+    def test_warms_the_response_cache(self):
+        out, err = StringIO(), StringIO()
+        call_command('warm_cache', '--state', 'mi', stdout=out, stderr=err)
+
+        self.assertIn('0 failed', out.getvalue())
+        self.assertIn('(100.0% coverage)', out.getvalue())
+        self.assertIn('RESPONSE_CACHE=local', err.getvalue())
+        for url in ['/stats/location/summary?state=MI', '/stats/location/top_chemicals?state=MI&release_type=air',
+                    '/stats/location/dashboard?state=MI']:
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT', url)
+        self.assertEqual(self.client.get('/stats/location/summary?state=TX')['X-Cache'], 'MISS')
+
+        cached = self.client.get('/stats/location/top_chemicals?state=MI&pbt=true').content
+        cache.clear()
+        self.assertEqual(self.client.get('/stats/location/top_chemicals?state=MI&pbt=true').content, cached)
+
+        report = warmup.warm(warmup.targets(['MI']))
+        self.assertEqual(report['warmed'], report['targets'] - report['cached'])
+        self.assertGreater(report['warmed'], 0)
+
+    def test_requires_a_cache(self):
+        with self.settings(RESPONSE_CACHE='none'):
+            cache.clear()
+            with self.assertRaises(CommandError):
+                call_command('warm_cache', stdout=StringIO())
+
+
+class StateTotalTestCases(DataTestCase):
+    def test_classified_totals(self):
+        response = self.client.get('/stats/state/summary?state=mi')
+
+        self.assertEqual(response.json(), {
+            'totalonsite': 1, 'air': 1, 'water': 0, 'land': 0, 'totaloffsite': 1, 'totaldioxin': 2,
+            'totalcarcs': 23, 'totalpbt': 5, 'totalmetals': 5, 'totalcleanair': 0, 'numtrifacilities': 3})
+
+    def test_query_count_is_constant(self):
+        dataset.current_version()  # read once per DATASET_VERSION_TTL for the ETag
+        location_resolver.index()  # loaded once per dataset version
+        with self.settings(RESPONSE_CACHE='none', USE_ROLLUPS=False):
+            with self.assertNumQueries(1):
+                self.client.get('/stats/state/summary?state=MI')
+            with self.assertNumQueries(1):
+                self.client.get('/stats/state/summary?state=TX&year=2018')
+            with self.assertNumQueries(1):
+                self.client.get('/stats/state/summary?state=XX')
+
+
+class DashboardTestCases(DataTestCase):
+    routes = {
+        'summary': '/stats/location/summary', 'top_chemicals': '/stats/location/top_chemicals',
+        'facility_releases': '/stats/location/facility_releases',
+        'parent_releases': '/stats/location/parent_releases',
+        'timeline_total': '/stats/location/timeline/total',
+        'timeline_top_chemicals': '/stats/location/timeline/top_chemicals',
+        'timeline_top_pbt_chemicals': '/stats/location/timeline/top_pbt_chemicals',
+        'timeline_facility_releases': '/stats/location/timeline/facility_releases',
+        'timeline_parent_releases': '/stats/location/timeline/parent_releases',
+        'timeline_county_releases': '/stats/location/timeline/county_releases',
+    }
+
+    def test_panels_match_endpoints(self):
+        query = '?state=MI&county=WAYNE&carcinogen=true'
+        dashboard = self.client.get('/stats/location/dashboard' + query).json()
+
+        self.assertEqual(set(dashboard), set(self.routes))
+        for name, route in self.routes.items():
+            self.assertEqual(dashboard[name], self.client.get(route + query).json(), name)
+
+    def test_requested_panels_only(self):
+        dashboard = self.client.get('/stats/location/dashboard?state=MI&panels=summary,timeline_total').json()
+        self.assertEqual(set(dashboard), {'summary', 'timeline_total'})
+
+    def test_bad_requests(self):
+        self.assertEqual(self.client.get('/stats/location/dashboard').status_code, 400)
+        self.assertEqual(self.client.get('/stats/location/dashboard?state=MI&panels=nope').status_code, 400)
+
+
+@modify_settings(MIDDLEWARE={'remove': ['api.middleware.auth.AuthMiddleware']})
+class ConcurrentDashboardTestCases(TransactionTestCase):
+    def setUp(self):
+        seed_releases()
+        cache.clear()
+        location_resolver.reset()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_concurrent_panels_match_sequential(self):
+        dataset.reset()
+        dataset.current_version()
+        location_resolver.index()
+        with self.settings(QUERY_WORKERS=1, RESPONSE_CACHE='none'):
+            sequential = self.client.get('/stats/location/dashboard?state=MI')
+        expected = sequential.json()
+        self.assertTrue(expected['timeline_total'])
+        with self.settings(QUERY_WORKERS=4, RESPONSE_CACHE='none'):
+            concurrent = self.client.get('/stats/location/dashboard?state=MI')
+            self.assertEqual(concurrent.json(), expected)
+
+        # the queries of the pool threads are attributed to the request as well
+        queries = [r['Server-Timing'].split('desc="')[1].split()[0] for r in (sequential, concurrent)]
+        self.assertEqual(queries[0], queries[1])
+
+    def test_concurrent_summary_matches_sequential(self):
+        dataset.reset()
+        dataset.current_version()
+        location_resolver.index()
+        responses = []
+        for workers in (1, 4):
+            with self.settings(QUERY_WORKERS=workers, RESPONSE_CACHE='none', USE_ROLLUPS=False):
+                responses.append(self.client.get('/stats/location/summary?state=MI'))
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertIsNotNone(responses[1].json()['total_carcinogen'])
+        queries = [r['Server-Timing'].split('desc="')[1].split()[0] for r in responses]
+        self.assertEqual(queries[0], queries[1])
+
+
+class AsgiTestCases(DataTestCase):
+    urls = ['/stats/location/summary?state=MI', '/stats/summary?state=&year=2018',
+            '/stats/location/dashboard?state=MI', '/facilities?state=MI',
+            '/stats/location/top_chemicals?state=MI&all=true']
+
+    def test_asgi_matches_wsgi(self):
+        with self.settings(RESPONSE_CACHE='none'):
+            for url in self.urls:
+                response = async_to_sync(self.async_client.get)(url)
+                self.assertEqual(response.status_code, 200, url)
+                # streamed lists are materialized, the ASGI handler reads streams on the event loop
+                self.assertFalse(response.streaming, url)
+                self.assertEqual(json.loads(response.content), self.get_json(url), url)
+
+
+@modify_settings(MIDDLEWARE={'remove': ['api.middleware.auth.AuthMiddleware']})
+class ReplicaRoutingTestCases(TransactionTestCase):
+    # 'replica' and 'second' read the test database, 'broken' can't be opened and 'empty' has no tables; they
+    # are added once the test case has guarded the aliases it doesn't use
+    aliases = ('replica', 'second', 'broken', 'empty')
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        settings = connections['default'].settings_dict
+        connections.databases['replica'] = dict(settings)
+        connections.databases['second'] = dict(settings)
+        connections.databases['broken'] = dict(settings, NAME='/nonexistent/directory/db.sqlite3')
+        cls.directory = tempfile.mkdtemp()
+        connections.databases['empty'] = dict(settings, NAME=os.path.join(cls.directory, 'empty.sqlite3'))
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in cls.aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.databases[alias]
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        seed_releases()
+        routing.reset()
+        cache.clear()
+
+    def tearDown(self):
+        routing.reset()
+        cache.clear()
+
+    def test_reads_go_round_robin_to_healthy_replicas(self):
+        with self.settings(DATABASE_REPLICAS=['replica', 'broken'], RESPONSE_CACHE='none'), \
+                self.assertLogs('viewModule.routing', 'WARNING'):
+            expected = [self.client.get('/stats/state/all').json() for _ in range(4)]
+            stats = routing.stats()
+        self.assertTrue(expected[0])
+        self.assertEqual(expected, [expected[0]] * 4)
+        self.assertGreater(stats['replica']['reads'], 0)
+        self.assertEqual(stats['broken']['reads'], 0)
+        self.assertFalse(stats['broken']['up'])
+        self.assertEqual(stats['broken']['failed_health_checks'], 1)
+
+    def test_falls_back_to_default(self):
+        with self.settings(DATABASE_REPLICAS=['broken'], RESPONSE_CACHE='none'), \
+                self.assertLogs('viewModule.routing', 'WARNING'):
+            self.assertEqual(self.client.get('/stats/state/all').status_code, 200)
+            self.assertIn('vet_db_up{alias="broken"} 0', self.client.get('/_metrics').content.decode())
+        self.assertGreater(routing.stats()['default']['reads'], 0)
+
+    def test_retries_a_read_when_a_replica_fails(self):
+        with self.settings(RESPONSE_CACHE='none'):
+            expected = self.client.get('/stats/state/all').json()
+            with self.settings(DATABASE_REPLICAS=['empty']), self.assertLogs('viewModule.routing', 'WARNING'):
+                response = self.client.get('/stats/state/all')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(routing.stats()['empty']['errors'], 1)
+        self.assertFalse(routing.stats()['empty']['up'])
+
+    def test_writes_and_transactions_stay_on_default(self):
+        router = routing.ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=['replica']):
+            self.assertEqual(router.db_for_read(Release), 'replica')
+            self.assertEqual(router.db_for_write(Release), 'default')
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Release))
+            self.assertFalse(router.allow_migrate('replica', 'viewModule'))
+
+    def test_explain_views_captures_routed_reads(self):
+        # the first run also loads the in-memory indexes
+        reports = []
+        for replicas in ([], [], ['replica']):
+            out = StringIO()
+            with self.settings(DATABASE_REPLICAS=replicas):
+                call_command('explain_views', '--state', 'mi', stdout=out)
+            reports.append(out.getvalue())
+        self.assertEqual(reports[1], reports[2])
+        self.assertNotIn('/stats/county/all state=MI: 0 queries', reports[2])
+        self.assertEqual(routing.stats()['replica']['reads'], 0)
+
+    def test_dataset_version_reads_default(self):
+        router = routing.ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=['replica']):
+            self.assertEqual(router.db_for_read(DatasetVersion), 'default')
+            self.assertEqual(router.db_for_read(Release), 'replica')
+
+    def test_reads_of_a_request_stay_on_one_replica(self):
+        router = routing.ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=['replica', 'second']):
+            with routing.pinned(routing.Pin()):
+                self.assertEqual(len({router.db_for_read(Release) for _ in range(4)}), 1)
+            self.assertEqual(len({router.db_for_read(Release) for _ in range(4)}), 2)
+            # the dashboard runs its queries on the pool threads, the comparison on the request's thread
+            for url in ('/stats/location/dashboard?state=MI',
+                        '/stats/location/compare?state=MI&by=chemical&limit=2'):
+                routing.reset()
+                with self.settings(QUERY_WORKERS=4, RESPONSE_CACHE='none'):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                reads = {alias: counts['reads'] for alias, counts in routing.stats().items() if counts['reads']}
+                self.assertEqual(len(reads), 1, url)
+
+
+class TimelineTestCases(DataTestCase):
+    def two_step(self, queryset, key, label, limit=10):
+        top = list(queryset.values(key).annotate(t=Sum('total')).order_by('-t', key).values_list(key, flat=True)[:limit])
+        return list(queryset.filter(**{key + '__in': top}).values('year', label).order_by(label, 'year').annotate(
+            total=Sum('total')))
+
+    def test_matches_two_step_queries(self):
+        releases = Release.objects.filter(total__gt=0)
+        for dimension, key, label in [('chemical', 'chemical__id', 'chemical__name'),
+                                      ('facility', 'facility__id', 'facility__name'),
+                                      ('parent', 'facility__parent_co_name', 'facility__parent_co_name')]:
+            for limit in (1, 2, 10):
+                self.assertEqual(timelines.top_over_time(releases, dimension, limit),
+                                 self.two_step(releases, key, label, limit), (dimension, limit))
+
+    def test_counties(self):
+        lines = timelines.top_over_time(Release.objects.filter(facility__state='MI'), 'county', 1)
+        self.assertEqual(lines, [{'year': 2018, 'facility__state': 'MI', 'facility__county': 'WAYNE', 'total': 11.0},
+                                 {'year': 2019, 'facility__state': 'MI', 'facility__county': 'WAYNE', 'total': 47.0}])
+
+    def test_endpoints_run_one_query(self):
+        dataset.current_version()  # read once per DATASET_VERSION_TTL for the ETag
+        location_resolver.index()  # loaded once per dataset version
+        with self.settings(RESPONSE_CACHE='none'):
+            for route in ['top_chemicals', 'top_pbt_chemicals', 'facility_releases', 'parent_releases',
+                          'county_releases']:
+                with self.assertNumQueries(1):
+                    response = self.client.get('/stats/location/timeline/{}?state=MI&limit=3'.format(route))
+                self.assertTrue(response.json(), route)
+
+
+class StreamingTestCases(DataTestCase):
+    urls = ['/facilities?state=MI', '/facilities?state=MI&carcinogen=true&year=2018',
+            '/stats/location/facility_releases?state=MI&all=true',
+            '/stats/location/top_chemicals?state=MI&all=true&release_type=land']
+
+    def test_streamed_bytes_match_buffered(self):
+        for url in self.urls:
+            with self.settings(STREAM_RESPONSES=False, RESPONSE_CACHE='none'):
+                expected = self.client.get(url)
+            with self.settings(STREAM_RESPONSES=True, STREAM_CHUNK_SIZE=1, RESPONSE_CACHE='none'):
+                response = self.client.get(url)
+
+            self.assertTrue(response.streaming, url)
+            self.assertEqual(b''.join(response.streaming_content), expected.content, url)
+
+    def test_streamed_responses_are_cached(self):
+        response = self.client.get(self.urls[0])
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        cached = self.client.get(self.urls[0])
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached.content, body)
+
+    def test_empty_result(self):
+        response = self.client.get('/facilities?state=XX')
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+
+class ChemicalSearchTestCases(DataTestCase):
+    searches = ['benz', 'BENZENE', 'dioxin', 'Lead', 'e', 'in-like', 'zinc', '']
+
+    def test_matches_icontains(self):
+        for search in self.searches:
+            expected = set(Chemical.objects.filter(name__icontains=search).values_list('id', flat=True))
+            self.assertEqual(chemical_search.matching_ids(search), expected, search)
+
+    def test_release_filter_avoids_name_scan(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/stats/location/timeline/total?state=MI&chemical=benz')
+        self.assertNotIn('LIKE', queries[-1]['sql'])
+        self.assertEqual(self.client.get('/stats/location/timeline/total?state=MI&chemical=benz').json(),
+                         [{'year': 2018, 'total': 11.0}, {'year': 2019, 'total': 21.0}])
+
+    def test_index_follows_dataset_version(self):
+        self.assertEqual(chemical_search.matching_ids('zinc'), set())
+        Chemical.objects.create(id='C5', name='ZINC COMPOUNDS')
+        self.assertEqual(chemical_search.matching_ids('zinc'), set())
+
+        dataset.bump()
+        self.assertEqual(chemical_search.matching_ids('zinc'), {'C5'})
+
+
+class SuggestTestCases(DataTestCase):
+    def names(self, url):
+        parents = dict(ParentCompany.objects.values_list('id', 'name'))
+        # parent companies are named by their id in the expectations
+        return [(s['kind'], parents[s['id']] if s['kind'] == 'parent' else s['id'], s['name'])
+                for s in self.get_json(url)]
+
+    def test_prefixes_rank_first(self):
+        self.assertEqual(self.names('/search/suggest?q=ben'), [('chemical', 'C1', 'BENZENE')])
+        self.assertEqual(self.names('/search/suggest?q=acme'), [
+            ('parent', 'ACME CORP', 'ACME CORP'), ('facility', 'F1', 'ACME PLANT')])
+        # a word inside the name ranks after the names starting with the query
+        self.assertEqual(self.names('/search/suggest?q=l'), [
+            ('parent', 'LAKE INC', 'LAKE INC'), ('facility', 'F3', 'LAKE MILL'), ('chemical', 'C2', 'LEAD'),
+            ('chemical', 'C3', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS'), ('parent', 'GULF LLC', 'GULF LLC')])
+        self.assertEqual(self.names('/search/suggest?q=-like%20comp&kind=chemical'), [
+            ('chemical', 'C3', 'DIOXIN AND DIOXIN-LIKE COMPOUNDS')])
+        self.assertEqual(self.get_json('/search/suggest?q=gulf&kind=facility'), [
+            {'kind': 'facility', 'id': 'F4', 'name': 'GULF REFINERY', 'city': 'HOUSTON', 'state': 'TX'}])
+
+    def test_misspellings_and_limits(self):
+        self.assertEqual(self.names('/search/suggest?q=tolune'), [('chemical', 'C4', 'TOLUENE')])
+        self.assertEqual(len(self.get_json('/search/suggest?q=a&limit=2')), 2)
+        self.assertEqual(self.get_json('/search/suggest?q=%20'), [])
+        self.assertEqual(self.client.get('/search/suggest?q=a&kind=county').status_code, 400)
+        self.assertEqual(self.client.get('/search/suggest?q=a&limit=x').status_code, 400)
+
+    def test_lookups_stay_in_memory(self):
+        suggest.index()
+        lake = ParentCompany.objects.get(key='LAKE').id
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest.suggest('lake', 'parent'), [{'kind': 'parent', 'id': lake, 'name': 'LAKE INC'}])
+
+        Chemical.objects.create(id='C5', name='ZINC COMPOUNDS')
+        self.assertEqual(suggest.suggest('zinc'), [])
+        dataset.bump()
+        self.assertEqual(suggest.suggest('zinc')[0]['id'], 'C5')
+
+
+class ParentCompanyTestCases(DataTestCase):
+    def add_variants(self):
+        # a variant of ACME CORP, reported by two facilities, now the most reported spelling
+        for n, name in enumerate(['Acme Corporation', 'ACME CORPORATION']):
+            Facility.objects.filter(id='F{}'.format(n + 1)).update(parent_co_name=name.upper())
+        Facility.objects.create(id='F5', name='NEW SITE', state='MI', parent_co_name='The Acme Corp.')
+        Release.objects.create(doc_ctrl_num='D99', year=2019, facility_id='F5', chemical_id='C4', air=7, total=7)
+
+    def test_canonical_keys(self):
+        for name in ['ACME CORP', 'Acme Corporation', 'THE ACME CORP.', 'acme, inc', 'ACME CO INC']:
+            self.assertEqual(parents.canonical_key(name), 'ACME', name)
+        self.assertEqual(parents.canonical_key('A.B.C. L.L.C.'), 'ABC')
+        self.assertEqual(parents.canonical_key('AT&T'), 'AT AND T')
+        self.assertEqual(parents.canonical_key('THE COMPANY'), 'COMPANY')
+        self.assertIsNone(parents.canonical_key(' . '))
+
+    def test_link_merges_the_variants(self):
+        acme = ParentCompany.objects.get(key='ACME').id
+        self.add_variants()
+        call_command('canonicalize_parents', stdout=StringIO())
+
+        company = ParentCompany.objects.get(key='ACME')
+        self.assertEqual((company.id, company.name), (acme, 'ACME CORPORATION'))
+        self.assertEqual(set(company.facilities.values_list('id', flat=True)), {'F1', 'F2', 'F5'})
+        self.assertEqual(ParentCompany.objects.count(), 3)
+
+        rows = self.get_json('/stats/location/parent_releases?state=MI')
+        self.assertEqual([(r['facility__parent_co'], r['facility__parent_co_name'], r['total']) for r in rows][0],
+                         (acme, 'ACME CORPORATION', 54.0))
+        lines = self.get_json('/stats/location/timeline/parent_releases?state=MI&limit=1')
+        self.assertEqual(lines, [{'year': 2018, 'facility__parent_co_name': 'ACME CORPORATION', 'total': 11.0},
+                                 {'year': 2019, 'facility__parent_co_name': 'ACME CORPORATION', 'total': 54.0}])
+
+    def test_unreported_companies_are_removed(self):
+        Facility.objects.filter(id='F3').update(parent_co_name=None)
+        Facility.objects.filter(id='F4').update(parent_co_name='-')
+        parents.link(Facility, ParentCompany)
+
+        self.assertEqual(list(ParentCompany.objects.values_list('key', flat=True)), ['ACME'])
+        self.assertEqual(Facility.objects.filter(parent_co=None).count(), 2)
+
+    def test_save_resolves_changed_names_only(self):
+        lake = Facility.objects.get(id='F3')
+        with CaptureQueriesContext(connection) as queries:
+            lake.save()
+        self.assertFalse([q for q in queries if 'parent_companies' in q['sql']])
+
+        lake.parent_co_name = 'Lake Incorporated'
+        lake.save()
+        self.assertEqual(Facility.objects.get(id='F3').parent_co.key, 'LAKE')
+        lake.parent_co_name = 'RIVER LLC'
+        lake.save(update_fields=['parent_co_name'])
+        self.assertEqual(Facility.objects.get(id='F3').parent_co.name, 'RIVER LLC')
+
+    def test_facility_lists_hide_the_company_id(self):
+        row = self.get_json('/facilities?state=MI')[0]
+        self.assertIn('parent_co_name', row)
+        self.assertNotIn('parent_co_id', row)
+
+
+class LocationTestCases(DataTestCase):
+    counties = 'STATE|STATEFP|COUNTYFP|COUNTYNS|COUNTYNAME|CLASSFP|FUNCSTAT\n' \
+               'MI|26|049|01622967|Genesee County|H1|A\nMI|26|163|01623022|Wayne County|H1|A\n' \
+               'OH|39|163|01074093|Vinton County|H1|A\n'
+
+    def load_counties(self):
+        f = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        f.write(self.counties)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        err = StringIO()
+        call_command('load_county_fips', f.name, stdout=StringIO(), stderr=err)
+        return err.getvalue()
+
+    def test_county_keys(self):
+        self.assertEqual(locations.county_key('Wayne County'), 'WAYNE')
+        self.assertEqual(locations.county_key('St. Louis city'), locations.county_key('ST. LOUIS (CITY)'))
+        self.assertEqual(locations.county_key('Saint Clair'), 'ST CLAIR')
+        self.assertEqual(locations.county_key('Orleans Parish'), 'ORLEANS')
+        self.assertEqual(locations.fips(6, 37), '06037')
+        self.assertIsNone(locations.fips(26, None))
+
+    def test_facilities_reference_their_location(self):
+        wayne = Facility.objects.get(id='F1').location
+        self.assertEqual((wayne.state, wayne.county, wayne.state_fips, wayne.county_fips), ('MI', 'WAYNE', 26, None))
+        self.assertEqual(Facility.objects.get(id='F2').location, wayne)
+        self.assertEqual(Location.objects.count(), 3)
+
+        Facility.objects.filter(id='F2').update(location=None)
+        Location.objects.create(state='OH', county='VINTON')
+        self.assertEqual(locations.link(Facility, Location), 3)
+        self.assertEqual(Facility.objects.get(id='F2').location, wayne)
+        self.assertNotIn('location_id', self.get_json('/facilities?state=MI')[0])
+
+    def test_new_county_of_a_known_state_is_filtered(self):
+        self.assertEqual(len(self.get_json('/facilities?state=MI')), 3)
+        Facility.objects.create(id='F5', name='KENT PLANT', city='GRAND RAPIDS', county='KENT', state='MI')
+        Release.objects.create(doc_ctrl_num='D99', year=2019, facility_id='F5', chemical_id='C1', air=5, total=5)
+        cache.clear()
+        self.assertEqual(len(Facility.objects.filter(location_resolver.location_filter(
+            filters.QuerySpec(state='MI'), ''))), 4)
+        self.assertIn('F5', [f['id'] for f in self.get_json('/facilities?state=MI')])
+
+    def test_save_resolves_changed_locations_only(self):
+        flint = Facility.objects.get(id='F3')
+        with CaptureQueriesContext(connection) as queries:
+            flint.save()
+        self.assertFalse([q for q in queries if 'locations' in q['sql']])
+
+        flint.county = 'WAYNE'
+        flint.save(update_fields=['county'])
+        self.assertEqual(Facility.objects.get(id='F3').location, Facility.objects.get(id='F1').location)
+
+    def test_filters_resolve_to_location_ids(self):
+        wayne = Facility.objects.get(id='F1').location_id
+        self.assertEqual(location_resolver.index().matching_ids('MI', 'WAYNE'), {wayne})
+        self.assertIsNone(location_resolver.index().matching_ids('MI', 'KENT'))
+
+        spec = filters.QuerySpec(state='MI', county='WAYNE')
+        self.assertEqual(set(Release.objects.filter(spec.location()).values_list('pk', flat=True)),
+                         set(Release.objects.filter(facility__state='MI', facility__county='WAYNE').values_list(
+                             'pk', flat=True)))
+        with CaptureQueriesContext(connection) as queries:
+            self.get_json('/stats/location/summary?state=MI&city=detroit&year=2018')
+        self.assertIn('"location_id" IN', queries[-1]['sql'])
+        # names no facility reports still filter (and find nothing)
+        self.assertEqual(self.get_json('/facilities?state=XX'), [])
+
+    def test_counties_carry_their_fips_code(self):
+        self.assertIn('No FIPS code for HARRIS TX', self.load_counties())
+        with self.settings(USE_ROLLUPS=False), CaptureQueriesContext(connection) as queries:
+            rows = self.get_json('/stats/county/all?state=MI')
+        self.assertEqual([(r['facility__county'], r['fips'], r['num_facilities']) for r in rows],
+                         [('GENESEE', '26049', 1), ('WAYNE', '26163', 2)])
+        self.assertIn('GROUP BY "facilities"."location_id"', queries[-1]['sql'])
+
+        call_command('build_rollups', stdout=StringIO())
+        self.assertEqual(self.get_json('/stats/county/all?state=MI&year=2019'), rows)
+        self.assertIsNone(self.get_json('/stats/county/all?state=TX')[0]['fips'])
+
+
+class ExplainViewsTestCases(DataTestCase):
+    def test_reports_every_cacheable_route(self):
+        out = StringIO()
+        call_command('explain_views', '--state', 'mi', '--tables', 'releases,facilities,chemicals', stdout=out)
+        report = out.getvalue()
+
+        self.assertIn('/stats/location/summary state=MI', report)
+        self.assertIn('/facilities/F1/chemicals ', report)
+        self.assertIn('/stats/location/top_chemicals all=true&state=MI', report)
+        self.assertIn('request(s) with sequential scans', report)
+
+
+class FacilityBboxTestCases(DataTestCase):
+    detroit = '/facilities/bbox?west=-83.3&south=42.2&east=-82.9&north=42.5'
+    michigan = '/facilities/bbox?west=-90.5&south=41.6&east=-82.1&north=48.3'
+
+    def test_viewport_returns_facilities_in_view(self):
+        state = {f['id']: f for f in self.get_json('/facilities?state=MI')}
+        response = self.get_json(self.detroit + '&zoom=12')
+
+        self.assertFalse(response['clustered'])
+        self.assertEqual(sorted(f['id'] for f in response['results']), ['F1', 'F2'])
+        for f in response['results']:
+            self.assertEqual(f, state[f['id']])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.detroit + '&zoom=12&year=2018')
+        self.assertIn('grid_cell', queries[-1]['sql'])
+
+    def test_low_zoom_returns_clusters(self):
+        expected = self.get_json('/facilities?state=MI')
+        response = self.get_json(self.michigan + '&zoom=4')
+
+        self.assertTrue(response['clustered'])
+        self.assertEqual(sum(c['count'] for c in response['results']), len(expected))
+        self.assertEqual(sum(c['total'] for c in response['results']), sum(f['total'] for f in expected))
+        for c in response['results']:
+            w, s, e, n = c['bounds']
+            self.assertTrue(w <= c['longitude'] <= e and s <= c['latitude'] <= n)
+
+    def test_cover_contains_the_box(self):
+        for west, south, east, north in [(-83.3, 42.2, -82.9, 42.5), (-125, 24, -66, 50), (170, -50, -170, -30)]:
+            ranges = spatial.covering_ranges(west, south, east, north)
+            for lat in (south, (south + north) / 2, north):
+                for lon in (west, east):
+                    code = spatial.cell(lat, lon)
+                    self.assertTrue(any(low <= code < high for low, high in ranges), (lat, lon))
+            self.assertLessEqual(len(ranges), spatial.MAX_COVER_CELLS * 2)
+
+    def test_requires_bounds(self):
+        self.assertEqual(self.client.get('/facilities/bbox?west=-83&south=42&east=-82').status_code, 400)
+        self.assertEqual(self.client.get('/facilities/bbox?west=-83&south=43&east=-82&north=42').status_code, 400)
+
+
+class EncodingTestCases(DataTestCase):
+    urls = ['/stats/county/all?state=MI', '/facilities?state=MI', '/stats/location/top_chemicals?state=MI&all=true',
+            '/stats/location/summary?state=MI', '/stats/location/dashboard?state=MI']
+
+    def test_negotiation(self):
+        factory = RequestFactory()
+        for accept, expected in [
+            (None, encoding.JSON), ('*/*', encoding.JSON), ('text/html', encoding.JSON),
+            ('application/vnd.vet.columns+json', encoding.COLUMNS_JSON),
+            ('application/json;q=0.5, application/vnd.vet.columns+json', encoding.COLUMNS_JSON),
+            ('application/vnd.vet.columns+json;q=0, application/json', encoding.JSON),
+        ]:
+            headers = {} if accept is None else {'HTTP_ACCEPT': accept}
+            self.assertEqual(encoding.negotiate(factory.get('/', **headers)), expected, accept)
+
+    def test_columnar_json(self):
+        for url in self.urls:
+            rows = self.get_json(url)
+            response = self.client.get(url, HTTP_ACCEPT=encoding.COLUMNS_JSON)
+
+            self.assertEqual(response['Content-Type'], encoding.COLUMNS_JSON)
+            self.assertIn('Accept', response['Vary'])
+            self.assertEqual(response.json(), json.loads(json.dumps(encoding.to_columns(rows))), url)
+
+        columns = self.client.get(self.urls[0], HTTP_ACCEPT=encoding.COLUMNS_JSON).json()
+        self.assertEqual(columns['length'], 2)
+        self.assertEqual(columns['columns']['facility__county'], ['GENESEE', 'WAYNE'])
+
+    @unittest.skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        for url in self.urls:
+            rows = self.get_json(url)
+            for media_type, expected in [(encoding.MSGPACK, rows), (encoding.COLUMNS_MSGPACK, encoding.to_columns(rows))]:
+                response = self.client.get(url, HTTP_ACCEPT=media_type)
+                self.assertEqual(response['Content-Type'], media_type)
+                self.assertEqual(encoding.msgpack.unpackb(response.content), expected, url)
+
+    def test_formats_are_cached_apart(self):
+        url = self.urls[0]
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT=encoding.COLUMNS_JSON)['X-Cache'], 'MISS')
+
+        cached = self.client.get(url, HTTP_ACCEPT=encoding.COLUMNS_JSON)
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(cached['Content-Type'], encoding.COLUMNS_JSON)
+        self.assertIn('columns', cached.json())
+
+    def test_precompressed_bodies(self):
+        url = '/stats/location/dashboard?state=MI'
+        plain = self.client.get(url).content
+        self.assertGreaterEqual(len(plain), encoding.COMPRESS_MIN_BYTES)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain)
+
+        if encoding.brotli is not None:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(encoding.brotli.decompress(response.content), plain)
+
+        self.assertFalse(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+
+
+class ETagTestCases(DataTestCase):
+    url = '/stats/location/summary?state=MI'
+
+    def test_not_modified_before_the_view(self):
+        response = self.client.get(self.url)
+        tag = response['ETag']
+        self.assertTrue(tag.startswith('"v0-'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage=3600', response['Cache-Control'])
+
+        # the same canonical parameters share the tag, and a match skips every query
+        with self.assertNumQueries(0):
+            response = self.client.get('/stats/location/summary?state=mi&year=2019', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], tag)
+        self.assertEqual(response.content, b'')
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"v0-other"').status_code, 200)
+        self.assertNotEqual(self.client.get('/stats/location/summary?state=TX')['ETag'], tag)
+        self.assertNotEqual(self.client.get(self.url, HTTP_ACCEPT=encoding.COLUMNS_JSON)['ETag'], tag)
+
+    def test_tag_follows_dataset_version(self):
+        tag = self.client.get(self.url)['ETag']
+        dataset.bump()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('"v1-'))
+
+    def test_compressed_representation(self):
+        url = '/stats/location/dashboard?state=MI'
+        plain = self.client.get(url)['ETag']
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertEqual(compressed, plain[:-1] + '-gzip"')
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed)
+        self.assertEqual(response.status_code, 304)
+
+    def test_errors_have_no_tag(self):
+        response = self.client.get('/stats/location/summary')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class InstrumentationTestCases(DataTestCase):
+    def test_server_timing_counts_queries(self):
+        with self.settings(RESPONSE_CACHE='none'):
+            dataset.current_version()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/stats/location/summary?state=MI')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="{} queries"'.format(len(queries)), timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/stats/location/summary?state=MI')
+        self.client.get('/stats/location/summary?state=MI')
+        b''.join(self.client.get('/facilities?state=MI').streaming_content)
+        self.client.get('/stats/location/summary')
+
+        body = self.client.get('/_metrics').content.decode()
+        self.assertIn('vet_requests_total{route="/stats/location/summary",status="200"} 2', body)
+        self.assertIn('vet_requests_total{route="/stats/location/summary",status="400"} 1', body)
+        self.assertIn('vet_request_seconds_count{route="/stats/location/summary"} 3', body)
+        self.assertIn('vet_response_bytes_count{route="/facilities"} 1', body)
+        self.assertIn('vet_request_queries_bucket{route="/facilities",le="+Inf"} 1', body)
+
+    def test_slow_requests_log_their_sql(self):
+        with self.settings(SLOW_REQUEST_MS=0, RESPONSE_CACHE='none'), self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/stats/location/summary?state=MI')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['route'], '/stats/location/summary')
+        self.assertEqual(record['status'], 200)
+        self.assertTrue(any('"releases"' in q['sql'] for q in record['sql']))
+
+
+@unittest.skipIf(columnar.np is None, 'numpy is not installed')
+class ColumnarTestCases(DataTestCase):
+
+    urls = [
+        '/stats/state/all', '/stats/state/all?carcinogen=true', '/stats/state/all?chemical=lead&year=2018',
+        '/stats/state/all?chemical=zinc', '/stats/county/all?state=mi', '/stats/county/all?state=MI&pbt=true',
+        '/stats/county/all?state=MI&city=flint', '/stats/location/summary?state=MI',
+        '/stats/location/summary?state=MI&county=wayne', '/stats/location/summary?state=MI&city=FLINT',
+        '/stats/location/summary?state=OH', '/stats/summary?state=', '/stats/summary?state=&year=2018',
+        '/stats/location/top_chemicals?state=MI', '/stats/location/top_chemicals?state=TX&release_type=air',
+        '/stats/location/top_chemicals?state=MI&all=true&carcinogen=true',
+        '/stats/location/top_chemicals?state=MI&all=true&release_type=land',
+        '/stats/location/top_chemicals?state=MI&all=true&page_size=2&total=true',
+        '/stats/location/top_chemicals?state=MI&all=true&page_size=2&cursor=' + pagination.encode('BENZENE'),
+        '/stats/location/timeline/total?state=MI', '/stats/location/timeline/total?state=MI&chemical=benz',
+        '/stats/location/timeline/total?state=TX&release_type=water&carcinogen=true',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        # a release with unreported measures, whose sums stay NULL
+        Release.objects.create(doc_ctrl_num='DNULL', year=2019, facility_id='F4', chemical_id='C2', total=1)
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = self.directory + '/releases'
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_columnar_matches_orm(self):
+        with self.settings(USE_ROLLUPS=False, RESPONSE_CACHE='none'):
+            expected = {url: self.client.get(url) for url in self.urls}
+            expected = {url: b''.join(r.streaming_content) if r.streaming else r.content
+                        for url, r in expected.items()}
+
+            call_command('build_columnar_snapshot', '--dir', self.snapshot, stdout=StringIO())
+            with self.settings(ANALYTICS_BACKEND='columnar', COLUMNAR_SNAPSHOT_DIR=self.snapshot):
+                self.assertIsNotNone(columnar.engine())
+                for url in self.urls:
+                    with self.assertNumQueries(0):
+                        self.assertEqual(self.client.get(url).content, expected[url], url)
+
+    def test_stale_snapshot_falls_back_to_orm(self):
+        call_command('build_columnar_snapshot', '--dir', self.snapshot, stdout=StringIO())
+        dataset.bump()
+        Release.objects.filter(year=2019).delete()
+
+        with self.settings(ANALYTICS_BACKEND='columnar', COLUMNAR_SNAPSHOT_DIR=self.snapshot), \
+                self.assertLogs('viewModule.columnar', 'WARNING'):
+            self.assertIsNone(columnar.engine())
+            self.assertEqual(self.get_json('/stats/state/all'), [])
+
+
+class LoadTriTestCases(DataTestCase):
+    header = ['1. YEAR', '2. TRIFD', '4. FACILITY NAME', '6. CITY', '7. COUNTY', '8. ST', '9. ZIP',
+              '12. LATITUDE', '13. LONGITUDE', '16. STANDARD PARENT CO NAME', '34. CHEMICAL',
+              '37. TRI CHEMICAL/COMPOUND ID', '42. CARCINOGEN', '39. CLASSIFICATION', '47. 5.1 - FUGITIVE AIR',
+              '48. 5.2 - STACK AIR', '49. 5.3 - WATER', '50. 5.4 - UNDERGROUND', '54. 5.5.1 - LANDFILLS',
+              '62. ON-SITE RELEASE TOTAL', '80. OFF-SITE RELEASE TOTAL', '101. TOTAL RELEASES']
+
+    def write(self, rows):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+        self.addCleanup(os.remove, f.name)
+        with f:
+            writer = csv.writer(f)
+            writer.writerow(self.header)
+            writer.writerows(rows)
+        return f.name
+
+    def test_loads_a_new_year(self):
+        version = dataset.current_version()
+        path = self.write([
+            [2020, 'f1', 'Acme Plant', 'Detroit', 'Wayne', 'MI', '48201-1234', 42.33, -83.04, '', 'Benzene',
+             'C1', 'YES', 'TRI', 1, 2, 3, '', 4, 10, 5, 15],
+            [2020, 'F9', 'New Works', 'Lansing', 'Ingham', 'MI', '48933', 42.73, -84.55, '', 'Arsenic', 'C9', 'YES',
+             'TRI', '', '', '', '', '', '', '', ''],
+        ])
+        call_command('load_tri', path, stdout=StringIO())
+
+        self.assertEqual(Release.objects.filter(year=2020).count(), 2)
+        self.assertEqual(Release.objects.filter(year=2019).count(), 8)
+        loaded = Release.objects.get(year=2020, facility_id='F1')
+        self.assertEqual((loaded.air, loaded.water, loaded.land, loaded.on_site, loaded.off_site, loaded.total),
+                         (3, 3, 4, 10, 5, 15))
+        self.assertIsNone(Release.objects.get(facility_id='F9').total)
+
+        new = Facility.objects.get(id='F9')
+        self.assertEqual((new.city, new.zip, new.grid_cell), ('LANSING', 48933, spatial.cell(42.73, -84.55)))
+        self.assertEqual((new.location.state, new.location.county, new.location.state_fips), ('MI', 'INGHAM', 26))
+        # attributes missing from the file keep their value
+        self.assertEqual(Facility.objects.get(id='F1').parent_co_name, 'ACME CORP')
+        self.assertEqual(Chemical.objects.get(id='C9').name, 'ARSENIC')
+
+        self.assertTrue(ReleaseRollup.objects.filter(year=2020).exists())
+        self.assertGreater(dataset.current_version(), version)
+        self.assertEqual(self.get_json('/stats/location/summary?state=MI&year=2020')['total'], 15)
+
+    def test_replaces_the_releases_of_its_year(self):
+        row = [2019, 'F4', 'Gulf Refinery', 'Houston', 'Harris', 'TX', '77002', 29.76, -95.36, 'Gulf LLC', 'Benzene',
+               'C1', 'YES', 'TRI', 0, 7, 0, 0, 0, 7, 0, 7]
+        path = self.write([row])
+        call_command('load_tri', path, stdout=StringIO())
+        call_command('load_tri', path, stdout=StringIO())
+
+        self.assertEqual(list(Release.objects.filter(year=2019).values_list('facility_id', 'total')), [('F4', 7)])
+        self.assertEqual(Release.objects.filter(year=2018).count(), 3)
+        self.assertEqual(self.get_json('/stats/summary?state=&year=2019')['total'], 7)
+
+    def test_only_requested_years(self):
+        path = self.write([[2017, 'F1', '', '', '', '', '', '', '', '', 'Lead', 'C2', '', '', 1, 0, 0, 0, 0, 1, 0, 1]])
+        with self.assertRaises(CommandError):
+            call_command('load_tri', path, '--year', '2016', stdout=StringIO())
+        self.assertFalse(Release.objects.filter(year__lt=2018).exists())
+
+    def test_rejects_other_files(self):
+        self.header = ['NAME', 'VALUE']
+        with self.assertRaises(CommandError):
+            call_command('load_tri', self.write([['a', 1]]), stdout=StringIO())
+
+
+class BenchmarkTestCases(DataTestCase):
+    def test_generate_and_run(self):
+        from benchmark.generate import generate
+        from benchmark.run import run
+        from benchmark.compare import compare
+
+        quiet = lambda message: None
+        counts = generate(facilities=30, chemicals=8, releases=200, years=range(2018, 2020), replace=True, log=quiet)
+        self.assertEqual(counts['facilities'], 30)
+        self.assertEqual(Release.objects.count(), counts['releases'])
+        self.assertTrue(ReleaseRollup.objects.exists())
+
+        report = run(requests=2, warmup=0, routes=['stats/', 'facilities'], log=quiet)
+        self.assertIn('/stats/state/all', report['routes'])
+        self.assertIn('/facilities/bbox', report['routes'])
+        for route, result in report['routes'].items():
+            self.assertEqual(result['requests'], 2)
+            self.assertFalse([s for s in result['statuses'] if s.startswith('5')], route)
+            self.assertIsNotNone(result['p95_ms'])
+
+        slower = {'routes': {route: dict(result, p95_ms=result['p95_ms'] * 2 + 1)
+                             for route, result in report['routes'].items()}}
+        self.assertEqual(compare(report, report)[1], [])
+        self.assertEqual(sorted(compare(report, slower)[1]), sorted(report['routes']))
@@ -0,0 +1,61 @@
+# Top-N-over-time queries behind the timeline endpoints
+# The N largest groups across all years and their yearly totals come back from a single statement:
+# the grouped yearly sums are wrapped in a SUM() OVER window for the all-years total of each group and a
+# DENSE_RANK() OVER window ranking the groups, so no intermediate list of group keys goes through Python.
+from django.db import connections
+from django.db.models import F, Sum
+
+''' Dimensions a timeline can be ranked on: name -> (fields identifying a group, fields returned for it). '''
+DIMENSIONS = {
+    'chemical': (('chemical__id',), ('chemical__name',)),
+    'facility': (('facility__id',), ('facility__name',)),
+    'parent': (('facility__parent_co',), ('facility__parent_co_name',)),
+    'county': (('facility__state', 'facility__county'), ('facility__state', 'facility__county')),
+}
+# returned fields read from another path: parent companies group on their id and answer with the canonical name
+# under the field of the reported one
+SOURCES = {'facility__parent_co_name': 'facility__parent_co__name'}
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+def values(queryset, fields):
+    """queryset.values(*fields), with the fields of SOURCES read from their path."""
+    return queryset.values(*(field for field in fields if field not in SOURCES),
+                           **{field: F(SOURCES[field]) for field in fields if field in SOURCES})
+
+
+def top_over_time(queryset, dimension, limit=DEFAULT_LIMIT):
+    """Returns the yearly totals of the 'limit' groups of 'dimension' with the largest total over all years,
+    as [{'year': ..., <label fields>..., 'total': ...}] ordered by label and year."""
+    keys, labels = DIMENSIONS[dimension]
+    limit = max(1, min(int(limit), MAX_LIMIT))
+
+    # every field gets a plain alias so the outer statement can refer to it
+    fields = list(dict.fromkeys(keys + labels))
+    aliases = {field: 'f{}'.format(i) for i, field in enumerate(fields)}
+    grouped = queryset.filter(**{key + '__isnull': False for key in keys}).order_by().values(
+        period=F('year'), **{aliases[field]: F(SOURCES.get(field, field)) for field in fields}).annotate(
+        total=Sum('total'))
+
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    inner, params = grouped.query.sql_with_params()
+    key_columns = ', '.join(qn(aliases[key]) for key in keys)
+    label_columns = ', '.join(qn(aliases[label]) for label in labels)
+    sql = (
+        'SELECT {period}, {labels}, {total} FROM ('
+        ' SELECT ranked.*, DENSE_RANK() OVER (ORDER BY {group_total} DESC, {keys}) AS {rank} FROM ('
+        '  SELECT grouped.*, SUM(grouped.{total}) OVER (PARTITION BY {keys}) AS {group_total}'
+        '  FROM ({inner}) grouped'
+        ' ) ranked'
+        ') top WHERE {rank} <= %s ORDER BY {labels}, {period}'
+    ).format(period=qn('period'), labels=label_columns, total=qn('total'), keys=key_columns,
+             group_total=qn('group_total'), rank=qn('group_rank'), inner=inner)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*params, limit))
+        rows = cursor.fetchall()
+
+    return [{'year': row[0], **dict(zip(labels, row[1:-1])), 'total': row[-1]} for row in rows]
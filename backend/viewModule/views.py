@@ -1,626 +1,644 @@
 # This page handles requests by individual "view" functions
-from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest
 from rest_framework.response import Response
-from django.db.models import Q, Sum, Subquery, Count, Avg
+from django.db.models import Q, F, Sum, Subquery, Count, Avg, ExpressionWrapper, BigIntegerField, FloatField, Value
+from django.db.models.functions import Abs, Coalesce
 from viewModule.models import Facility as facility
 from viewModule.models import Chemical as chemical
 from viewModule.models import Release as release
+from viewModule.models import ReleaseRollup as release_rollup
+from viewModule import rollups, concurrency, timelines, encoding, columnar, spatial, metrics, pagination, sketches, \
+    suggest, location_resolver
+from viewModule.cache import cacheable
+from viewModule.filters import FACILITIES, CHEMICALS, ROLLUPS
 from django.core import serializers as szs
-from django.core.serializers.json import DjangoJSONEncoder
-import json
+from functools import partial
 import re
+from django.conf import settings
 
 latest_year = 2019
 
+# query parameters of the location and of the release filters (see filters.QuerySpec)
+geo_params = ('state', 'county', 'city')
+release_params = ('carcinogen', 'pbt', 'chemical', 'release_type')
+year_default = {'year': latest_year}
+# a comparison defaults to the latest year against the one before, by facility
+compare_default = {'year_a': latest_year - 1, 'year_b': latest_year, 'by': 'facility'}
+compare_page_size = 25
+# keyset pages of the all=true lists (see pagination.py)
+page_params = ('page_size', 'cursor', 'total')
+# facility columns returned by the facility lists; the grid cell only serves the viewport index, and the location
+# and parent company ids are surrogate keys that change whenever their tables are relinked
+internal_facility_fields = ('grid_cell', 'location', 'parent_co')
+facility_fields = [f.attname for f in facility._meta.concrete_fields if f.name not in internal_facility_fields]
+
 
 def health_check(request):
     return HttpResponse('OK')
 
 
-''' Returns a tree of Q objects with location filters from the supplied parameters.'''
-
-
-def geo_filter(request):
-    state = request.GET.get('state')
-    county = request.GET.get('county')
-    city = request.GET.get('city')
-
-    filters = Q()
+''' Returns the per-route request histograms of this process in the Prometheus text format.'''
 
-    if state is not None:
-        filters.add(Q(facility__state=state.upper()), filters.connector)
 
-    if county is not None:
-        filters.add(Q(facility__county=county.upper()), filters.connector)
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
 
-    if city is not None:
-        filters.add(Q(facility__city=city.upper()), filters.connector)
 
-    return filters
+''' Returns the releases matching every filter of 'spec' but the year, the rows behind the release lists and timelines.'''
 
 
-''' Returns a tree of Q objects with filters for the 'facilities' table ONLY from the supplied parameters.'''
+def filtered_releases(spec):
+    return release.objects.filter(spec.location() & Q(total__gt=0) & spec.releases())
 
 
-def filter_facilities(request):
-    carcinogen = request.GET.get('carcinogen')
+''' Annotates the grouped releases with the sum of the measure chosen by 'release_type', or with every measure.'''
 
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
-    release_type = request.GET.get('release_type')
 
-    filters = Q()
-
-    # filter by release_type
+def release_totals(queryset, release_type):
     if release_type is not None:
-        if release_type.lower() == 'air':
-            filters.add(Q(release__air__gt=0), filters.connector)
-        elif release_type.lower() == 'water':
-            filters.add(Q(release__water__gt=0), filters.connector)
-        elif release_type.lower() == 'land':
-            filters.add(Q(release__land__gt=0), filters.connector)
-        elif release_type.lower() == 'on_site':
-            filters.add(Q(release__on_site__gt=0), filters.connector)
-        elif release_type.lower() == 'off_site':
-            filters.add(Q(release__off_site__gt=0), filters.connector)
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical), filters.connector)
-
-    # filter by carcinogens and PBTs
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
+        return queryset.annotate(total=Sum(release_type))
+    return queryset.annotate(total=Sum('total'), air=Sum('air'), water=Sum('water'), land=Sum('land'),
+                             off_site=Sum('off_site'))
 
-    return filters
 
+def timeline_limit(spec):
+    return timelines.DEFAULT_LIMIT if spec.limit is None else spec.limit
 
-''' Returns a tree of Q objects with filters for the 'chemicals' table ONLY from the supplied parameters.'''
-
-
-def filter_chemicals(request):
-    carcinogen = request.GET.get('carcinogen')
-
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
-    release_type = request.GET.get('release_type')
-
-    filters = Q()
-
-    # filter by release_type
-    if release_type is not None:
-        if release_type.lower() == 'air':
-            filters.add(Q(release__air__gt=0), filters.connector)
-        elif release_type.lower() == 'water':
-            filters.add(Q(release__water__gt=0), filters.connector)
-        elif release_type.lower() == 'land':
-            filters.add(Q(release__land__gt=0), filters.connector)
-        elif release_type.lower() == 'on_site':
-            filters.add(Q(release__on_site__gt=0), filters.connector)
-        elif release_type.lower() == 'off_site':
-            filters.add(Q(release__off_site__gt=0), filters.connector)
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(name__icontains=chemical), filters.connector)
 
-    # filter by carcinogens only or PBTs only
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(classification='PBT'), filters.connector)
-
-    return filters
-
-
-''' Returns a tree of Q objects with filters for the 'releases' table ONLY from the supplied parameters.'''
-
-
-def filter_releases(request):
-    carcinogen = request.GET.get('carcinogen')
-
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
-    release_type = request.GET.get('release_type')
+''' Returns list of facilties filtered by state, year, release type, and chemical classification.'''
 
-    filters = Q(total__gt=0)
 
-    # filter by release_type
-    if release_type is not None:
-        if release_type.lower() == 'air':
-            filters.add(Q(air__gt=0), filters.connector)
-        elif release_type.lower() == 'water':
-            filters.add(Q(water__gt=0), filters.connector)
-        elif release_type.lower() == 'land':
-            filters.add(Q(land__gt=0), filters.connector)
-        elif release_type.lower() == 'on_site':
-            filters.add(Q(on_site__gt=0), filters.connector)
-        elif release_type.lower() == 'off_site':
-            filters.add(Q(off_site__gt=0), filters.connector)
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical), filters.connector)
-
-    if request.path != '/chemicals':
-        # filter by carcinogens only or PBTs only
-        if carcinogen is not None and str(carcinogen).lower() == 'true':
-            filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-        if pbt is not None and str(pbt).lower() == 'true':
-            filters.add(Q(chemical__classification='PBT'), filters.connector)
-    return filters
+@cacheable(*geo_params, *release_params, 'year', defaults=year_default)
+def get_facilities(request):
+    spec = request.spec
+    if spec.state is None:
+        return HttpResponseBadRequest()
 
+    # add sum of total releases for the facility with these filters
+    raw = facility.objects.filter(spec.location(FACILITIES) & Q(release__year=spec.year) &
+                                  spec.releases(FACILITIES)).distinct().annotate(
+        total=Sum('release__total')).values(*facility_fields, 'total')
+    return encoding.stream(request, raw)
 
-''' Returns list of facilties filtered by state, year, release type, and chemical classification.'''
 
+''' Returns the facilities inside a map viewport (west, south, east, north) with their total releases, or
+clusters of them (count, summed total and cell bounds) below FACILITY_CLUSTER_ZOOM.'''
 
-def get_facilities(request):
-    state = request.GET.get('state')
-    county = request.GET.get('county')
-    city = request.GET.get('city')
-    filters = Q()
 
-    if state is None:
+@cacheable('west', 'south', 'east', 'north', 'zoom', *release_params, 'year', defaults=year_default)
+def get_facilities_in_bbox(request):
+    spec = request.spec
+    west, south, east, north = spec.west, spec.south, spec.east, spec.north
+    if None in (west, south, east, north) or south > north:
         return HttpResponseBadRequest()
+    zoom = spec.zoom or 0
 
-    if state is not None:
-        filters.add(Q(state=state.upper()), filters.connector)
+    queryset = facility.objects.filter(spatial.bbox_filter(west, south, east, north) & Q(release__year=spec.year) &
+                                       spec.releases(FACILITIES))
 
-    if county is not None:
-        filters.add(Q(county=county.upper()), filters.connector)
+    if zoom >= getattr(settings, 'FACILITY_CLUSTER_ZOOM', 9):
+        raw = queryset.distinct().annotate(total=Sum('release__total')).values(*facility_fields, 'total')
+        return encoding.respond(request, {'clustered': False, 'results': list(raw)})
 
-    if city is not None:
-        filters.add(Q(city=city.upper()), filters.connector)
-
-    y = int(request.GET.get('year', default=latest_year))
-
-    # add sum of total releases for the facility with these filters
-    raw = facility.objects.filter(filters & Q(release__year=y) & filter_facilities(request)).distinct().annotate(
-        total=Sum('release__total')).values()
-    response = json.dumps(list(raw), cls=DjangoJSONEncoder)
-    return HttpResponse(response, content_type='application/json')
+    level = spatial.cluster_level(zoom)
+    cells = queryset.order_by().values(cluster=ExpressionWrapper(
+        F('grid_cell') / (1 << 2 * (spatial.GRID_BITS - level)), output_field=BigIntegerField())).annotate(
+        count=Count('id', distinct=True), total=Sum('release__total')).order_by('cluster')
+    clusters = []
+    for c in cells:
+        w, s, e, n = spatial.cell_bounds(c['cluster'], level)
+        clusters.append({'latitude': (s + n) / 2, 'longitude': (w + e) / 2, 'bounds': [w, s, e, n],
+                         'count': c['count'], 'total': c['total']})
+    return encoding.respond(request, {'clustered': True, 'results': clusters})
 
 
 ''' Returns the chemicals and their total amounts released by a specific facility and year'''
 
 
+@cacheable(*release_params, 'year', defaults=year_default)
 def get_chemicals(request, facility_id):
-    y = int(request.GET.get('year', default=latest_year))
-
-    filters = Q(facilities__id=facility_id) & Q(release__year=y)
-    filters.add(filter_chemicals(request), filters.connector)
+    spec = request.spec
+    filters = Q(facilities__id=facility_id) & Q(release__year=spec.year) & spec.releases(CHEMICALS)
 
     raw = chemical.objects.filter(filters).values().annotate(
         total=Sum('release__total'))
-    response = json.dumps(list(raw), cls=DjangoJSONEncoder)
-    return HttpResponse(response, content_type='application/json')
+    return encoding.respond(request, list(raw))
 
 
 ''' Returns distinct chemcials released in a location and year'''
 
 
+@cacheable(*geo_params, *release_params, 'year', defaults=year_default)
 def get_chemicals_in_window(request):
-    state = request.GET.get('state')
-    y = int(request.GET.get('year', default=latest_year))
+    spec = request.spec
+    if spec.state is None:
+        return HttpResponseBadRequest()
+
+    # releases table is queried here instead to add on (relational) filters for the chemicals table
+    raw = filtered_releases(spec).filter(year=spec.year).values('chemical__name').order_by(
+        'chemical__name').distinct()
+
+    return encoding.respond(request, [x['chemical__name'] for x in raw])
 
-    if state is None:
+
+''' Returns type-ahead suggestions (kind, id and name, best first) for 'q' among the chemical, facility and parent
+company names, or only those of 'kind'. Served from memory, so the responses are not cached.'''
+
+
+def search_suggest(request):
+    kind = request.GET.get('kind')
+    try:
+        limit = int(request.GET.get('limit', suggest.DEFAULT_LIMIT))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if kind is not None and kind not in suggest.KINDS:
         return HttpResponseBadRequest()
+    return encoding.respond(request, suggest.suggest(request.GET.get('q', ''), kind, limit))
 
-    # releases table is queried here instead to add on (relational) filters for the chemicals table (through filter_releases)
-    raw = release.objects.filter(geo_filter(request) & filter_releases(request) & Q(
-        year=y)).values('chemical__name').order_by('chemical__name').distinct()
 
-    response = json.dumps([x['chemical__name']
-                           for x in raw], cls=DjangoJSONEncoder)
-    return HttpResponse(response, content_type='application/json')
+dioxin = Q(chemical__classification='Dioxin')
+
+''' Classified totals reported by state_total_releases: response key -> (summed column, chemical condition).
+All of them are conditional sums of the same aggregate, so a new classification is one more entry here.'''
+state_totals = {
+    'totalonsite': ('on_site', dioxin),
+    'air': ('air', dioxin),
+    'water': ('water', dioxin),
+    'land': ('land', dioxin),
+    'totaloffsite': ('off_site', dioxin),
+    'totaldioxin': ('total', dioxin),
+    'totalcarcs': ('total', Q(chemical__carcinogen='YES')),
+    'totalpbt': ('total', Q(chemical__classification='PBT')),
+    'totalmetals': ('total', Q(chemical__metal_category__gt=0)),
+    'totalcleanair': ('total', Q(chemical__clean_air_act_chemical='YES')),
+}
 
 
 ''' Return total stats released for a state & year.'''
 
 
+@cacheable(*geo_params, 'year', 'exact', defaults=year_default)
 def state_total_releases(request):
-    state = request.GET.get('state')
-    if state is None:
+    spec = request.spec
+    if spec.state is None:
         return HttpResponseBadRequest()
 
-    y = int(request.GET.get('year', default=latest_year))
-    t_dioxin, t_carc, t_onsite, t_air, t_water, t_land, t_offsite, t_facilitycount = 0, 0, 0, 0, 0, 0, 0, 0
-    result = {}
-
-    if y != 'None':
-        queryset = release.objects.filter(geo_filter(request) & Q(year=y))
-        t_facilitycount = int(release.objects.filter(geo_filter(request) &
-                                                     Q(year=y)).values('facility').distinct().count())
-        # populate result dictionary filtered by types
-        for q in queryset:
-            if q.chemical.carcinogen == 'YES':
-                t_carc += q.total
-            if q.chemical.classification == 'Dioxin':
-                t_dioxin += q.total
-                t_onsite += q.on_site
-                t_offsite += q.off_site
-                t_air += q.air
-                t_water += q.water
-                t_land += q.land
-
-        result = {'totalonsite': t_onsite, 'air': t_air, 'water': t_water, 'land': t_land,
-                  'totaloffsite': t_offsite, 'totaldioxin': t_dioxin, 'totalcarcs': t_carc,
-                  'numtrifacilities': t_facilitycount}
-        return JsonResponse(result)
+    # the facilities are counted from the rollups when they are built, else by the same aggregate
+    counted = sketches.can_answer(spec)
+    distinct = {} if counted else {'numtrifacilities': Count('facility', distinct=True)}
+    # one aggregate over the releases of the location: a conditional sum per classified total
+    raw = release.objects.filter(spec.location() & Q(year=spec.year)).aggregate(
+        **distinct, **{key: Sum(column, filter=condition) for key, (column, condition) in state_totals.items()})
+
+    result = {key: raw[key] or 0 for key in state_totals}
+    result['numtrifacilities'] = sketches.facilities(spec)[()] if counted else raw['numtrifacilities']
+    return encoding.respond(request, result)
 
 
 ''' Returns total releases for a state and year'''
 
 
+@cacheable(*geo_params, 'carcinogen', 'pbt', 'chemical', 'year', 'exact', defaults=year_default)
 def all_state_total_releases(request):
-    y = int(request.GET.get('year', default=latest_year))
-    carcinogen = request.GET.get('carcinogen')
+    spec = request.spec
 
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
+    engine = columnar.engine()
+    if engine is not None:
+        return encoding.respond(request, engine.location_totals(spec, by_county=False))
 
-    filters = Q()
+    # the rollups hold the sums, the distinct facilities of each state come from the sketches
+    if rollups.can_answer(spec) and sketches.can_answer(spec):
+        queryset = release_rollup.objects.filter(spec.location(ROLLUPS) & spec.chemicals(ROLLUPS) &
+                                                 Q(year=spec.year)).values(
+            facility__state=F('state')).annotate(total=Sum('total'), air=Sum('air'), water=Sum('water'),
+                                                 land=Sum('land'), off_site=Sum('off_site'),
+                                                 on_site=Sum('on_site')).order_by('facility__state')
+        counts = sketches.facilities(spec, 'state')
+        rows = list(queryset)
+        for row in rows:
+            row['num_facilities'] = counts.get((row['facility__state'],), 0)
+        return encoding.respond(request, rows)
 
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical), filters.connector)
+    queryset = release.objects.filter(spec.chemicals() &
+                                      spec.location() & Q(year=spec.year)).values('facility__state').annotate(total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum(
+                                          'water')).annotate(land=Sum('land')).annotate(off_site=Sum('off_site')).annotate(on_site=Sum('on_site')).annotate(num_facilities=Count('facility__id', distinct=True)).order_by('facility__state')
 
-    # filter by carcinogens and PBTs
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
+    return encoding.respond(request, list(queryset))
 
-    queryset = release.objects.filter(filters &
-                                      geo_filter(request) & Q(year=y)).values('facility__state').annotate(total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum(
-                                          'water')).annotate(land=Sum('land')).annotate(off_site=Sum('off_site')).annotate(on_site=Sum('on_site')).annotate(num_facilities=Count('facility__id')).order_by('facility__state')
 
-    return JsonResponse(list(queryset), content_type='application/json', safe=False)
+''' Adds the FIPS code of each county to the rows of all_county_total_releases, ordered by county then state.'''
 
 
-''' Returns releases for the counties of a state in a year.'''
+def county_rows(rows):
+    for row in rows:
+        row['fips'] = location_resolver.county_fips(row['facility__state'], row['facility__county'])
+    # NULL counties sort last, as in PostgreSQL
+    return sorted(rows, key=lambda r: (r['facility__county'] is None, r['facility__county'] or '',
+                                       r['facility__state'] or ''))
 
 
-def all_county_total_releases(request):
-    y = int(request.GET.get('year', default=latest_year))
-    state = request.GET.get('state')
-    carcinogen = request.GET.get('carcinogen')
+''' Returns releases for the counties of a state in a year, with their FIPS code.'''
 
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
 
-    filters = Q()
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical), filters.connector)
-
-    # filter by carcinogens and PBTs
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
-
-    # filter by state (used for single state on map page)
-    if state is not None:
-        filters.add(Q(facility__state=state.upper()), filters.connector)
-
-    queryset = release.objects.filter(filters &
-                                      geo_filter(request) & Q(year=y)).values('facility__county',
-                                                                              'facility__state').annotate(
+@cacheable(*geo_params, 'carcinogen', 'pbt', 'chemical', 'year', 'exact', defaults=year_default)
+def all_county_total_releases(request):
+    spec = request.spec
+
+    engine = columnar.engine()
+    if engine is not None:
+        return encoding.respond(request, county_rows(engine.location_totals(spec, by_county=True)))
+
+    if rollups.can_answer(spec) and sketches.can_answer(spec):
+        queryset = release_rollup.objects.filter(spec.location(ROLLUPS) & spec.chemicals(ROLLUPS) &
+                                                 Q(year=spec.year)).values(
+            facility__county=F('county'), facility__state=F('state')).annotate(
+            total=Sum('total'), air=Sum('air'), water=Sum('water'), land=Sum('land'), off_site=Sum('off_site'),
+            on_site=Sum('on_site')).order_by('facility__county')
+        counts = sketches.facilities(spec, 'county')
+        rows = list(queryset)
+        for row in rows:
+            row['num_facilities'] = counts.get((row['facility__county'], row['facility__state']), 0)
+        return encoding.respond(request, county_rows(rows))
+
+    # the location filter narrows to a single state on the map page; the counties are grouped on their location
+    # id and named from the location resolver
+    queryset = release.objects.filter(spec.chemicals() &
+                                      spec.location() & Q(year=spec.year)).values('facility__location').annotate(
         total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum(
             'water')).annotate(land=Sum('land')).annotate(off_site=Sum('off_site')).annotate(
-        on_site=Sum('on_site')).annotate(num_facilities=Count('facility__id')).order_by('facility__county')
+        on_site=Sum('on_site')).annotate(num_facilities=Count('facility__id', distinct=True)).order_by()
 
-    return JsonResponse(list(queryset), content_type='application/json', safe=False)
+    rows = []
+    for row in queryset:
+        county, state, _ = location_resolver.label(row.pop('facility__location'))
+        rows.append({'facility__county': county, 'facility__state': state, **row})
+    return encoding.respond(request, county_rows(rows))
 
 
 ''' Returns all chemicals and respective total release (by type) amounts for queried location {Graph 13} '''
 
 
+@cacheable(*geo_params, 'year', defaults=year_default)
 def all_chemicals_releases(request):
-    state = request.GET.get('state')
-    y = int(request.GET.get('year', default=latest_year))
-
-    if state is None:
+    spec = request.spec
+    if spec.state is None:
         return HttpResponseBadRequest()
 
-    qs = release.objects.filter(geo_filter(request) & Q(year=y)).values('chemical__name').annotate(
+    qs = release.objects.filter(spec.location() & Q(year=spec.year)).values('chemical__name').annotate(
         Sum('air'), Sum('water'), Sum('land'), Sum('off_site')).order_by('chemical__name')
 
-    return JsonResponse(list(qs), content_type='application/json', safe=False)
+    return encoding.respond(request, list(qs))
 
 
 ''' Returns all chemicals and respective total release (not by type / only total) amounts in queried location {Graph 15} '''
 
 
+@cacheable(*geo_params, 'year', defaults=year_default)
 def all_chemicals_total_releases(request):
-    state = request.GET.get('state')
-    y = int(request.GET.get('year', default=latest_year))
-
-    if state is None:
+    spec = request.spec
+    if spec.state is None:
         return HttpResponseBadRequest()
 
-    qs = release.objects.filter(geo_filter(request) & Q(year=y)).values(
+    qs = release.objects.filter(spec.location() & Q(year=spec.year)).values(
         'chemical__name').annotate(Sum('total')).order_by('chemical__name')
 
-    return JsonResponse(list(qs), content_type='application/json', safe=False)
+    return encoding.respond(request, list(qs))
 
 
-''' Return top 10 companies in total releases by location & year'''
+''' Return top 10 companies in total releases by location & year, grouped on the canonical parent company'''
 
 
+def top_parentco_releases_data(request):
+    spec = request.spec
+    queryset = timelines.values(release.objects.filter(spec.chemicals() & spec.location() & Q(year=spec.year)),
+                                timelines.DIMENSIONS['parent'][0] + timelines.DIMENSIONS['parent'][1])
+    queryset = release_totals(queryset, spec.release_type)
+    return list(queryset.filter(total__gt=0).order_by('-total')[:10])
+
+
+@cacheable(*geo_params, *release_params, 'year', defaults=year_default)
 def top_parentco_releases(request):
-    state = request.GET.get('state')
-    if state is None:
+    if request.spec.state is None:
         return HttpResponseBadRequest()
-    carcinogen = request.GET.get('carcinogen')
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
-    y = int(request.GET.get('year', default=latest_year))
-    release_type = request.GET.get('release_type', default='all').upper()
-    queryset = release.objects.filter(
-        geo_filter(request) & Q(year=y)).values('facility__parent_co_name')
-
-    filters = Q()
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical), filters.connector)
-
-    # filter by carcinogens and PBTs
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
-
-    queryset = release.objects.filter(filters &
-                                      geo_filter(request) & Q(year=y)).values('facility__parent_co_name')
-
-    if release_type == 'AIR':
-        queryset = queryset.annotate(total=Sum('air'))
-    elif release_type == 'WATER':
-        queryset = queryset.annotate(total=Sum('water'))
-    elif release_type == 'LAND':
-        queryset = queryset.annotate(total=Sum('land'))
-    elif release_type == 'ON_SITE':
-        queryset = queryset.annotate(
-            total=Sum('on_site'))
-    elif release_type == 'OFF_SITE':
-        queryset = queryset.annotate(
-            total=Sum('off_site'))
-    else:
-        queryset = queryset.annotate(total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum('water')).annotate(
-            land=Sum('land')).annotate(off_site=Sum('off_site'))
-    response = list(queryset.filter(total__gt=0).order_by('-total')[:10])
-    return JsonResponse(response, content_type='application/json', safe=False)
+    return encoding.respond(request, top_parentco_releases_data(request))
 
 
 ''' Return top ten polluting facilities over time for a location.'''
 
 
-def timeline_top_parentco_releases(request):
-    state = request.GET.get('state')
+def timeline_top_parentco_releases_data(request):
+    return timelines.top_over_time(filtered_releases(request.spec), 'parent', timeline_limit(request.spec))
 
-    if state is None:
+
+@cacheable(*geo_params, *release_params, 'limit')
+def timeline_top_parentco_releases(request):
+    if request.spec.state is None:
         return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_top_parentco_releases_data(request))
+
 
-    # values_list() returns QuerySet containing tuples, with param flat= true it returns single values instead of tuples
-    parents = list(release.objects.filter(geo_filter(request) & filter_releases(request)).values_list(
-        'facility__parent_co_name', flat=True).annotate(total=Sum('total')).order_by('-total'))[:10]
-    response = release.objects.filter(geo_filter(request) & filter_releases(request) & Q(facility__parent_co_name__in=parents)).values(
-        'year', 'facility__parent_co_name').order_by('facility__parent_co_name', 'year').annotate(total=Sum('total'))
+""" Returns the total releases (in lbs) in a location for each available year. """
 
-    return HttpResponse(json.dumps(list(response), cls=DjangoJSONEncoder), content_type='application/json')
 
+def timeline_total_data(request):
+    engine = columnar.engine()
+    if engine is not None:
+        return engine.timeline_total(request.spec)
 
-""" Returns the total releases (in lbs) in a location for each available year. """
+    queryset = filtered_releases(request.spec).values('year').annotate(total=Sum('total')).order_by('year')
+    return list(queryset)
 
 
+@cacheable(*geo_params, *release_params)
 def timeline_total(request):
-    state = request.GET.get('state')
-
-    if state is None:
+    if request.spec.state is None:
         return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_total_data(request))
 
-    queryset = release.objects.filter(geo_filter(request) & filter_releases(request)).values(
-        'year').annotate(total=Sum('total')).order_by('year')
-    response = json.dumps(list(queryset), cls=DjangoJSONEncoder)
 
-    return HttpResponse(response, content_type='application/json')
+''' Returns one keyset page of an all=true list of groups of 'field' (a grouped queryset, or rows in memory)
+with its continuation token, and with total=true the number of groups counted over the ungrouped 'source'.'''
+
+
+def list_page(request, source, groups, field):
+    spec = request.spec
+    try:
+        if isinstance(groups, list):
+            result = pagination.page_rows(groups, field, spec)
+        else:
+            result = pagination.page(groups, field, spec)
+    except ValueError:
+        return HttpResponseBadRequest()
+    if spec.total:
+        result['total'] = len(groups) if source is None else pagination.count(
+            source, field, spec.release_type or 'total')
+    return encoding.respond(request, result)
 
 
 ''' Return top ten polluting facilities by location. '''
 
 
+def top_facility_releases_source(spec):
+    return release.objects.filter(spec.chemicals() & spec.location() & Q(year=spec.year))
+
+
+def top_facility_releases_queryset(request):
+    spec = request.spec
+    queryset = release_totals(top_facility_releases_source(spec).values('facility__name'), spec.release_type)
+
+    if spec.all:
+        return queryset.filter(total__gt=0).order_by('facility__name')
+    return queryset.filter(total__gt=0).order_by('-total')[:10]
+
+
+def top_facility_releases_data(request):
+    return list(top_facility_releases_queryset(request))
+
+
+@cacheable(*geo_params, *release_params, 'all', *page_params, 'year', defaults=year_default)
 def top_facility_releases(request):
-    state = request.GET.get('state')
-    carcinogen = request.GET.get('carcinogen')
-    pbt = request.GET.get('pbt')
-    chemical = request.GET.get('chemical')
-    all = request.GET.get('all')
-    y = int(request.GET.get('year', default=latest_year))
-    release_type = request.GET.get('release_type', default='all').upper()
-    filters = Q()
-
-    # filter by chemicals
-    if chemical is not None and chemical != "all":
-        filters.add(Q(chemical__name__icontains=chemical),
-                    filters.connector)
-
-    # filter by carcinogens and PBTs
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
-
-    queryset = release.objects.filter(filters &
-                                      geo_filter(request) & Q(year=y)).values('facility__name')
-
-    if release_type == 'AIR':
-        queryset = queryset.annotate(total=Sum('air'))
-    elif release_type == 'WATER':
-        queryset = queryset.annotate(total=Sum('water'))
-    elif release_type == 'LAND':
-        queryset = queryset.annotate(total=Sum('land'))
-    elif release_type == 'ON_SITE':
-        queryset = queryset.annotate(
-            total=Sum('on_site'))
-    elif release_type == 'OFF_SITE':
-        queryset = queryset.annotate(
-            total=Sum('off_site'))
-    else:
-        queryset = queryset.annotate(total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum('water')).annotate(
-            land=Sum('land')).annotate(off_site=Sum('off_site'))
-
-    response = []
-    if all is not None and str(all).lower() == 'true':
-        response = list(queryset.filter(total__gt=0).order_by('facility__name'))
-    else:
-        response = list(queryset.filter(total__gt=0).order_by('-total')[:10])
-    return JsonResponse(response, content_type='application/json', safe=False)
+    spec = request.spec
+    if spec.all and pagination.requested(spec):
+        return list_page(request, top_facility_releases_source(spec), top_facility_releases_queryset(request),
+                         'facility__name')
+    if spec.all:
+        return encoding.stream(request, top_facility_releases_queryset(request))
+    return encoding.respond(request, top_facility_releases_data(request))
 
 
 ''' Return top ten polluting facilities over time for a location.'''
 
 
-def timeline_top_facility_releases(request):
-    state = request.GET.get('state')
+def timeline_top_facility_releases_data(request):
+    return timelines.top_over_time(filtered_releases(request.spec), 'facility', timeline_limit(request.spec))
 
-    if state is None:
+
+@cacheable(*geo_params, *release_params, 'limit')
+def timeline_top_facility_releases(request):
+    if request.spec.state is None:
         return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_top_facility_releases_data(request))
 
-    release_list = release.objects.filter(geo_filter(request) & filter_releases(request)).values(
-        'facility__id').annotate(total=Sum('total')).order_by('-total')
-    top_facilities = [x['facility__id'] for x in release_list][:10]
-    lines = release.objects.filter(geo_filter(request) & filter_releases(request) & Q(facility__id__in=top_facilities)).values(
-        'year', 'facility__name').order_by('facility__name', 'year').annotate(total=Sum('total'))
 
-    return HttpResponse(json.dumps(list(lines), cls=DjangoJSONEncoder), content_type='application/json')
+''' Queries behind a release summary (name -> zero-argument callable), independent of each other.'''
 
 
-''' Returns summary points for each state and year.'''
+def summary_tasks(request, geo=True):
+    spec = request.spec
+    engine = columnar.engine()
+    if engine is not None:
+        return {'summary': partial(engine.summary, spec, geo=geo)}
 
+    if rollups.can_answer(spec):
+        location = spec.location(ROLLUPS) if geo else Q()
+        if not sketches.can_answer(spec):
+            return {'summary': partial(rollups.summary, location, spec.year)}
+        # the distinct chemicals are merged from the sketches instead of counted over the rollup rows
+        return {'summary': partial(rollups.summary, location, spec.year, chemicals=False),
+                'chemicals': partial(sketches.chemicals, spec, geo=geo)}
 
-def country_summary(request):
-    state = request.GET.get('state')
-    y = int(request.GET.get('year', default=latest_year))
+    releases = release.objects.filter((spec.location() if geo else Q()) & Q(year=spec.year))
+    return {
+        'summary': partial(releases.aggregate, total=Sum('total'), num_facilities=Count('facility__id', distinct=True),
+                           num_chemicals=Count('chemical__id', distinct=True), total_air=Sum('air'),
+                           total_water=Sum('water'), total_land=Sum('land'), total_on_site=Sum('on_site'),
+                           total_off_site=Sum('off_site')),
+        'carcinogen': partial(releases.filter(chemical__carcinogen='YES').aggregate, carcinogen=Sum('total')),
+    }
 
-    if state is None:
-        return HttpResponseBadRequest()
 
-    raw = release.objects.filter(Q(year=y)).aggregate(total=Sum(
-        'total'), num_facilities=Count('facility__id', distinct=True), num_chemicals=Count('chemical__id', distinct=True),
-        total_air=Sum('air'), total_water=Sum('water'), total_land=Sum('land'), total_on_site=Sum('on_site'), total_off_site=Sum('off_site'))
-    raw['total_carcinogen'] = release.objects.filter(Q(year=y) & Q(
-        chemical__carcinogen='YES')).aggregate(carcinogen=Sum('total'))['carcinogen']
-    response = json.dumps(raw, cls=DjangoJSONEncoder)
+def summary_result(results):
+    raw = results['summary']
+    if 'carcinogen' in results:
+        raw['total_carcinogen'] = results['carcinogen']['carcinogen']
+    if 'chemicals' in results:
+        raw['num_chemicals'] = results['chemicals']
+    return raw
 
-    return HttpResponse(response, content_type='application/json')
+
+''' Returns summary points for each state and year.'''
+
+
+@cacheable('state', 'year', 'exact', defaults=year_default)
+async def country_summary(request):
+    if request.spec.state is None:
+        return HttpResponseBadRequest()
+
+    tasks = await concurrency.call(request, summary_tasks, request, geo=False)
+    return encoding.respond(request, summary_result(await concurrency.gather(request, tasks)))
 
 
 ''' Returns release summary based on location. '''
 
 
-def location_summary(request):
-    state = request.GET.get('state')
-    y = int(request.GET.get('year', default=latest_year))
+def location_summary_data(request):
+    return summary_result(concurrency.run_all(summary_tasks(request)))
 
-    if state is None:
+
+@cacheable(*geo_params, 'year', 'exact', defaults=year_default)
+async def location_summary(request):
+    if request.spec.state is None:
         return HttpResponseBadRequest()
 
-    raw = release.objects.filter(geo_filter(request) & Q(year=y)).aggregate(total=Sum(
-        'total'), num_facilities=Count('facility__id', distinct=True), num_chemicals=Count('chemical__id', distinct=True),
-        total_air=Sum('air'), total_water=Sum('water'), total_land=Sum('land'), total_on_site=Sum('on_site'), total_off_site=Sum('off_site'))
-    raw['total_carcinogen'] = release.objects.filter(geo_filter(request) & Q(year=y) & Q(
-        chemical__carcinogen='YES')).aggregate(carcinogen=Sum('total'))['carcinogen']
+    # the summary and carcinogen aggregates run side by side, so the request takes as long as the slower one
+    tasks = await concurrency.call(request, summary_tasks, request)
+    return encoding.respond(request, summary_result(await concurrency.gather(request, tasks)))
 
-    response = json.dumps(raw, cls=DjangoJSONEncoder)
 
-    return HttpResponse(response, content_type='application/json')
+''' Returns amount released by each chemical within geo spec. '''
 
 
-''' Returns amount released by each chemical within geo spec. '''
+def top_chemicals_source(spec):
+    if rollups.can_answer(spec):
+        # 'positive' rollups hold exactly the releases with total > 0
+        return release_rollup.objects.filter(
+            spec.location(ROLLUPS) & spec.chemicals(ROLLUPS, search=False) & Q(year=spec.year, positive=True))
+    return release.objects.filter(Q(total__gt=0) & spec.chemicals(search=False) & spec.location() &
+                                  Q(year=spec.year))
 
 
+def top_chemicals_queryset(request):
+    spec = request.spec
+    queryset = release_totals(top_chemicals_source(spec).values('chemical__name'), spec.release_type)
+
+    if spec.all:
+        return queryset.filter(total__gt=0).order_by('chemical__name')
+    return queryset.filter(total__gt=0).order_by('-total')[:10]
+
+
+def top_chemicals_data(request):
+    engine = columnar.engine()
+    if engine is not None:
+        return engine.top_chemicals(request.spec)
+    return list(top_chemicals_queryset(request))
+
+
+@cacheable(*geo_params, 'carcinogen', 'pbt', 'release_type', 'all', *page_params, 'year', defaults=year_default)
 def top_chemicals(request):
-    carcinogen = request.GET.get('carcinogen')
-    pbt = request.GET.get('pbt')
-    state = request.GET.get('state')
-    all = request.GET.get('all')
-    if state is None:
+    spec = request.spec
+    if spec.state is None:
         return HttpResponseBadRequest()
-    y = int(request.GET.get('year', default=latest_year))
-    release_type = request.GET.get('release_type', default='all').upper()
-    filters = Q(total__gt=0)
-
-    if pbt is not None and str(pbt).lower() == 'true':
-        filters.add(Q(chemical__classification='PBT'), filters.connector)
-
-    # filter by carcinogens only or PBTs only
-    if carcinogen is not None and str(carcinogen).lower() == 'true':
-        filters.add(Q(chemical__carcinogen='YES'), filters.connector)
-
-    queryset = release.objects.filter(filters & geo_filter(request) & Q(year=y)).values(
-        'chemical__name')
-
-    if release_type == 'AIR':
-        queryset = queryset.annotate(total=Sum('air'))
-    elif release_type == 'WATER':
-        queryset = queryset.annotate(total=Sum('water'))
-    elif release_type == 'LAND':
-        queryset = queryset.annotate(total=Sum('land'))
-    elif release_type == 'ON_SITE':
-        queryset = queryset.annotate(
-            total=Sum('on_site'))
-    elif release_type == 'OFF_SITE':
-        queryset = queryset.annotate(
-            total=Sum('off_site'))
-    else:
-        queryset = queryset.annotate(total=Sum('total')).annotate(air=Sum('air')).annotate(water=Sum('water')).annotate(
-            land=Sum('land')).annotate(off_site=Sum('off_site'))
-
-    response = []
-    if all is not None and str(all).lower() == 'true':
-        response = list(queryset.filter(total__gt=0).order_by('chemical__name'))
-    else:
-        response = list(queryset.filter(total__gt=0).order_by('-total')[:10])
-    return JsonResponse(response, content_type='application/json', safe=False)
+    if spec.all and pagination.requested(spec):
+        engine = columnar.engine()
+        if engine is not None:
+            return list_page(request, None, engine.top_chemicals(spec), 'chemical__name')
+        return list_page(request, top_chemicals_source(spec), top_chemicals_queryset(request), 'chemical__name')
+    if spec.all and columnar.engine() is None:
+        return encoding.stream(request, top_chemicals_queryset(request))
+    return encoding.respond(request, top_chemicals_data(request))
 
 
 ''' Returns top 10 chemicals released in a location by year.'''
 
 
-def timeline_top_chemicals(request):
-    state = request.GET.get('state')
+def timeline_top_chemicals_data(request):
+    return timelines.top_over_time(filtered_releases(request.spec), 'chemical', timeline_limit(request.spec))
 
-    if state is None:
-        return HttpResponseBadRequest()
-    chemicals = list(release.objects.filter(geo_filter(request) & filter_releases(request)).values_list(
-        'chemical__id', flat=True).annotate(total=Sum('total')).order_by('-total'))[:10]
-    response = release.objects.filter(geo_filter(request) & filter_releases(request) & Q(chemical__id__in=chemicals)).values(
-        'year', 'chemical__name').order_by('chemical__name', 'year').annotate(total=Sum('total'))
 
-    return HttpResponse(json.dumps(list(response), cls=DjangoJSONEncoder), content_type='application/json')
+@cacheable(*geo_params, *release_params, 'limit')
+def timeline_top_chemicals(request):
+    if request.spec.state is None:
+        return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_top_chemicals_data(request))
 
 
 ''' Returns timeline data for PBT chemicals.'''
 
 
+def timeline_top_pbt_chemicals_data(request):
+    return timelines.top_over_time(filtered_releases(request.spec).filter(chemical__classification='PBT'),
+                                   'chemical', timeline_limit(request.spec))
+
+
+@cacheable(*geo_params, *release_params, 'limit')
 def timeline_top_pbt_chemicals(request):
-    state = request.GET.get('state')
+    if request.spec.state is None:
+        return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_top_pbt_chemicals_data(request))
+
+
+''' Returns top 10 counties releasing in a location by year.'''
 
-    if state is None:
+
+def timeline_top_county_releases_data(request):
+    return timelines.top_over_time(filtered_releases(request.spec), 'county', timeline_limit(request.spec))
+
+
+@cacheable(*geo_params, *release_params, 'limit')
+def timeline_top_county_releases(request):
+    if request.spec.state is None:
         return HttpResponseBadRequest()
+    return encoding.respond(request, timeline_top_county_releases_data(request))
+
+
+''' Rows of one page of a comparison between two years, largest absolute change first: the groups of 'spec.by'
+with their sums in year_a and year_b (of the release_type measure, or the total), the change and the percent
+change (None when nothing was released in year_a). Both sums come from one grouped pass over the two years.'''
+
+
+def compare_data(spec, offset, limit):
+    keys, labels = timelines.DIMENSIONS[spec.by]
+    fields = list(dict.fromkeys(keys + labels))
+    measure = spec.release_type or 'total'
+    queryset = timelines.values(filtered_releases(spec).filter(Q(year__in=(spec.year_a, spec.year_b)), **{
+        key + '__isnull': False for key in keys}).order_by(), fields).annotate(
+        total_a=Sum(measure, filter=Q(year=spec.year_a)), total_b=Sum(measure, filter=Q(year=spec.year_b))).annotate(
+        change=ExpressionWrapper(Coalesce('total_b', Value(0.0)) - Coalesce('total_a', Value(0.0)),
+                                 output_field=FloatField())).order_by(Abs('change').desc(), *fields)
 
-    chemicals = list(release.objects.filter(geo_filter(request) & filter_releases(request) & Q(chemical__classification='PBT')).values_list(
-        'chemical__id', flat=True).annotate(total=Sum('total')).order_by('-total'))[:10]
-    response = release.objects.filter(geo_filter(request) & filter_releases(request) & Q(chemical__id__in=chemicals)).values(
-        'year', 'chemical__name').order_by('chemical__name', 'year').annotate(total=Sum('total'))
+    rows = list(queryset[offset:offset + limit + 1])
+    for row in rows:
+        row['percent_change'] = row['change'] / row['total_a'] * 100 if row['total_a'] else None
+    return rows
+
+
+@cacheable(*geo_params, *release_params, 'year_a', 'year_b', 'by', 'limit', 'offset', defaults=compare_default)
+def location_compare(request):
+    spec = request.spec
+    if spec.state is None or spec.by not in timelines.DIMENSIONS:
+        return HttpResponseBadRequest()
+    offset = max(0, spec.offset or 0)
+    limit = max(1, min(compare_page_size if spec.limit is None else spec.limit, timelines.MAX_LIMIT))
+
+    rows = compare_data(spec, offset, limit)
+    return encoding.respond(request, {'year_a': spec.year_a, 'year_b': spec.year_b, 'by': spec.by,
+                                      'offset': offset, 'limit': limit,
+                                      'next_offset': offset + limit if len(rows) > limit else None,
+                                      'results': rows[:limit]})
+
+
+''' Panels of the location dashboard: name -> function computing the data of the matching endpoint.'''
+dashboard_panels = {
+    'summary': location_summary_data,
+    'top_chemicals': top_chemicals_data,
+    'facility_releases': top_facility_releases_data,
+    'parent_releases': top_parentco_releases_data,
+    'timeline_total': timeline_total_data,
+    'timeline_top_chemicals': timeline_top_chemicals_data,
+    'timeline_top_pbt_chemicals': timeline_top_pbt_chemicals_data,
+    'timeline_facility_releases': timeline_top_facility_releases_data,
+    'timeline_parent_releases': timeline_top_parentco_releases_data,
+    'timeline_county_releases': timeline_top_county_releases_data,
+}
+
+
+''' Returns the requested dashboard panels (comma separated 'panels', all by default) for one filter set.'''
+
+
+@cacheable(*geo_params, *release_params, 'all', 'year', 'limit', 'panels', defaults=year_default)
+async def location_dashboard(request):
+    spec = request.spec
+    if spec.state is None:
+        return HttpResponseBadRequest()
+
+    names = set(dashboard_panels) if spec.panels is None else set(spec.panels)
+    if not names or not names.issubset(dashboard_panels):
+        return HttpResponseBadRequest()
 
-    return HttpResponse(json.dumps(list(response), cls=DjangoJSONEncoder), content_type='application/json')
+    # the panels are independent queries over the same filters, run them side by side
+    results = await concurrency.gather(request, {name: partial(dashboard_panels[name], request)
+                                                 for name in dashboard_panels if name in names})
+    return encoding.respond(request, results)
 
 
 ''' Root page for backend'''
@@ -0,0 +1,175 @@
+# Response cache warm-up
+# After a deploy or a data reload the response cache is cold and the first visitor of every state pays for all the
+# queries of its dashboard. warm() renders the stats endpoints of every state at the latest year with the default
+# filter combinations (none, carcinogen, pbt, each release_type) and stores the responses as
+# ResponseCacheMiddleware would. 'manage.py warm_cache' runs it once, into the shared cache or through a running
+# server (--base-url); with CACHE_WARM_INTERVAL set, each server process also keeps its own cache warm from a
+# background thread that warms again whenever the dataset version changes.
+import asyncio
+import base64
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection, close_old_connections
+from django.test import RequestFactory
+from django.urls import get_resolver
+from viewModule.models import Facility as facility
+from viewModule import cache, concurrency, dataset, filters
+
+logger = logging.getLogger(__name__)
+
+# filter combinations warmed for every state, restricted to the parameters each endpoint reads
+COMBINATIONS = [{}, {'carcinogen': 'true'}, {'pbt': 'true'}] + [
+    {'release_type': release_type} for release_type in filters.RELEASE_TYPES]
+
+# outcomes of a warm-up request
+WARMED, CACHED, SKIPPED, FAILED = 'warmed', 'cached', 'skipped', 'failed'
+
+_refresher = None
+
+
+def stats_routes():
+    """Returns (path, view) of the cacheable stats endpoints that take a state and no path argument."""
+    routes = []
+    for pattern in get_resolver().url_patterns:
+        path = '/' + str(pattern.pattern)
+        params = getattr(getattr(pattern, 'callback', None), 'cache_params', ())
+        if path.startswith('/stats/') and 'state' in params and not pattern.pattern.converters:
+            routes.append((path, pattern.callback))
+    return routes
+
+
+def targets(states=None, year=None):
+    """Returns the (path, view, params) to warm: every stats route, state and filter combination it reads."""
+    if states is None:
+        states = list(facility.objects.exclude(state=None).order_by('state').values_list(
+            'state', flat=True).distinct())
+    factory = RequestFactory()
+    result, seen = [], set()
+    for path, view in stats_routes():
+        for state in states:
+            for combination in COMBINATIONS:
+                params = {'state': state, **combination}
+                if year is not None:
+                    params['year'] = year
+                params = {name: value for name, value in params.items() if name in view.cache_params}
+                # combinations the endpoint doesn't read collapse into the same response
+                spec = filters.compile_request(factory.get(path, params), view.cache_params, view.cache_defaults)
+                if (path, spec) not in seen:
+                    seen.add((path, spec))
+                    result.append((path, view, params))
+    return result
+
+
+def render(path, view, params, db_slots):
+    """Runs the view in-process and stores a successful response in the response cache."""
+    backend = cache.backend()
+    request = RequestFactory().get(path, params)
+    key = cache.cache_key(request, cache.request_spec(request, view.cache_params, view.cache_defaults))
+    if backend.get(key) is not None:
+        return CACHED
+
+    with db_slots:
+        response = async_to_sync(view)(request) if asyncio.iscoroutinefunction(view) else view(request)
+        if response.status_code != 200:
+            return SKIPPED
+        # a streamed body reads its rows from the database while it is joined
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+    cache.store(backend, key, response['Content-Type'], body)
+    return WARMED
+
+
+def fetch(base_url, path, params, db_slots):
+    """Requests the endpoint from a running server, which caches the response itself."""
+    url = base_url.rstrip('/') + path + '?' + urllib.parse.urlencode(params)
+    key = os.environ.get('API_KEY')
+    headers = {} if key is None else {'Authorization': base64.b64encode(key.encode()).decode()}
+    with db_slots:
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                response.read()
+                return CACHED if response.headers.get('X-Cache') == 'HIT' else WARMED
+        except urllib.error.HTTPError:
+            return SKIPPED
+
+
+def _run(job, base_url, db_slots):
+    path, view, params = job
+    close_old_connections()
+    try:
+        if base_url is not None:
+            return fetch(base_url, path, params, db_slots)
+        return render(path, view, params, db_slots)
+    except Exception:
+        logger.exception('Warming %s %s failed', path, params)
+        return FAILED
+    finally:
+        close_old_connections()
+
+
+def warm(jobs, workers=4, db_limit=2, base_url=None):
+    """Warms the (path, view, params) of 'jobs' and returns the coverage report: outcome counts overall and per
+    route, the share of the targets now cached and the duration. At most 'db_limit' of the 'workers' query the
+    database at a time, the others serialize and compress."""
+    started = time.perf_counter()
+    db_slots = threading.BoundedSemaphore(max(1, db_limit))
+    # other connections can't see the rows of an open transaction (tests), so stay on this one
+    if workers <= 1 or connection.in_atomic_block:
+        outcomes = [_run(job, base_url, db_slots) for job in jobs]
+    else:
+        # pool threads run the nested queries of a view themselves instead of fanning out to the query pool,
+        # so each worker holds a single connection
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=concurrency.THREAD_PREFIX + '-warm') as pool:
+            outcomes = list(pool.map(lambda job: _run(job, base_url, db_slots), jobs))
+
+    report = {'targets': len(jobs), **dict.fromkeys((WARMED, CACHED, SKIPPED, FAILED), 0), 'routes': {}}
+    for (path, _, _), outcome in zip(jobs, outcomes):
+        report[outcome] += 1
+        route = report['routes'].setdefault(path, dict.fromkeys((WARMED, CACHED, SKIPPED, FAILED), 0))
+        route[outcome] += 1
+    report['coverage'] = round(100 * (report[WARMED] + report[CACHED]) / len(jobs), 1) if jobs else 100.0
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+class Refresher(threading.Thread):
+    """Warms this process's response cache whenever the dataset version changes, checked every 'interval' s."""
+
+    def __init__(self, interval):
+        super().__init__(name='vet-cache-warm', daemon=True)
+        self.interval = interval
+        self.version = None
+
+    def run(self):
+        while True:
+            try:
+                version = dataset.current_version()
+                if version != self.version:
+                    report = warm(targets(), getattr(settings, 'CACHE_WARM_WORKERS', 2),
+                                  getattr(settings, 'CACHE_WARM_DB_LIMIT', 2))
+                    self.version = version
+                    logger.info('Warmed the response cache of dataset version %s: %s of %s responses (%s%%) in %s s',
+                                version, report[WARMED], report['targets'], report['coverage'], report['seconds'])
+            except Exception:
+                logger.exception('Warming the response cache failed')
+            finally:
+                close_old_connections()
+            time.sleep(self.interval)
+
+
+def start_refresher():
+    """Starts the background refresher of this process when CACHE_WARM_INTERVAL is set and a cache is enabled."""
+    global _refresher
+    interval = getattr(settings, 'CACHE_WARM_INTERVAL', 0)
+    if interval <= 0 or cache.backend() is None or _refresher is not None:
+        return None
+    _refresher = Refresher(interval)
+    _refresher.start()
+    return _refresher